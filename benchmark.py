@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+ローカルスタブに対する出勤・退勤処理の所要時間の測定
+
+stub_portal.py のスタブを起動し、SalesforceAutoCheckInOut.execute("出勤", ...) と
+execute("退勤", ...) をヘッドレスのブラウザで実行して、段階ごとの所要時間を測定する。
+結果はコミットごとに比較できるよう benchmarks/results.jsonl に追記する。
+ネットワークには接続しない（ドライバーは cache/drivers.json か PATH から解決される）。
+
+使用方法:
+    python benchmark.py [--runs 5] [--browser chrome] [--backend cdp] [--profile] [--login-delay-ms 500 --dom-nodes 3000 ...]
+    python benchmark.py --report
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from stub_portal import (
+    LOGIN_HOST,
+    STUB_PASSWORD,
+    STUB_USERNAME,
+    add_option_arguments,
+    options_from_arguments,
+    start_stub_portal,
+)
+
+BASE_DIR = Path(__file__).resolve().parent
+RESULTS_PATH = BASE_DIR / "benchmarks" / "results.jsonl"
+
+# 所要時間を測定する SalesforceAutoCheckInOut のメソッド（段階）
+PHASES = [
+    "setup_driver",
+    "login",
+    "wait_for_lightning_ready",
+    "_click_location_tab",
+    "read_punch_state",
+    "_find_button_in_frames",
+    "_click_button",
+    "_confirm_punch",
+    "take_screenshot",
+    "close",
+]
+
+
+def git_commit():
+    """現在のコミット（未コミットの変更がある場合は末尾に "-dirty"）"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if status else commit
+
+
+def instrument(automation, phases):
+    """各段階のメソッドを所要時間の記録つきのものに置き換える
+
+    同じ段階が複数回呼ばれた場合は合計する（入れ子の段階は親の時間にも含まれる）。
+    """
+    for name in PHASES:
+        method = getattr(automation, name)
+
+        def timed(*args, _name=name, _method=method, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                phases[_name] = phases.get(_name, 0.0) + time.perf_counter() - start
+
+        setattr(automation, name, timed)
+
+
+def run_once(server, args, action, work_location):
+    """1回分の出勤または退勤を実行して結果を返す"""
+    from main import SalesforceAutoCheckInOut
+
+    overrides = {
+        "salesforce_url": f"http://{LOGIN_HOST}:{server.server_address[1]}/",
+        "username": STUB_USERNAME,
+        "password": STUB_PASSWORD,
+        "browser": args.browser,
+        "headless": True,
+        "auto_close": True,
+        "session_cache": {"enabled": args.session_cache},
+        "lean_mode": {"enabled": args.lean},
+        "driver_backend": args.backend,
+        "profiler": {"enabled": args.profile},
+        "http_punch": {"enabled": False},
+        "screenshot_prefix": "benchmark",
+    }
+    automation = SalesforceAutoCheckInOut(str(args.config), overrides)
+    phases = {}
+    instrument(automation, phases)
+
+    punches = len(server.portal.punches)
+    start = time.perf_counter()
+    success = automation.execute(action, work_location)
+    total = time.perf_counter() - start
+
+    recorded = server.portal.punches[punches:]
+    return {
+        "action": action,
+        "success": bool(success),
+        "punched": recorded == [{"action": action, "work_location": work_location}],
+        "total": round(total, 3),
+        "phases": {name: round(seconds, 3) for name, seconds in phases.items()},
+    }
+
+
+def run_benchmark(args):
+    """スタブを起動して測定し、結果を追記する"""
+    options = options_from_arguments(args)
+    server = start_stub_portal(options=options)
+    commit = git_commit()
+    results = []
+    try:
+        for run in range(1, args.runs + 1):
+            server.portal.reset()
+            for action in ("出勤", "退勤"):
+                result = run_once(server, args, action, args.work_location)
+                result.update(
+                    {
+                        "timestamp": datetime.now().isoformat(timespec="seconds"),
+                        "commit": commit,
+                        "run": run,
+                        "browser": args.browser,
+                        "session_cache": args.session_cache,
+                        "lean": args.lean,
+                        "backend": args.backend,
+                        "stub": options,
+                    }
+                )
+                results.append(result)
+                print(
+                    f"{'✓' if result['success'] and result['punched'] else '✗'} "
+                    f"{run}回目 {action}: {result['total']:.2f}秒"
+                )
+    finally:
+        server.shutdown()
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    print_summary(results)
+    return all(result["success"] and result["punched"] for result in results)
+
+
+def print_summary(results):
+    """段階ごとの所要時間の中央値・最小値・最大値を表示"""
+    for action in ("出勤", "退勤"):
+        rows = [r for r in results if r["action"] == action]
+        if not rows:
+            continue
+        print(f"\n===== {action}（{len(rows)}回） =====")
+        print(f"  {'段階':<28} {'中央値':>8} {'最小':>8} {'最大':>8}")
+        for name in ["total"] + PHASES:
+            values = [r["total"] if name == "total" else r["phases"].get(name) for r in rows]
+            values = [v for v in values if v is not None]
+            if values:
+                print(
+                    f"  {name:<28} {statistics.median(values):8.3f} "
+                    f"{min(values):8.3f} {max(values):8.3f}"
+                )
+
+
+def print_report(path):
+    """記録した結果をコミットごとに比較（合計と各段階の中央値）"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        print(f"結果がありません: {path}")
+        return False
+
+    groups = {}
+    for result in results:
+        key = (
+            result.get("commit"),
+            result.get("backend", "selenium"),
+            result["action"],
+            json.dumps(result.get("stub"), sort_keys=True),
+        )
+        groups.setdefault(key, []).append(result)
+
+    for (commit, backend, action, stub), rows in groups.items():
+        medians = {
+            name: statistics.median(values)
+            for name in PHASES
+            if (values := [r["phases"][name] for r in rows if name in r["phases"]])
+        }
+        failed = sum(1 for r in rows if not (r["success"] and r["punched"]))
+        print(
+            f"{commit or '不明'} [{backend}] {action} {len(rows)}回"
+            f"{f'（失敗 {failed}回）' if failed else ''}: "
+            f"合計 {statistics.median(r['total'] for r in rows):.3f}秒"
+        )
+        print("    " + ", ".join(f"{name} {seconds:.3f}" for name, seconds in medians.items()))
+        print(f"    スタブ: {stub}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルスタブに対する出勤・退勤処理の所要時間の測定")
+    parser.add_argument("--runs", type=int, default=3, help="出勤・退勤の組を実行する回数")
+    parser.add_argument("--browser", default="chrome", choices=["chrome", "edge", "firefox"])
+    parser.add_argument("--work-location", default="自宅")
+    parser.add_argument(
+        "--session-cache", action="store_true",
+        help="保存したセッションを使う（2回目以降はログインフォームを省略）",
+    )
+    parser.add_argument("--lean", action="store_true", help="軽量モード（lean_mode）で実行")
+    parser.add_argument(
+        "--backend", default="selenium", choices=["selenium", "cdp"],
+        help="ボタンの探索とクリックに使うバックエンド（driver_backend）",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="WebDriverのコマンドごとの所要時間を記録（logs/webdriver_profile_*.json）",
+    )
+    parser.add_argument(
+        "--config", type=Path, default=BASE_DIR / "config.json.sample",
+        help="ボタンや探索戦略などの設定に使う設定ファイル",
+    )
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH)
+    parser.add_argument("--report", action="store_true", help="記録した結果をコミットごとに表示")
+    add_option_arguments(parser)
+    args = parser.parse_args()
+
+    if args.report:
+        return print_report(args.output)
+    return run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
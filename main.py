@@ -4,63 +4,2829 @@
 Salesforce 自動出勤・退勤システム
 """
 
-import json
 import sys
 import time
-import logging
-from datetime import datetime
-from pathlib import Path
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
-
-# WebDriver Manager（自動ドライバーダウンロード）
-try:
-    from webdriver_manager.chrome import ChromeDriverManager
-    from webdriver_manager.microsoft import EdgeChromiumDriverManager
-    from webdriver_manager.firefox import GeckoDriverManager
-    from selenium.webdriver.chrome.service import Service as ChromeService
-    from selenium.webdriver.edge.service import Service as EdgeService
-    from selenium.webdriver.firefox.service import Service as FirefoxService
-
-    WEBDRIVER_MANAGER_AVAILABLE = True
-except ImportError:
-    WEBDRIVER_MANAGER_AVAILABLE = False
+
+# 起動プロファイル（--startup-profile）の計測開始時点
+_MODULE_LOAD_START = time.perf_counter()
+_MODULE_COUNT_START = len(sys.modules)
+
+import atexit  # noqa: E402
+import csv  # noqa: E402
+import ctypes  # noqa: E402
+import fnmatch  # noqa: E402
+import functools  # noqa: E402
+import hashlib  # noqa: E402
+import http.client  # noqa: E402
+import importlib.util  # noqa: E402
+import json  # noqa: E402
+import multiprocessing  # noqa: E402
+import re  # noqa: E402
+import secrets  # noqa: E402
+import shutil  # noqa: E402
+import socket  # noqa: E402
+import socketserver  # noqa: E402
+import subprocess  # noqa: E402
+import threading  # noqa: E402
+import logging  # noqa: E402
+from contextlib import contextmanager  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from html.parser import HTMLParser  # noqa: E402
+from http.cookies import SimpleCookie  # noqa: E402
+from pathlib import Path  # noqa: E402
+from urllib.parse import urljoin, urlparse  # noqa: E402
+
+# Seleniumは起動時間短縮のため、SalesforceAutoCheckInOut の初期化時に読み込む
+# （使用方法の表示や引数エラーの場合は読み込まない）。_load_selenium を参照
+webdriver = None
+By = None
+WebDriverWait = None
+EC = None
+TimeoutException = None
+NoSuchElementException = None
+WebDriverException = None
 
 # ベースディレクトリを取得（exe実行時も対応）
-import os as _os
+import os as _os  # noqa: E402
 
 if getattr(sys, "frozen", False):
     _base_dir = Path(_os.path.dirname(sys.executable))
 else:
     _base_dir = Path(_os.path.dirname(_os.path.abspath(__file__)))
 
-# ログ設定
-log_dir = _base_dir / "logs"
-log_dir.mkdir(exist_ok=True)
-log_file = log_dir / f"auto_checkinout_{datetime.now().strftime('%Y%m%d')}.log"
+logger = logging.getLogger(__name__)
+
+# 起動プロファイル: (段階, 秒, 読み込んだモジュール数)
+_STARTUP_TIMINGS = []
+_startup_profile_enabled = False
+_logging_pid = None
+_log_listener = None
+_log_file_handler = None
+
+# ログファイルの既定の上限（config.json の logging で変更可能）
+_LOG_DEFAULTS = {
+    "max_bytes": 10 * 1024 * 1024,
+    "retention_days": 30,
+    "max_total_mb": 200,
+}
+
+
+@contextmanager
+def _file_lock(path):
+    """プロセス間で共有するファイルロック（ログの書き込みとローテーションの排他）"""
+    with open(path, "a+b") as f:
+        if sys.platform == "win32":
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK は約10秒で諦めるため、取得できるまで繰り返す
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedLogFileHandler(logging.Handler):
+    """複数プロセスから同じ日付のログファイルに追記するハンドラー
+
+    QueueListener のスレッドから呼ばれ、キューが空になるまで（または一定件数ごとに）
+    まとめてファイルロックを取得して書き込む。ファイルが max_bytes を超えたら
+    auto_checkinout_YYYYMMDD.N.log.gz に圧縮してローテーションし、前日以前のログも圧縮する。
+    retention_days より古いファイルと、合計が max_total_mb を超えた分の古いファイルは削除する。
+    """
+
+    def __init__(self, log_dir, log_queue):
+        super().__init__()
+        self.log_dir = Path(log_dir)
+        self.log_queue = log_queue
+        self.settings = dict(_LOG_DEFAULTS)
+        self.buffer = []
+        self.cleaned_on = None
+
+    def configure(self, settings):
+        """上限を設定（config.json の logging）"""
+        self.settings.update({k: v for k, v in settings.items() if k in _LOG_DEFAULTS})
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+            return
+        if self.log_queue.empty() or len(self.buffer) >= 200:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data, self.buffer = "".join(self.buffer), []
+        today = datetime.now().strftime("%Y%m%d")
+        path = self.log_dir / f"auto_checkinout_{today}.log"
+        try:
+            self.log_dir.mkdir(exist_ok=True)
+            with _file_lock(self.log_dir / ".auto_checkinout.lock"):
+                if self.cleaned_on != today:
+                    self.cleaned_on = today
+                    self._clean_up(today)
+                encoded = data.encode("utf-8")
+                if path.exists() and path.stat().st_size + len(encoded) > int(self.settings["max_bytes"]):
+                    self._compress(path, today)
+                with open(path, "ab") as f:
+                    f.write(encoded)
+        except OSError:
+            sys.stderr.write(data)
+
+    def _compress(self, path, date):
+        """ログファイルを auto_checkinout_YYYYMMDD.N.log.gz に圧縮して削除"""
+        import gzip
+
+        index = 1
+        while (self.log_dir / f"auto_checkinout_{date}.{index}.log.gz").exists():
+            index += 1
+        target = self.log_dir / f"auto_checkinout_{date}.{index}.log.gz"
+        with open(path, "rb") as source, gzip.open(target, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        # 保存期間の判定に使うため、更新日時は元のファイルに合わせる
+        stat = path.stat()
+        _os.utime(target, (stat.st_atime, stat.st_mtime))
+        path.unlink()
+
+    def _clean_up(self, today):
+        """前日以前のログを圧縮し、保存期間と合計サイズの上限を超えたファイルを削除"""
+        for path in self.log_dir.glob("auto_checkinout_*.log"):
+            date = path.stem.split("_")[-1]
+            if date.isdigit() and date < today:
+                self._compress(path, date)
+
+        files = [
+            path
+            for pattern in ("auto_checkinout_*.log.gz", "spans_*.jsonl")
+            for path in self.log_dir.glob(pattern)
+        ]
+        files.sort(key=lambda path: path.stat().st_mtime)
+        cutoff = time.time() - float(self.settings["retention_days"]) * 86400
+        total = sum(path.stat().st_size for path in files)
+        limit = float(self.settings["max_total_mb"]) * 1024 * 1024
+        for path in files:
+            if path.stat().st_mtime >= cutoff and total <= limit:
+                break
+            if path.name == f"spans_{today}.jsonl":
+                continue
+            total -= path.stat().st_size
+            path.unlink()
+
+
+def setup_logging():
+    """ログ出力を設定（同じプロセスでの2回目以降の呼び出しは何もしない）
+
+    ログはキューに入れるだけにし、ファイルとコンソールへの出力は
+    QueueListener のスレッドで行う（打刻処理がディスクの書き込みで待たされないように）。
+    """
+    global _logging_pid, _log_listener, _log_file_handler
+    if _logging_pid == _os.getpid():
+        return
+    _logging_pid = _os.getpid()
+
+    with _startup_stage("ログ設定"):
+        import logging.handlers
+        import queue
+
+        log_queue = queue.SimpleQueue()
+        formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+        _log_file_handler = SharedLogFileHandler(_base_dir / "logs", log_queue)
+        console_handler = logging.StreamHandler()
+        for handler in (_log_file_handler, console_handler):
+            handler.setFormatter(formatter)
+
+        root = logging.getLogger()
+        # fork で起動したワーカープロセスでは親のハンドラーを引き継ぐため置き換える
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(logging.INFO)
+
+        _log_listener = logging.handlers.QueueListener(
+            log_queue, _log_file_handler, console_handler
+        )
+        _log_listener.start()
+        atexit.register(flush_logging, restart=False)
+
+
+def configure_logging(settings):
+    """ログファイルのローテーションと保存期間を設定（config.json の logging）"""
+    if _log_file_handler is not None:
+        _log_file_handler.configure(settings or {})
+
+
+def flush_logging(restart=True):
+    """キューに残っているログをすべて書き込む（終了前やワーカープロセスの処理後に呼ぶ）
+
+    Args:
+        restart: 書き込み後に QueueListener を再開する場合True（終了時はFalse）
+    """
+    if _log_listener is None or _logging_pid != _os.getpid():
+        return
+    _log_listener.stop()
+    _log_file_handler.flush()
+    if restart:
+        _log_listener.start()
+
+
+def _load_selenium():
+    """Seleniumの共通モジュールを読み込む（ブラウザごとのモジュールは各 _setup_* で読み込む）"""
+    global webdriver, By, WebDriverWait, EC, TimeoutException, NoSuchElementException, WebDriverException
+    if webdriver is not None:
+        return
+
+    with _startup_stage("Selenium"):
+        from selenium import webdriver as _webdriver
+        from selenium.webdriver.common.by import By as _By
+        from selenium.webdriver.support.ui import WebDriverWait as _WebDriverWait
+        from selenium.webdriver.support import expected_conditions as _EC
+        from selenium.common.exceptions import (
+            TimeoutException as _TimeoutException,
+            NoSuchElementException as _NoSuchElementException,
+            WebDriverException as _WebDriverException,
+        )
+
+    webdriver = _webdriver
+    By = _By
+    WebDriverWait = _WebDriverWait
+    EC = _EC
+    TimeoutException = _TimeoutException
+    NoSuchElementException = _NoSuchElementException
+    WebDriverException = _WebDriverException
+
+
+def _driver_manager(browser):
+    """ブラウザに対応するwebdriver_managerのクラスを読み込む（未インストールの場合はNone）"""
+    try:
+        with _startup_stage(f"webdriver_manager ({browser})"):
+            if browser == "chrome":
+                from webdriver_manager.chrome import ChromeDriverManager as manager
+            elif browser == "edge":
+                from webdriver_manager.microsoft import (
+                    EdgeChromiumDriverManager as manager,
+                )
+            else:
+                from webdriver_manager.firefox import GeckoDriverManager as manager
+    except ImportError:
+        return None
+    return manager
+
+
+@contextmanager
+def _startup_stage(label):
+    """起動プロファイルの1段階を計測"""
+    start = time.perf_counter()
+    modules = len(sys.modules)
+    try:
+        yield
+    finally:
+        _STARTUP_TIMINGS.append(
+            (label, time.perf_counter() - start, len(sys.modules) - modules)
+        )
+
+
+def print_startup_profile():
+    """起動プロファイル（段階ごとの所要時間と読み込んだモジュール数）を表示"""
+    global _startup_profile_enabled
+    if not _startup_profile_enabled:
+        return
+    _startup_profile_enabled = False
+    total = time.perf_counter() - _MODULE_LOAD_START
+    print("\n===== 起動プロファイル =====")
+    for label, seconds, modules in _STARTUP_TIMINGS:
+        print(f"  {label:<32} {seconds * 1000:9.1f} ms  （モジュール +{modules}）")
+    print(f"  {'main.py 読み込み開始からの合計':<28} {total * 1000:9.1f} ms")
+
+
+# 出勤・退勤ボタンのID（TeamSpirit）
+_BUTTON_IDS = {"出勤": "btnStInput", "退勤": "btnEtInput"}
+
+# ドキュメント内のiframeを、openなShadow Root内も含めて文書順に列挙する関数
+_DEEP_FRAMES_FN = """
+function deepRoots(doc) {
+    const roots = [doc];
+    for (let i = 0; i < roots.length; i++) {
+        for (const el of roots[i].querySelectorAll('*')) {
+            if (el.shadowRoot) roots.push(el.shadowRoot);
+        }
+    }
+    return roots;
+}
+function deepFrames(doc) {
+    const frames = [];
+    for (const root of deepRoots(doc)) {
+        frames.push(...root.querySelectorAll('iframe, frame'));
+    }
+    return frames;
+}
+"""
+
+# deepFrames(document) の index 番目のiframeを取得
+_FRAME_AT_JS = _DEEP_FRAMES_FN + """
+return deepFrames(document)[arguments[0]] || null;
+"""
+
+# 出勤・退勤ボタンを1回のexecute_scriptで探索する
+#   arguments: targetIds, targetValues, css（設定のセレクター）, xpath（同）
+#   発見時: {found: true, element, path, id, value, disabled}
+#     path が空でない場合、ボタンは同一オリジンのiframe内にある（elementはnull）
+#   未発見時: {found: false, opaque: [{path, name}]}
+#     opaque は中身を参照できないクロスオリジンのiframe（Visualforceを優先）
+_DEEP_LOCATOR_JS = _DEEP_FRAMES_FN + """
+const targetIds = arguments[0];
+const targetValues = arguments[1];
+const css = arguments[2];
+const xpath = arguments[3];
+const opaque = [];
+
+function matches(el) {
+    if (css && el.matches(css)) return true;
+    if (el.tagName !== 'INPUT' && el.tagName !== 'BUTTON') return false;
+    if (targetIds.includes(el.id) || targetValues.includes(el.value)) return true;
+    return el.tagName === 'BUTTON' && targetValues.includes(el.textContent.trim());
+}
+
+function findIn(doc, path) {
+    if (xpath) {
+        try {
+            const hit = doc.evaluate(xpath, doc, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+            if (hit) return {el: hit, path: path};
+        } catch (e) {}
+    }
+    const query = 'input, button' + (css ? ', ' + css : '');
+    for (const root of deepRoots(doc)) {
+        for (const el of root.querySelectorAll(query)) {
+            if (matches(el)) return {el: el, path: path};
+        }
+    }
+    const frames = deepFrames(doc);
+    for (let i = 0; i < frames.length; i++) {
+        let child = null;
+        try { child = frames[i].contentDocument; } catch (e) {}
+        if (child) {
+            const hit = findIn(child, path.concat([i]));
+            if (hit) return hit;
+        } else {
+            opaque.push({path: path.concat([i]), name: frames[i].name || ''});
+        }
+    }
+    return null;
+}
+
+const hit = findIn(document, []);
+if (!hit) {
+    opaque.sort((a, b) => (b.name.startsWith('vfFrameId') ? 1 : 0) - (a.name.startsWith('vfFrameId') ? 1 : 0));
+    return {found: false, opaque: opaque};
+}
+return {
+    found: true,
+    element: hit.path.length === 0 ? hit.el : null,
+    path: hit.path,
+    id: hit.el.id || null,
+    value: hit.el.value === undefined ? null : hit.el.value,
+    disabled: Boolean(hit.el.disabled) || hit.el.hasAttribute('disabled'),
+};
+"""
+
+# ">>>" で区切ったCSSセレクターを、Shadow Rootを貫通しながら順に適用
+_PIERCING_QUERY_JS = """
+let node = document;
+for (const part of arguments[0].split('>>>')) {
+    node = (node.shadowRoot || node).querySelector(part.trim());
+    if (!node) return null;
+}
+return node;
+"""
+
+# 現在のフレームで、probe() が値を返すまでDOMの変更を監視して待機する関数
+#   document と openなShadow Root をMutationObserverで監視し、変更のたびに probe() を確認する。
+#   値には待機時間 waited_ms を追加して done に渡す。timeoutMs 経過した場合は null。
+#   監視できない変更（closedなShadow Rootなど）に備えて500msごとにも確認する。
+_DOM_WAIT_FN = """
+function waitFor(probe, timeoutMs, done) {
+    const start = Date.now();
+    const observed = new Set();
+    let finished = false;
+    let observer = null;
+    let timer = null;
+    let backstop = null;
+    function finish(value) {
+        if (finished) return;
+        finished = true;
+        if (observer) observer.disconnect();
+        clearTimeout(timer);
+        clearInterval(backstop);
+        done(value);
+    }
+    function check() {
+        if (finished) return;
+        for (const root of deepRoots(document)) {
+            if (observed.has(root)) continue;
+            observed.add(root);
+            observer.observe(root, {childList: true, subtree: true, attributes: true, characterData: true});
+        }
+        const value = probe();
+        if (value) {
+            value.waited_ms = Date.now() - start;
+            finish(value);
+        }
+    }
+    observer = new MutationObserver(check);
+    timer = setTimeout(() => finish(null), timeoutMs);
+    backstop = setInterval(check, 500);
+    check();
+}
+"""
+
+# 現在のフレーム内で、CSS（Shadow Root内も対象）またはXPathに一致する要素が現れるまで待機
+#   arguments: css, xpath, timeoutMs（execute_async_script で実行）
+_SELECTOR_WAIT_JS = _DEEP_FRAMES_FN + _DOM_WAIT_FN + """
+const css = arguments[0];
+const xpath = arguments[1];
+const done = arguments[arguments.length - 1];
+waitFor(() => {
+    let el = null;
+    if (xpath) {
+        try {
+            el = document.evaluate(xpath, document, null,
+                XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        } catch (e) {}
+    }
+    if (!el && css) {
+        for (const root of deepRoots(document)) {
+            el = root.querySelector(css);
+            if (el) break;
+        }
+    }
+    if (!el) return null;
+    return {
+        element: el,
+        id: el.id || null,
+        value: el.value === undefined ? null : el.value,
+        disabled: Boolean(el.disabled) || el.hasAttribute('disabled'),
+    };
+}, arguments[2], done);
+"""
+
+# フレームパスの1段分のiframeが現れるまで待機（arguments: step, timeoutMs）
+#   step が文字列の場合は ">>>" 区切りのCSSセレクター、数値の場合は deepFrames のインデックス
+_FRAME_WAIT_JS = _DEEP_FRAMES_FN + _DOM_WAIT_FN + """
+const step = arguments[0];
+const done = arguments[arguments.length - 1];
+waitFor(() => {
+    let node = null;
+    if (typeof step === 'number') {
+        node = deepFrames(document)[step] || null;
+    } else {
+        node = document;
+        for (const part of step.split('>>>')) {
+            node = (node.shadowRoot || node).querySelector(part.trim());
+            if (!node) break;
+        }
+    }
+    return node ? {element: node} : null;
+}, arguments[1], done);
+"""
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler(log_file, encoding="utf-8"), logging.StreamHandler()],
+# 現在のフレームでDOMが変更されるまで待機（arguments: timeoutMs）
+#   変更がない場合も、500msごとの確認の時点で待機を終える
+_DOM_CHANGE_JS = _DEEP_FRAMES_FN + _DOM_WAIT_FN + """
+const done = arguments[arguments.length - 1];
+let first = true;
+waitFor(() => {
+    if (first) {
+        first = false;
+        return null;
+    }
+    return {changed: true};
+}, arguments[0], (value) => done(Boolean(value)));
+"""
+
+# 勤務場所タブ（テキストが一致する要素）が現れるまで待機（arguments: name, timeoutMs）
+#   role="tab" の要素を優先し、次に直下のテキストが一致する要素を探す
+_LOCATION_TAB_FN = """
+function ownText(el) {
+    let text = '';
+    for (const node of el.childNodes) {
+        if (node.nodeType === Node.TEXT_NODE) text += node.textContent;
+    }
+    return text.trim();
+}
+function findLocationTab(name) {
+    for (const root of deepRoots(document)) {
+        for (const el of root.querySelectorAll('[role="tab"]')) {
+            if (el.textContent.trim() === name) return el;
+        }
+    }
+    for (const root of deepRoots(document)) {
+        for (const el of root.querySelectorAll('[class*="tab"], button, div, span')) {
+            if (ownText(el) === name) return el;
+        }
+    }
+    return null;
+}
+"""
+
+_LOCATION_TAB_WAIT_JS = _DEEP_FRAMES_FN + _LOCATION_TAB_FN + _DOM_WAIT_FN + """
+const name = arguments[0];
+const done = arguments[arguments.length - 1];
+waitFor(() => {
+    const el = findLocationTab(name);
+    return el ? {element: el} : null;
+}, arguments[1], done);
+"""
+
+# DevTools Protocol のバックエンド用: 現在のフレームで勤務場所タブを1回探す（arguments: name）
+_CDP_LOCATION_TAB_JS = _DEEP_FRAMES_FN + _LOCATION_TAB_FN + """
+return findLocationTab(arguments[0]);
+"""
+
+# DevTools Protocol のバックエンド用: 現在のフレームで出勤・退勤ボタンを1回探す
+#   arguments: targetIds, targetValues, css（設定のセレクター）, xpath（同）
+_CDP_BUTTON_JS = _DEEP_FRAMES_FN + """
+const targetIds = arguments[0];
+const targetValues = arguments[1];
+const css = arguments[2];
+const xpath = arguments[3];
+if (xpath) {
+    try {
+        const hit = document.evaluate(xpath, document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        if (hit) return hit;
+    } catch (e) {}
+}
+const query = 'input, button' + (css ? ', ' + css : '');
+for (const root of deepRoots(document)) {
+    for (const el of root.querySelectorAll(query)) {
+        if (css && el.matches(css)) return el;
+        if (el.tagName !== 'INPUT' && el.tagName !== 'BUTTON') continue;
+        if (targetIds.includes(el.id) || targetValues.includes(el.value)) return el;
+        if (el.tagName === 'BUTTON' && targetValues.includes(el.textContent.trim())) return el;
+    }
+}
+return null;
+"""
+
+# 勤務場所タブが選択状態になるまで待機（arguments: tab, timeoutMs）
+_TAB_SELECTED_JS = _DEEP_FRAMES_FN + _DOM_WAIT_FN + """
+const tab = arguments[0];
+const done = arguments[arguments.length - 1];
+waitFor(() => {
+    const selected = tab.getAttribute('aria-selected') === 'true'
+        || /(^|[\\s_-])(selected|active|on)($|[\\s_-])/i.test(tab.className || '');
+    return selected ? {selected: true} : null;
+}, arguments[1], (value) => done(Boolean(value)));
+"""
+
+# 打刻の状態を1回で読み取る（ボタンが見つかったフレームで実行）
+#   arguments: buttonIds（{"出勤": id, "退勤": id}）, timeSelectors（{start_time: css, end_time: css}）
+_PUNCH_STATE_JS = _DEEP_FRAMES_FN + """
+const buttonIds = arguments[0];
+const timeSelectors = arguments[1];
+function find(selector) {
+    for (const root of deepRoots(document)) {
+        const el = root.querySelector(selector);
+        if (el) return el;
+    }
+    return null;
+}
+function disabled(action) {
+    let el = find('[id="' + buttonIds[action] + '"]');
+    if (!el) {
+        for (const root of deepRoots(document)) {
+            el = [...root.querySelectorAll('input, button')].find(
+                (e) => (e.value || e.textContent.trim()) === action);
+            if (el) break;
+        }
+    }
+    return el ? Boolean(el.disabled) || el.hasAttribute('disabled') : null;
+}
+let location = null;
+for (const root of deepRoots(document)) {
+    const tab = [...root.querySelectorAll('[role="tab"]')].find(
+        (el) => el.getAttribute('aria-selected') === 'true'
+            || /(^|[\\s_-])(selected|active)($|[\\s_-])/i.test(el.className || ''));
+    if (tab) {
+        location = tab.textContent.trim();
+        break;
+    }
+}
+const times = {};
+for (const [key, selector] of Object.entries(timeSelectors)) {
+    const el = selector ? find(selector) : null;
+    times[key] = el && el.textContent.trim() ? el.textContent.trim() : null;
+}
+return {
+    checkin_disabled: disabled('出勤'),
+    checkout_disabled: disabled('退勤'),
+    location: location,
+    start_time: times.start_time || null,
+    end_time: times.end_time || null,
+};
+"""
+
+# クリック後、打刻が記録された証拠が現れるまで待機（ボタンが見つかったフレームで実行）
+#   arguments: buttonId, action, timeSelector, previousTime, sinceClickMs, requestPattern, settleMs, timeoutMs
+#   証拠: 打刻時刻の欄が埋まる（time_cell）、または打刻要求の応答から settleMs 経過してもボタンが
+#   無効のまま（response）。応答がエラー、または応答後にボタンが有効に戻った場合は失敗。
+#   応答を観測できないままタイムアウトした場合は、ボタンが無効なら成功（button_disabled）とする
+_PUNCH_CONFIRM_JS = _DEEP_FRAMES_FN + _DOM_WAIT_FN + """
+const buttonId = arguments[0];
+const action = arguments[1];
+const timeSelector = arguments[2];
+const previousTime = arguments[3] || '';
+const clickedAt = performance.now() - arguments[4] - 100;
+const requestPattern = new RegExp(arguments[5]);
+const settleMs = arguments[6];
+const done = arguments[arguments.length - 1];
+function find(selector) {
+    for (const root of deepRoots(document)) {
+        const el = root.querySelector(selector);
+        if (el) return el;
+    }
+    return null;
+}
+function buttonDisabled() {
+    let el = find('[id="' + buttonId + '"]');
+    if (!el) {
+        for (const root of deepRoots(document)) {
+            el = [...root.querySelectorAll('input, button')].find(
+                (e) => (e.value || e.textContent.trim()) === action);
+            if (el) break;
+        }
+    }
+    return el ? Boolean(el.disabled) || el.hasAttribute('disabled') : null;
+}
+let response = null;
+function record(entries) {
+    for (const entry of entries) {
+        if (entry.startTime >= clickedAt && entry.responseEnd > 0 && requestPattern.test(entry.name)) {
+            response = {url: entry.name, status: entry.responseStatus || null, end: entry.responseEnd};
+        }
+    }
+}
+record(performance.getEntriesByType('resource'));
+let resources = null;
+if (window.PerformanceObserver) {
+    resources = new PerformanceObserver((list) => record(list.getEntries()));
+    resources.observe({type: 'resource'});
+}
+waitFor(() => {
+    const cell = timeSelector ? find(timeSelector) : null;
+    const time = cell ? cell.textContent.trim() : '';
+    if (time && time !== previousTime) {
+        return {confirmed: true, evidence: 'time_cell', time: time};
+    }
+    if (!response) return null;
+    if (response.status >= 400) {
+        return {confirmed: false, reason: 'http_error', status: response.status, url: response.url};
+    }
+    if (performance.now() - response.end < settleMs) return null;
+    if (buttonDisabled()) {
+        return {confirmed: true, evidence: 'response', status: response.status, url: response.url};
+    }
+    return {confirmed: false, reason: 'rejected', url: response.url};
+}, arguments[7], (value) => {
+    if (resources) resources.disconnect();
+    if (!value) {
+        value = buttonDisabled() && !response
+            ? {confirmed: true, evidence: 'button_disabled'}
+            : {confirmed: false, reason: 'timeout'};
+    }
+    done(value);
+});
+"""
+
+# 探索戦略のデフォルト（config.json の locator_strategies で上書き可能）
+#   frames: 切り替えるiframeのセレクター（">>>" でShadow Rootを貫通）
+#   selector: フレーム内のボタンのセレクター（{button_id}, {button_value} を置換）
+#   deep: true の場合、Shadow DOM・iframeをすべて探索する
+_DEFAULT_LOCATOR_STRATEGIES = [
+    {
+        "name": "vf_iframe",
+        "frames": ["force-aloha-page >>> iframe[name^='vfFrameId']"],
+        "selector": {"type": "id", "value": "{button_id}"},
+    },
+    {
+        "name": "main_frame",
+        "frames": [],
+        "selector": {"type": "id", "value": "{button_id}"},
+    },
+    {"name": "deep_search", "deep": True},
+]
+
+# Network.setCookies に渡せるCookieの項目
+_COOKIE_PARAM_KEYS = (
+    "name",
+    "value",
+    "domain",
+    "path",
+    "secure",
+    "httpOnly",
+    "sameSite",
+    "expires",
+    "priority",
 )
-logger = logging.getLogger(__name__)
+
+# セッション復元後の状態: ログインフォームなら "rejected"、Lightningの画面なら "ok"
+_SESSION_OUTCOME_JS = """
+if (document.getElementById('username')) return 'rejected';
+if (document.querySelector('force-aloha-page')) return 'ok';
+if (location.pathname.startsWith('/lightning/') && document.readyState === 'complete') return 'ok';
+return null;
+"""
+
+# force-aloha-page のShadow Root内にあるVisualforce iframeのURLを取得
+_ALOHA_IFRAME_SRC_JS = """
+const alohaPage = document.querySelector('force-aloha-page');
+if (alohaPage && alohaPage.shadowRoot) {
+    const iframe = alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]');
+    return iframe ? iframe.src : null;
+}
+return null;
+"""
+
+# Visualforce Remotingの設定（JSON）の直前にある文字列
+_REMOTING_PROVIDER_MARKER = "$VFRM.RemotingProviderImpl("
+
+# ブラウザのバージョンを記録しているレジストリ（Windows）
+_BROWSER_VERSION_REGISTRY = {
+    "chrome": [("HKEY_CURRENT_USER", r"Software\Google\Chrome\BLBeacon", "version")],
+    "edge": [("HKEY_CURRENT_USER", r"Software\Microsoft\Edge\BLBeacon", "version")],
+    "firefox": [
+        ("HKEY_LOCAL_MACHINE", r"SOFTWARE\Mozilla\Mozilla Firefox", "CurrentVersion")
+    ],
+}
+
+# ブラウザのバージョンを取得するコマンド（Windows以外）
+_BROWSER_VERSION_COMMANDS = {
+    "chrome": [
+        "google-chrome",
+        "google-chrome-stable",
+        "chromium",
+        "chromium-browser",
+        "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome",
+    ],
+    "edge": [
+        "microsoft-edge",
+        "microsoft-edge-stable",
+        "/Applications/Microsoft Edge.app/Contents/MacOS/Microsoft Edge",
+    ],
+    "firefox": ["firefox", "/Applications/Firefox.app/Contents/MacOS/firefox"],
+}
+
+# 軽量モード（lean_mode）の既定値
+_LEAN_DEFAULTS = {
+    "page_load_strategy": "eager",
+    "window_size": [1280, 900],
+    "block_resource_types": ["Image", "Font", "Media"],
+    "block_url_patterns": [
+        "*://*.google-analytics.com/*",
+        "*://*.googletagmanager.com/*",
+        "*://*.doubleclick.net/*",
+    ],
+    # ブロック対象でも続行するURL（TeamSpiritのVisualforce iframeとRemoting、その静的リソース）
+    "allow_url_patterns": [
+        "*://*.vf.force.com/*",
+        "*://*.visual.force.com/*",
+        "*/apex/*",
+        "*/apexremote*",
+        "*teamspirit*",
+    ],
+}
+
+# 準備シグナルごとのデフォルトタイムアウト（秒）
+_READINESS_TIMEOUTS = {
+    "login_form": 20,
+    "url_change": 30,
+    "ready_state": 20,
+    "aloha_page": 20,
+    "idle": 10,
+}
+
+# force-aloha-page のShadow Root内にあるVisualforce iframeを取得
+_ALOHA_IFRAME_JS = """
+const alohaPage = document.querySelector('force-aloha-page');
+if (alohaPage && alohaPage.shadowRoot) {
+    return alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]');
+}
+return null;
+"""
+
+# ログイン画面のエラーメッセージを取得（エラーがなければnull）
+_LOGIN_ERROR_JS = """
+const error = document.getElementById('error');
+if (error && error.offsetParent !== null && error.textContent.trim()) {
+    return error.textContent.trim();
+}
+return null;
+"""
+
+# DOMの変更とリソース読み込みが quietMs の間止まるまで待機（最大 timeoutMs）
+_DOM_IDLE_JS = """
+const quietMs = arguments[0];
+const timeoutMs = arguments[1];
+const done = arguments[arguments.length - 1];
+const resources = () => performance.getEntriesByType('resource').length;
+let lastChange = Date.now();
+let lastResources = resources();
+const observer = new MutationObserver(() => { lastChange = Date.now(); });
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+const start = Date.now();
+const timer = setInterval(() => {
+    const count = resources();
+    if (count !== lastResources) {
+        lastResources = count;
+        lastChange = Date.now();
+    }
+    const now = Date.now();
+    if (now - lastChange >= quietMs || now - start >= timeoutMs) {
+        clearInterval(timer);
+        observer.disconnect();
+        done(now - lastChange >= quietMs);
+    }
+}, 50);
+"""
+
+
+class _DataBlob(ctypes.Structure):
+    """DPAPIのDATA_BLOB構造体"""
+
+    _fields_ = [
+        ("cbData", ctypes.c_uint32),
+        ("pbData", ctypes.POINTER(ctypes.c_char)),
+    ]
+
+
+def _dpapi(data, protect):
+    """Windows DPAPIでデータを暗号化・復号（ログオンユーザーのみ復号可能）"""
+    crypt32 = ctypes.windll.crypt32
+    kernel32 = ctypes.windll.kernel32
+    buffer = ctypes.create_string_buffer(data, len(data))
+    blob_in = _DataBlob(len(data), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+    blob_out = _DataBlob()
+    function = crypt32.CryptProtectData if protect else crypt32.CryptUnprotectData
+    # CRYPTPROTECT_UI_FORBIDDEN = 0x1
+    if not function(
+        ctypes.byref(blob_in), None, None, None, None, 0x1, ctypes.byref(blob_out)
+    ):
+        raise ctypes.WinError()
+    try:
+        return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+    finally:
+        kernel32.LocalFree(blob_out.pbData)
+
+
+# Windows以外でセッションの暗号化の鍵を保存するキーリングのサービス名とユーザー名
+_KEYRING_SERVICE = "salesforce-auto-checkinout"
+_KEYRING_USERNAME = "session-key"
+
+
+def _encryption_available():
+    """セッション保存用の暗号化が利用可能かどうか
+
+    WindowsはDPAPI。それ以外は cryptography と、鍵を暗号文とは別の場所に保存できる
+    OSのキーリング（keyring）が必要（鍵を暗号文と同じディレクトリには置かない）。
+    """
+    if sys.platform == "win32":
+        return True
+    if (
+        importlib.util.find_spec("cryptography") is None
+        or importlib.util.find_spec("keyring") is None
+    ):
+        return False
+    import keyring
+    from keyring.backends import fail
+
+    return not isinstance(keyring.get_keyring(), fail.Keyring)
+
+
+def _fernet(cache_dir):
+    """OSのキーリングに保存した鍵でFernetを作成（鍵がなければ生成して保存）"""
+    import keyring
+    from cryptography.fernet import Fernet
+
+    # 以前のバージョンが暗号文の隣に保存していた鍵は削除する
+    legacy_key = Path(cache_dir) / "session.key"
+    if legacy_key.exists():
+        legacy_key.unlink()
+        logger.info("cache/session.key を削除しました（鍵はキーリングに保存します）")
+
+    key = keyring.get_password(_KEYRING_SERVICE, _KEYRING_USERNAME)
+    if key is None:
+        key = Fernet.generate_key().decode("ascii")
+        keyring.set_password(_KEYRING_SERVICE, _KEYRING_USERNAME, key)
+    return Fernet(key.encode("ascii"))
+
+
+def _protect(data, cache_dir):
+    """データを暗号化（WindowsはDPAPI、それ以外はcryptographyのFernet）"""
+    if sys.platform == "win32":
+        return _dpapi(data, protect=True)
+    return _fernet(cache_dir).encrypt(data)
+
+
+def _unprotect(data, cache_dir):
+    """_protect で暗号化したデータを復号"""
+    if sys.platform == "win32":
+        return _dpapi(data, protect=False)
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return _fernet(cache_dir).decrypt(data)
+    except InvalidToken:
+        raise ValueError("セッションを復号できませんでした")
+
+
+class HttpPunchUnavailable(Exception):
+    """HTTPでの打刻を続行できない（ページの構造が想定と異なるなど）
+
+    Attributes:
+        submitted: 打刻要求を送信した後に発生した場合True（ブラウザの再読み込みが必要）
+    """
+
+    def __init__(self, message, submitted=False):
+        super().__init__(message)
+        self.submitted = submitted
+
+
+class PooledHttpClient:
+    """ホストごとにKeep-Alive接続を再利用する最小限のHTTPクライアント
+
+    Cookie（ドメイン・パス・Secure属性による送信先の判定とSet-Cookieの反映）と
+    リダイレクトに対応する。スレッドセーフではない。
+    """
+
+    def __init__(self, timeout=20):
+        self.timeout = timeout
+        self.connections = {}
+        self.cookies = {}
+
+    def add_cookies(self, cookies):
+        """Network.getAllCookies 形式のCookieを追加"""
+        for cookie in cookies:
+            domain = cookie["domain"]
+            self.cookies[(domain, cookie.get("path", "/"), cookie["name"])] = {
+                "value": cookie["value"],
+                "host_only": not domain.startswith("."),
+                "secure": cookie.get("secure", False),
+            }
+
+    def request(self, method, url, body=None, headers=None, max_redirects=5):
+        """リクエストを送信
+
+        Returns:
+            tuple: (ステータスコード, レスポンスヘッダー, 本文(bytes), 最終URL)
+        """
+        for _ in range(max_redirects + 1):
+            status, response_headers, data = self._send(method, url, body, headers or {})
+            location = response_headers.get("Location")
+            if status not in (301, 302, 303, 307, 308) or not location:
+                return status, response_headers, data, url
+            url = urljoin(url, location)
+            if status in (301, 302, 303):
+                method, body = "GET", None
+        raise HttpPunchUnavailable(f"リダイレクトが多すぎます: {url}")
+
+    def _send(self, method, url, body, headers):
+        """1回のリクエストを送信（切断済みの接続は1回だけ張り直す）"""
+        parts = urlparse(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        request_headers = dict(headers)
+        cookie = self._cookie_header(parts)
+        if cookie:
+            request_headers["Cookie"] = cookie
+
+        for attempt in range(2):
+            connection = self.connections.get(key)
+            if connection is None:
+                connection_class = (
+                    http.client.HTTPSConnection
+                    if parts.scheme == "https"
+                    else http.client.HTTPConnection
+                )
+                connection = connection_class(parts.netloc, timeout=self.timeout)
+                self.connections[key] = connection
+            try:
+                connection.request(method, path, body=body, headers=request_headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                del self.connections[key]
+                if attempt == 1:
+                    raise
+
+        for header in response.headers.get_all("Set-Cookie") or []:
+            self._store_cookie(parts.hostname, header)
+        return response.status, response.headers, data
+
+    def _cookie_header(self, parts):
+        """送信先に一致するCookieをCookieヘッダーの形式で返す"""
+        host = parts.hostname or ""
+        pairs = []
+        for (domain, path, name), cookie in self.cookies.items():
+            bare = domain.lstrip(".")
+            if cookie["host_only"]:
+                if host != bare:
+                    continue
+            elif host != bare and not host.endswith("." + bare):
+                continue
+            if not (parts.path or "/").startswith(path):
+                continue
+            if cookie["secure"] and parts.scheme != "https":
+                continue
+            pairs.append(f"{name}={cookie['value']}")
+        return "; ".join(pairs)
+
+    def _store_cookie(self, host, header):
+        """Set-Cookieヘッダーを反映"""
+        parsed = SimpleCookie()
+        try:
+            parsed.load(header)
+        except Exception:
+            return
+        for name, morsel in parsed.items():
+            domain = morsel["domain"] or host
+            if morsel["domain"] and not domain.startswith("."):
+                domain = "." + domain
+            key = (domain, morsel["path"] or "/", name)
+            if morsel["max-age"] == "0":
+                self.cookies.pop(key, None)
+                continue
+            self.cookies[key] = {
+                "value": morsel.value,
+                "host_only": not morsel["domain"],
+                "secure": bool(morsel["secure"]),
+            }
+
+    def close(self):
+        """すべての接続を閉じる"""
+        for connection in self.connections.values():
+            connection.close()
+        self.connections.clear()
+
+
+class _TimesheetParser(HTMLParser):
+    """TeamSpiritのページから出勤・退勤ボタンの状態を取得"""
+
+    def __init__(self):
+        super().__init__()
+        self.buttons = {}
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag == "input" and attributes.get("id") in _BUTTON_IDS.values():
+            self.buttons[attributes["id"]] = {
+                "value": attributes.get("value"),
+                "disabled": "disabled" in attributes,
+            }
+
+
+class TeamSpiritHttpPunch:
+    """ブラウザを使わず、HTTPでTeamSpiritの打刻を行う
+
+    ブラウザでログインした後のCookieを使ってVisualforceのページを取得し、
+    ボタンの状態を読み取ってから、Visualforce Remotingで打刻要求を送信する。
+    ページの構造や応答が想定と異なる場合は HttpPunchUnavailable を送出する。
+    """
+
+    def __init__(self, client, page_url, settings):
+        self.client = client
+        self.page_url = page_url
+        self.settings = settings
+
+    def read_state(self):
+        """ページを取得し、ボタンの状態とRemotingの設定を返す"""
+        status, _, data, final_url = self.client.request("GET", self.page_url)
+        if status != 200:
+            raise HttpPunchUnavailable(f"ページを取得できません（HTTP {status}）")
+        html = data.decode("utf-8", errors="replace")
+
+        parser = _TimesheetParser()
+        parser.feed(html)
+        if set(parser.buttons) != set(_BUTTON_IDS.values()):
+            raise HttpPunchUnavailable(f"出勤・退勤ボタンが見つかりません: {final_url}")
+
+        marker = html.find(_REMOTING_PROVIDER_MARKER)
+        if marker < 0:
+            raise HttpPunchUnavailable("Visualforce Remotingの設定が見つかりません")
+        try:
+            provider, _ = json.JSONDecoder().raw_decode(
+                html, marker + len(_REMOTING_PROVIDER_MARKER)
+            )
+        except ValueError:
+            raise HttpPunchUnavailable("Visualforce Remotingの設定を解析できません")
+
+        return {
+            "checkin_disabled": parser.buttons[_BUTTON_IDS["出勤"]]["disabled"],
+            "checkout_disabled": parser.buttons[_BUTTON_IDS["退勤"]]["disabled"],
+            "provider": provider,
+            "url": final_url,
+        }
+
+    def punch(self, action_type, work_location=None):
+        """打刻する
+
+        Returns:
+            True / "already_done" / "not_checked_in"（_click_button と同じ意味）
+        """
+        state = self.read_state()
+        if action_type == "出勤":
+            if state["checkin_disabled"]:
+                return "already_done"
+        else:
+            if not state["checkin_disabled"]:
+                return "not_checked_in"
+            if state["checkout_disabled"]:
+                return "already_done"
+
+        controller = self.settings.get("controller")
+        method_name = self.settings.get("method")
+        methods = (
+            state["provider"].get("actions", {}).get(controller, {}).get("ms", [])
+        )
+        method = next((m for m in methods if m.get("name") == method_name), None)
+        if method is None:
+            raise HttpPunchUnavailable(
+                f"Remotingのメソッド {controller}.{method_name} が見つかりません"
+            )
+
+        args = _fill_placeholders(
+            self.settings.get("args", []),
+            {"action": action_type, "work_location": work_location or ""},
+        )
+        vf = state["provider"].get("vf", {})
+        payload = {
+            "action": controller,
+            "method": method_name,
+            "data": args,
+            "type": "rpc",
+            "tid": 2,
+            "ctx": {
+                "csrf": method.get("csrf"),
+                "vid": vf.get("vid"),
+                "ns": method.get("ns", ""),
+                "ver": method.get("ver"),
+                "authorization": method.get("authorization"),
+            },
+        }
+        endpoint = urljoin(state["url"], "/apexremote")
+        status, _, data, _ = self.client.request(
+            "POST",
+            endpoint,
+            body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json",
+                "X-User-Agent": "Visualforce-Remoting",
+                "Referer": state["url"],
+            },
+        )
+        try:
+            response = json.loads(data.decode("utf-8"))[0]
+        except (ValueError, IndexError, KeyError):
+            raise HttpPunchUnavailable(
+                f"打刻要求の応答を解析できません（HTTP {status}）", submitted=True
+            )
+        if status != 200 or response.get("statusCode") != 200 or response.get("type") != "rpc":
+            raise HttpPunchUnavailable(
+                f"打刻要求が失敗しました: {response.get('message', response)}",
+                submitted=True,
+            )
+
+        # 打刻が記録されたことをボタンの状態で確認
+        state = self.read_state()
+        key = "checkin_disabled" if action_type == "出勤" else "checkout_disabled"
+        if not state[key]:
+            raise HttpPunchUnavailable(
+                "打刻後もボタンが有効なままです", submitted=True
+            )
+        return True
+
+
+def _fill_placeholders(value, values):
+    """文字列中の {name} を置換（リスト・辞書は再帰的に処理）"""
+    if isinstance(value, str):
+        for name, replacement in values.items():
+            value = value.replace("{" + name + "}", replacement)
+        return value
+    if isinstance(value, list):
+        return [_fill_placeholders(item, values) for item in value]
+    if isinstance(value, dict):
+        return {key: _fill_placeholders(item, values) for key, item in value.items()}
+    return value
+
+
+class _DriverRefresh(threading.Thread):
+    """バックグラウンドでドライバーを更新するスレッド"""
+
+    def __init__(self, cache, browser, version):
+        super().__init__(daemon=True)
+        self.cache = cache
+        self.browser = browser
+        self.version = version
+        self.driver_path = None
+
+    def run(self):
+        try:
+            self.driver_path = self.cache.refresh(self.browser, self.version)
+            logger.info(
+                f"{self.browser.capitalize()}ドライバーを更新しました: {self.driver_path}"
+            )
+        except Exception as e:
+            logger.warning(f"{self.browser.capitalize()}ドライバーの更新に失敗しました: {e}")
+
+
+# ブラウザのバージョンを取得できない場合に、キャッシュしたドライバーを更新する間隔
+_DRIVER_REFRESH_INTERVAL = timedelta(hours=24)
+
+
+class DriverCache:
+    """インストール済みブラウザのバージョンごとにWebDriverのパスをキャッシュする
+
+    ブラウザのバージョンが前回と同じなら、ネットワークに接続せずに
+    cache/drivers.json に記録したパスを返す。バージョンが変わった場合は
+    前回のドライバーを返しつつ、バックグラウンドで webdriver_manager による更新を行う。
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self.path = self.base_dir / "cache" / "drivers.json"
+        self.working_path = self.base_dir / "cache" / "browser.json"
+
+    def resolve(self, browser):
+        """ドライバーのパスを返す
+
+        Returns:
+            tuple: (ドライバーのパス, 更新中の場合は _DriverRefresh)。
+                   パスが分からない場合のドライバーのパスはNone（Selenium Managerに任せる）
+        """
+        version = installed_browser_version(browser)
+        entry = self._load().get(browser, {})
+        driver_path = self._existing_path(entry.get("driver_path"))
+
+        if driver_path and version and entry.get("browser_version") == version:
+            return driver_path, None
+
+        if driver_path and version is None:
+            # バージョンを取得できない場合は、前回の更新から一定時間経過した場合のみ更新する
+            try:
+                age = datetime.now() - datetime.fromisoformat(entry["resolved_at"])
+            except (KeyError, TypeError, ValueError):
+                age = None
+            if age is not None and age < _DRIVER_REFRESH_INTERVAL:
+                return driver_path, None
+            logger.info(
+                f"{browser.capitalize()}のバージョンを取得できないため、"
+                f"前回の更新から{_DRIVER_REFRESH_INTERVAL.total_seconds() / 3600:g}時間以上経過した"
+                "ドライバーをバックグラウンドで更新します"
+            )
+        elif driver_path:
+            logger.info(
+                f"{browser.capitalize()}のバージョンが変わりました"
+                f"（{entry.get('browser_version')} → {version}）。ドライバーをバックグラウンドで更新します"
+            )
+
+        if driver_path:
+            if _driver_manager(browser) is None:
+                return driver_path, None
+            refresh = _DriverRefresh(self, browser, version)
+            refresh.start()
+            return driver_path, refresh
+
+        if _driver_manager(browser) is None:
+            return None, None
+        try:
+            return self.refresh(browser, version), None
+        except Exception as e:
+            # オフライン環境など。PATH上のドライバーをSelenium Managerに探させる
+            logger.warning(f"{browser.capitalize()}ドライバーを取得できません: {e}")
+            return None, None
+
+    def refresh(self, browser, version=None):
+        """webdriver_manager でドライバーを取得してキャッシュに記録"""
+        driver_path = _driver_manager(browser)().install()
+        self.record(browser, version or installed_browser_version(browser), driver_path)
+        return driver_path
+
+    def seed(self, browser, driver_path=None):
+        """ドライバーを cache/drivers/ にコピーしてキャッシュに登録（オフライン環境への事前配置用）
+
+        Args:
+            browser: "chrome" / "edge" / "firefox"
+            driver_path: 登録するドライバーのファイル。Noneの場合は webdriver_manager で取得する
+
+        Returns:
+            str: 登録したドライバーのパス
+        """
+        version = installed_browser_version(browser)
+        if version is None:
+            raise ValueError(f"{browser} のバージョンを取得できません（インストールされていない可能性があります）")
+        if driver_path is None:
+            manager = _driver_manager(browser)
+            if manager is None:
+                raise ValueError("webdriver-manager がインストールされていません")
+            driver_path = manager().install()
+
+        destination = self.base_dir / "cache" / "drivers" / browser / version
+        destination.mkdir(parents=True, exist_ok=True)
+        target = destination / Path(driver_path).name
+        shutil.copy2(driver_path, target)
+        self.record(browser, version, target)
+        return str(target)
+
+    def record(self, browser, version, driver_path):
+        """ブラウザのバージョンとドライバーのパスを記録"""
+        entries = self._load()
+        entries[browser] = {
+            "browser_version": version,
+            "driver_path": self._relative_path(driver_path),
+            "resolved_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._write(self.path, entries)
+
+    def working_browser(self):
+        """前回起動に成功したブラウザ（記録がなければNone）"""
+        return self._load(self.working_path).get("browser")
+
+    def remember_working(self, browser, driver_path):
+        """起動に成功したブラウザとバージョン、ドライバーのパスを記録"""
+        entry = self._load().get(browser, {})
+        working = {
+            "browser": browser,
+            "browser_version": entry.get("browser_version"),
+            "driver_path": driver_path and self._relative_path(driver_path),
+        }
+        previous = self._load(self.working_path)
+        if all(previous.get(key) == value for key, value in working.items()):
+            return
+        working["launched_at"] = datetime.now().isoformat(timespec="seconds")
+        self._write(self.working_path, working)
+
+    def forget_working(self):
+        """起動に成功したブラウザの記録を削除"""
+        try:
+            self.working_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _relative_path(self, driver_path):
+        """アプリのフォルダ内なら相対パスに変換（フォルダごと別のPCにコピーできるように）"""
+        driver_path = Path(driver_path)
+        try:
+            driver_path = driver_path.resolve().relative_to(self.base_dir.resolve())
+        except ValueError:
+            pass
+        return driver_path.as_posix()
+
+    def _write(self, path, data):
+        """一時ファイル経由でJSONを書き込む"""
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{_os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        _os.replace(tmp_path, path)
+
+    def _existing_path(self, driver_path):
+        """記録したパスが存在すれば絶対パスで返す"""
+        if not driver_path:
+            return None
+        path = Path(driver_path)
+        if not path.is_absolute():
+            path = self.base_dir / path
+        return str(path) if path.is_file() else None
+
+    def _load(self, path=None):
+        """キャッシュを読み込む"""
+        try:
+            with open(path or self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+
+def installed_browser_version(browser):
+    """インストール済みブラウザのバージョンを取得（ネットワークには接続しない）
+
+    Returns:
+        str: "120.0.6099.109" などのバージョン。取得できない場合はNone
+    """
+    if sys.platform == "win32":
+        import winreg
+
+        for hive, key, name in _BROWSER_VERSION_REGISTRY.get(browser, []):
+            try:
+                with winreg.OpenKey(getattr(winreg, hive), key) as handle:
+                    return str(winreg.QueryValueEx(handle, name)[0]).split()[0]
+            except OSError:
+                continue
+        return None
+
+    for command in _BROWSER_VERSION_COMMANDS.get(browser, []):
+        try:
+            output = subprocess.run(
+                [command, "--version"], capture_output=True, text=True, timeout=10
+            ).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        match = re.search(r"\d+(?:\.\d+)+", output)
+        if match:
+            return match.group(0)
+    return None
+
+
+def lean_request_patterns(lean):
+    """軽量モードで一時停止して振り分けるリクエストのパターン（Fetch.enable の patterns）
+
+    リソース種別（block_resource_types）はURLにかかわらず、block_url_patterns はURLで一致させる。
+    """
+    patterns = [
+        {"urlPattern": "*", "resourceType": resource_type, "requestStage": "Request"}
+        for resource_type in lean["block_resource_types"]
+    ]
+    patterns.extend(
+        {"urlPattern": pattern, "requestStage": "Request"} for pattern in lean["block_url_patterns"]
+    )
+    return patterns
+
+
+def lean_request_allowed(url, lean):
+    """一時停止したリクエストのURLが許可リスト（allow_url_patterns）に一致するか"""
+    return any(fnmatch.fnmatchcase(url, pattern) for pattern in lean["allow_url_patterns"])
+
+
+# Prometheusのヒストグラムのバケット（秒）
+_SPAN_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class SpanRecorder:
+    """処理の段階ごとの所要時間（スパン）を記録する
+
+    スパンは入れ子にでき（スレッドごとに親子関係を管理）、終了時に
+    logs/spans_YYYYMMDD.jsonl へ1行ずつ追記する。最上位のスパンが終了した時点で、
+    設定に応じてPrometheusのtextfile（ヒストグラム）とOTLP（HTTP/JSON）にも出力する。
+    出力の失敗は警告のみとし、打刻処理には影響させない。
+    """
+
+    def __init__(self, base_dir, config):
+        self.base_dir = Path(base_dir)
+        self.settings = config.get("telemetry", {})
+        self.resource = {
+            "host": socket.gethostname(),
+            "org": urlparse(config.get("salesforce_url", "")).netloc,
+        }
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """スパンを開始し、with ブロックの終了時に記録する
+
+        ブロック内で span["outcome"] や span["attributes"] を設定できる。
+        設定しない場合の outcome は、例外なら "error"、それ以外は "ok"。
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = {
+            "trace_id": parent["trace_id"] if parent else secrets.token_hex(16),
+            "span_id": secrets.token_hex(8),
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "attributes": dict(attributes),
+        }
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span["outcome"] = "error"
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - start
+            span.setdefault("outcome", "ok")
+            stack.pop()
+            self._finish(span, root=parent is None)
+
+    def annotate(self, **attributes):
+        """実行中のスパンに属性（strategy など）を追加"""
+        stack = self._stack()
+        if stack:
+            stack[-1]["attributes"].update(attributes)
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+            self.local.finished = []
+        return self.local.stack
+
+    def _finish(self, span, root):
+        """スパンを出力（最上位のスパンの場合はトレース全体をエクスポート）"""
+        self.local.finished.append(span)
+        if self.settings.get("spans_file", True):
+            self._write_jsonl(span)
+        if not root:
+            return
+        spans, self.local.finished = self.local.finished, []
+        if self.settings.get("prometheus_textfile"):
+            self._write_prometheus(spans)
+        if self.settings.get("otlp_endpoint"):
+            self._export_otlp(spans)
+
+    def _write_jsonl(self, span):
+        record = {
+            "timestamp": datetime.fromtimestamp(span["start"]).isoformat(timespec="milliseconds"),
+            "trace_id": span["trace_id"],
+            "span_id": span["span_id"],
+            "parent_id": span["parent_id"],
+            "name": span["name"],
+            "duration_ms": round(span["duration"] * 1000, 1),
+            "outcome": span["outcome"],
+            "attributes": span["attributes"],
+            **self.resource,
+        }
+        path = self.base_dir / "logs" / f"spans_{datetime.now().strftime('%Y%m%d')}.jsonl"
+        try:
+            path.parent.mkdir(exist_ok=True)
+            # 1行を1回で書き込む（バッチ実行時に複数プロセスから追記されるため）
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"スパンの記録に失敗しました: {e}")
+
+    def _write_prometheus(self, spans):
+        """段階ごとのヒストグラムを累積し、node_exporter のtextfile形式で書き出す"""
+        state_path = self.base_dir / "cache" / "span_histograms.json"
+        textfile = Path(self.settings["prometheus_textfile"])
+        try:
+            with self.lock:
+                try:
+                    histograms = json.loads(state_path.read_text(encoding="utf-8"))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    histograms = {}
+                for span in spans:
+                    key = f"{span['name']}|{span['outcome']}"
+                    entry = histograms.setdefault(
+                        key, {"buckets": [0] * len(_SPAN_BUCKETS), "count": 0, "sum": 0.0}
+                    )
+                    for index, bound in enumerate(_SPAN_BUCKETS):
+                        if span["duration"] <= bound:
+                            entry["buckets"][index] += 1
+                    entry["count"] += 1
+                    entry["sum"] += span["duration"]
+
+                state_path.parent.mkdir(exist_ok=True)
+                tmp_path = state_path.with_suffix(f".{_os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(histograms), encoding="utf-8")
+                _os.replace(tmp_path, state_path)
+
+                metric = "auto_checkinout_phase_duration_seconds"
+                lines = [
+                    f"# HELP {metric} Duration of each check-in/out phase.",
+                    f"# TYPE {metric} histogram",
+                ]
+                for key, entry in sorted(histograms.items()):
+                    phase, outcome = key.split("|", 1)
+                    labels = f'phase="{phase}",outcome="{outcome}",org="{self.resource["org"]}"'
+                    for bound, count in zip(_SPAN_BUCKETS, entry["buckets"]):
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                    lines.append(f"{metric}_sum{{{labels}}} {entry['sum']:.6f}")
+                    lines.append(f"{metric}_count{{{labels}}} {entry['count']}")
+
+                # node_exporter が書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+                textfile.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = textfile.with_name(f".{textfile.name}.{_os.getpid()}.tmp")
+                tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+                _os.replace(tmp_path, textfile)
+        except OSError as e:
+            logger.warning(f"Prometheusのtextfileの書き込みに失敗しました: {e}")
+
+    def _export_otlp(self, spans):
+        """OTLP/HTTP（JSON）でコレクターにスパンを送信"""
+        import urllib.request
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, (int, float)):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        otlp_spans = []
+        for span in spans:
+            start_ns = int(span["start"] * 1e9)
+            otlp_span = {
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(span["duration"] * 1e9)),
+                "attributes": [attribute("outcome", span["outcome"])]
+                + [attribute(k, v) for k, v in span["attributes"].items() if v is not None],
+                "status": {"code": 2 if span["outcome"] == "error" else 1},
+            }
+            if span["parent_id"]:
+                otlp_span["parentSpanId"] = span["parent_id"]
+            otlp_spans.append(otlp_span)
+
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            attribute("service.name", "auto_checkinout"),
+                            attribute("host.name", self.resource["host"]),
+                            attribute("salesforce.org", self.resource["org"]),
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": "auto_checkinout"}, "spans": otlp_spans}],
+                }
+            ]
+        }
+        request = urllib.request.Request(
+            self.settings["otlp_endpoint"],
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=float(self.settings.get("otlp_timeout", 2))):
+                pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"OTLPへのスパンの送信に失敗しました: {e}")
+
+
+def _span_outcome(result):
+    """メソッドの戻り値からスパンの outcome を決める"""
+    if result is False:
+        return "failed"
+    if isinstance(result, str):
+        return result
+    return "ok"
+
+
+def _traced(name, outcome=_span_outcome):
+    """メソッドの実行をスパンとして記録するデコレーター
+
+    Args:
+        name: スパン名
+        outcome: 戻り値からスパンの outcome を決める関数
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.spans.span(name) as span:
+                result = method(self, *args, **kwargs)
+                span.setdefault("outcome", outcome(result))
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+# WebDriverコマンドの所要時間のヒストグラムの境界（ミリ秒、最後は上限なし）
+_COMMAND_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# 暗黙の待機（implicitly_wait）の対象になる要素の検索コマンド
+_FIND_COMMANDS = {"findElement", "findElements", "findChildElement", "findChildElements"}
+
+# 操作中のフレームをトップに戻すコマンド
+_TOP_FRAME_COMMANDS = {"switchToWindow", "get", "refresh", "goBack", "goForward", "newWindow"}
+
+
+class CommandProfiler:
+    """WebDriverのコマンド（command_executor.execute）ごとの所要時間を記録する
+
+    コマンド名、操作中のフレーム、呼び出し元（main.py の最も内側の関数と行番号、
+    およびその呼び出し元の関数）、所要時間、暗黙の待機をすべて待ったかどうかを記録する。
+    report() で呼び出し元ごと・コマンドごとの回数・合計時間・ヒストグラムをログに出力し、
+    全コマンドの記録とあわせて logs/webdriver_profile_*.json に書き出す。
+    ブラウザを起動し直した場合は attach() で新しいWebDriverに付け替える（記録は引き継ぐ）。
+    """
+
+    def __init__(self, base_dir, settings):
+        self.base_dir = Path(base_dir)
+        self.settings = settings
+        self.records = []
+        self.started = datetime.now()
+        self.frames = []
+        self.implicit_wait = 0.0
+
+    def attach(self, driver):
+        """WebDriverのコマンドの送信を、記録つきのものに置き換える"""
+        executor = driver.command_executor
+        execute = executor.execute
+        self.frames = []
+        self.implicit_wait = 0.0
+
+        def profiled(command, params=None):
+            start = time.perf_counter()
+            error = None
+            try:
+                response = execute(command, params)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                duration = time.perf_counter() - start
+                if error is None:
+                    value = response.get("value") if isinstance(response, dict) else None
+                    if isinstance(value, dict) and value.get("error"):
+                        error = value["error"]
+                self._record(command, params or {}, duration, error)
+            return response
+
+        executor.execute = profiled
+
+    def _record(self, command, params, duration, error):
+        """1コマンド分を記録し、フレームと暗黙の待機の設定を追跡する"""
+        frame = " > ".join(self.frames) or "top"
+        site, caller = self._call_site()
+        self.records.append(
+            {
+                "command": command,
+                "frame": frame,
+                "site": site,
+                "caller": caller,
+                "duration_ms": round(duration * 1000, 2),
+                "implicit_wait": (
+                    command in _FIND_COMMANDS
+                    and self.implicit_wait > 0
+                    and duration >= self.implicit_wait * 0.95
+                ),
+                "error": error,
+            }
+        )
+        if error is not None:
+            return
+        if command == "switchToFrame":
+            target = params.get("id")
+            if target is None:
+                self.frames = []
+            elif isinstance(target, dict):
+                # 要素の参照（WebElementのID）は先頭8文字のみ
+                self.frames.append(f"iframe:{str(next(iter(target.values()), ''))[:8]}")
+            else:
+                self.frames.append(f"iframe[{target}]")
+        elif command == "switchToParentFrame":
+            self.frames = self.frames[:-1]
+        elif command in _TOP_FRAME_COMMANDS:
+            self.frames = []
+        elif command == "setTimeouts" and "implicit" in params:
+            self.implicit_wait = params["implicit"] / 1000
+
+    @staticmethod
+    def _call_site():
+        """コマンドを送信した main.py の関数と行番号（site）と、その呼び出し元の関数名（caller）"""
+        frame = sys._getframe(2)
+        site = caller = None
+        while frame is not None:
+            if frame.f_globals is globals() and frame.f_code.co_name != "profiled":
+                name = frame.f_code.co_name
+                if site is None:
+                    site = f"{name}:{frame.f_lineno}"
+                    site_name = name
+                elif name not in (site_name, "wrapper"):
+                    caller = name
+                    break
+            frame = frame.f_back
+        return site or "-", caller
+
+    def summary(self):
+        """呼び出し元ごと・コマンドごとの集計"""
+
+        def histogram(durations):
+            counts = [0] * (len(_COMMAND_BUCKETS_MS) + 1)
+            for duration in durations:
+                index = next(
+                    (i for i, bound in enumerate(_COMMAND_BUCKETS_MS) if duration <= bound),
+                    len(_COMMAND_BUCKETS_MS),
+                )
+                counts[index] += 1
+            return counts
+
+        def aggregate(records):
+            durations = [record["duration_ms"] for record in records]
+            commands = {}
+            for record in records:
+                commands[record["command"]] = commands.get(record["command"], 0) + 1
+            return {
+                "count": len(records),
+                "total_ms": round(sum(durations), 1),
+                "max_ms": max(durations),
+                "implicit_wait_hits": sum(1 for record in records if record["implicit_wait"]),
+                "errors": sum(1 for record in records if record["error"]),
+                "commands": commands,
+                "histogram": histogram(durations),
+            }
+
+        groups = {}
+        for record in self.records:
+            key = record["site"] + (f" ← {record['caller']}" if record["caller"] else "")
+            groups.setdefault(("site", key), []).append(record)
+            groups.setdefault(("command", record["command"]), []).append(record)
+        sites = [
+            {"site": key, **aggregate(records)}
+            for (kind, key), records in groups.items()
+            if kind == "site"
+        ]
+        commands = [
+            {"command": key, **aggregate(records)}
+            for (kind, key), records in groups.items()
+            if kind == "command"
+        ]
+        sites.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        commands.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "round_trips": len(self.records),
+            "total_ms": round(sum(record["duration_ms"] for record in self.records), 1),
+            "implicit_wait_hits": sum(1 for record in self.records if record["implicit_wait"]),
+            "histogram_buckets_ms": _COMMAND_BUCKETS_MS,
+            "call_sites": sites,
+            "commands": commands,
+        }
+
+    def report(self):
+        """集計をログに出力し、全コマンドの記録とあわせてファイルに書き出す"""
+        if not self.records:
+            return
+        summary = self.summary()
+        top = int(self.settings.get("top", 15))
+        logger.info(
+            f"WebDriverコマンド: {summary['round_trips']}回、合計 {summary['total_ms'] / 1000:.2f}秒"
+            f"（暗黙の待機をすべて待った検索: {summary['implicit_wait_hits']}回）"
+        )
+        logger.info("呼び出し元ごとの所要時間（合計の多い順）:")
+        for entry in summary["call_sites"][:top]:
+            waits = entry["implicit_wait_hits"]
+            logger.info(
+                f"  {entry['total_ms']:9.1f}ms {entry['count']:5d}回 最大 {entry['max_ms']:8.1f}ms"
+                f"{f' 暗黙の待機 {waits}回' if waits else ''}  {entry['site']}"
+            )
+        labels = [f"≤{bound}" for bound in _COMMAND_BUCKETS_MS] + [f">{_COMMAND_BUCKETS_MS[-1]}"]
+        logger.info("コマンドごとの所要時間のヒストグラム（ミリ秒: 回数）:")
+        for entry in summary["commands"][:top]:
+            buckets = ", ".join(
+                f"{label}: {count}" for label, count in zip(labels, entry["histogram"]) if count
+            )
+            logger.info(
+                f"  {entry['command']} {entry['count']}回 合計 {entry['total_ms']:.1f}ms（{buckets}）"
+            )
+
+        path = (
+            self.base_dir / "logs"
+            / f"webdriver_profile_{self.started.strftime('%Y%m%d_%H%M%S')}_{_os.getpid()}.json"
+        )
+        try:
+            path.parent.mkdir(exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({**summary, "records": self.records}, f, ensure_ascii=False, indent=2)
+            logger.info(f"WebDriverコマンドの記録を保存しました: {path}")
+        except OSError as e:
+            logger.warning(f"WebDriverコマンドの記録の保存に失敗しました: {e}")
+
+
+# スクリーンショットの形式ごとの拡張子
+_SCREENSHOT_EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+# TeamSpiritのウィジェット（Visualforce iframe）のページ上の位置を取得
+_WIDGET_RECT_JS = """
+const alohaPage = document.querySelector('force-aloha-page');
+let element = alohaPage && alohaPage.shadowRoot
+    ? alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]')
+    : null;
+element = element || alohaPage;
+if (!element) {
+    return null;
+}
+const rect = element.getBoundingClientRect();
+if (rect.width < 1 || rect.height < 1) {
+    return null;
+}
+return {
+    element: element,
+    x: rect.left + window.scrollX,
+    y: rect.top + window.scrollY,
+    width: rect.width,
+    height: rect.height
+};
+"""
+
+
+class ScreenshotWriter:
+    """スクリーンショットの書き込みをバックグラウンドのスレッドで行う
+
+    画像のバイト列（またはCDPのbase64文字列）を受け取り、別スレッドで
+    デコードして screenshots/ に保存する。ファイル名は「ラベル_内容のハッシュ」とし
+    （撮影日時はファイルの更新日時とログで確認する）、同じ内容の画像は2回保存しない
+    （更新日時のみ更新）。保存後に、
+    retention_days より古いファイルと max_total_mb を超えた分の古いファイルを削除する。
+    """
+
+    def __init__(self, screenshot_dir, settings):
+        self.screenshot_dir = Path(screenshot_dir)
+        self.settings = settings
+        self.queue = None
+        self.thread = None
+
+    def submit(self, label, data, extension):
+        """保存を依頼（data は bytes、またはCDPの base64 文字列）"""
+        if self.thread is None:
+            import queue
+
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.queue.put((label, data, extension))
+
+    def flush(self):
+        """依頼済みのスクリーンショットがすべて保存されるまで待機"""
+        if self.queue is not None:
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            label, data, extension = self.queue.get()
+            try:
+                self._write(label, data, extension)
+                self._prune()
+            except Exception as e:
+                logger.error(f"スクリーンショットの保存に失敗しました: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, label, data, extension):
+        """内容のハッシュをファイル名に含めて保存（同じ内容なら保存を省略）"""
+        if isinstance(data, str):
+            import base64
+
+            data = base64.b64decode(data)
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        filepath = self.screenshot_dir / f"{label}_{digest}.{extension}"
+        self.screenshot_dir.mkdir(exist_ok=True)
+        if filepath.exists():
+            _os.utime(filepath)
+            logger.info(f"同じ内容のスクリーンショットが保存済みです: {filepath}")
+            return
+        tmp_path = filepath.with_name(f".{filepath.name}.{_os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        _os.replace(tmp_path, filepath)
+        logger.info(f"スクリーンショットを保存しました: {filepath}（{len(data) // 1024}KB）")
+
+    def _prune(self):
+        """保存期間と合計サイズの上限を超えた古いスクリーンショットを削除"""
+        files = [
+            path
+            for path in self.screenshot_dir.iterdir()
+            if path.is_file() and not path.name.startswith(".")
+        ]
+        files.sort(key=lambda path: path.stat().st_mtime)
+        cutoff = time.time() - float(self.settings.get("retention_days", 30)) * 86400
+        total = sum(path.stat().st_size for path in files)
+        limit = float(self.settings.get("max_total_mb", 100)) * 1024 * 1024
+        for path in files[:-1]:
+            if path.stat().st_mtime >= cutoff and total <= limit:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+
+
+# ページコンテキストの目印を書き込むプロパティ名
+_PAGE_CONTEXT_MARKER = "__autoCheckInOutContext"
+
+# 要素の現在の状態（古くなった要素の場合は StaleElementReferenceException）
+_ELEMENT_STATE_JS = """
+const el = arguments[0];
+return {
+    id: el.id || null,
+    value: el.value === undefined ? null : el.value,
+    disabled: Boolean(el.disabled) || el.hasAttribute('disabled'),
+};
+"""
+
+
+class PageContext:
+    """1回の処理の間、探索で見つけたフレームとボタンを保持する
+
+    フレーム（iframe要素）とボタンの要素を覚えておき、同じ処理の中の次の探索
+    （出勤状態の確認 → 勤務場所タブ → 退勤ボタンなど）では探索せずに再利用する。
+    ボタンのあるフレームに目印を書き込み、ページの遷移や再読み込みで目印が消えた場合と、
+    要素が古くなった（stale）場合にのみ破棄する。
+    """
+
+    def __init__(self):
+        self.driver = None
+        self.token = None
+        self.frame_path = None
+        self.frames = []
+        self.buttons = {}
+
+    def reset(self, driver):
+        """新しい処理を始める（保持している内容を破棄）"""
+        self.driver = driver
+        self.invalidate()
+
+    def invalidate(self, reason=None):
+        """保持している内容を破棄"""
+        if reason and self.frame_path is not None:
+            logger.info(f"ページコンテキストを破棄しました: {reason}")
+        self.token = None
+        self.frame_path = None
+        self.frames = []
+        self.buttons = {}
+
+    def remember(self, target_button, located):
+        """見つけたボタンと、そのフレーム（現在のフレーム）を保持する"""
+        frames = located.get("frames")
+        if self.driver is None or frames is None:
+            return
+        if located["frame_path"] != self.frame_path:
+            self.invalidate()
+            self.token = secrets.token_hex(8)
+            self.driver.execute_script(
+                f"window.{_PAGE_CONTEXT_MARKER} = arguments[0];", self.token
+            )
+            self.frame_path = list(located["frame_path"])
+            self.frames = frames
+        if target_button:
+            self.buttons[target_button] = {
+                key: value for key, value in located.items() if key != "frames"
+            }
+
+    def enter(self):
+        """保持しているフレームに切り替える
+
+        Returns:
+            bool: 切り替えられた場合True（遷移や要素の破棄を検出した場合は内容を破棄してFalse）
+        """
+        if self.driver is None or self.token is None:
+            return False
+        try:
+            self.driver.switch_to.default_content()
+            for frame in self.frames:
+                self.driver.switch_to.frame(frame)
+            if self.driver.execute_script(
+                f"return window.{_PAGE_CONTEXT_MARKER} === arguments[0];", self.token
+            ):
+                return True
+            reason = "ページが遷移しました"
+        except Exception as e:
+            reason = f"フレームが古くなりました（{type(e).__name__}）"
+        self.invalidate(reason)
+        return False
+
+    def button(self, target_button):
+        """保持しているボタンを、現在の状態（disabled など）に更新して返す（フレームに切り替える）
+
+        Returns:
+            dict: _find_button_in_frames と同じ形式。保持していない場合や古くなった場合はNone
+        """
+        cached = self.buttons.get(target_button)
+        if cached is None or not self.enter():
+            return None
+        try:
+            state = self.driver.execute_script(_ELEMENT_STATE_JS, cached["element"])
+        except Exception as e:
+            self.invalidate(f"{target_button}ボタンが古くなりました（{type(e).__name__}）")
+            return None
+        return {**cached, **state}
+
+
+class CdpError(Exception):
+    """DevTools Protocol のコマンドがエラーを返した、または接続できない"""
+
+
+class CdpElement:
+    """DevTools Protocol で取得した要素（セッションとリモートオブジェクトのID）"""
+
+    def __init__(self, session_id, object_id, frame_id=None):
+        self.session_id = session_id
+        self.object_id = object_id
+        self.frame_id = frame_id
+
+
+class CdpConnection:
+    """Chrome/Edge の DevTools Protocol へのWebSocket接続（ブラウザ単位のエンドポイント）
+
+    コマンドごとの回数と所要時間を記録し、close() でログに出力する。スレッドセーフではない。
+    """
+
+    def __init__(self, address, timeout=10):
+        import urllib.request
+
+        import websocket  # websocket-client（Seleniumの依存パッケージ）
+
+        self._websocket = websocket
+        with urllib.request.urlopen(f"http://{address}/json/version", timeout=timeout) as response:
+            url = json.load(response)["webSocketDebuggerUrl"]
+        self.timeout = timeout
+        self.ws = websocket.create_connection(url, timeout=timeout, suppress_origin=True)
+        self.next_id = 0
+        self.stats = {}
+
+    @staticmethod
+    def debugger_address(driver):
+        """Seleniumが起動したChrome/EdgeのDevToolsのアドレス（host:port）"""
+        for key in ("goog:chromeOptions", "ms:edgeOptions"):
+            address = driver.capabilities.get(key, {}).get("debuggerAddress")
+            if address:
+                return address
+        raise CdpError("DevToolsのアドレスを取得できません（ローカルのChrome/Edgeのみ対応）")
+
+    def _page_target(self, driver):
+        """Seleniumが操作中のタブのターゲットIDを取得"""
+        handle = driver.current_window_handle
+        pages = [
+            target
+            for target in self.send("Target.getTargets")["targetInfos"]
+            if target["type"] == "page"
+        ]
+        for target in pages:
+            if handle.endswith(target["targetId"]):
+                return target["targetId"]
+        current_url = driver.current_url
+        for target in pages:
+            if target["url"] == current_url:
+                return target["targetId"]
+        raise CdpError("操作中のタブのターゲットが見つかりません")
+
+    def send(self, method, params=None, session_id=None):
+        """コマンドを送信して結果を返す（待機中に届いたイベントも処理する）"""
+        self.next_id += 1
+        message = {"id": self.next_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        start = time.perf_counter()
+        self.ws.send(json.dumps(message))
+        while True:
+            response = json.loads(self.ws.recv())
+            if response.get("id") == message["id"]:
+                break
+            self._dispatch(response)
+        stat = self.stats.setdefault(method, [0, 0.0])
+        stat[0] += 1
+        stat[1] += time.perf_counter() - start
+        if "error" in response:
+            raise CdpError(f"{method}: {response['error'].get('message')}")
+        return response.get("result", {})
+
+    def _pump(self, timeout):
+        """timeout 秒までイベントを受信して処理する"""
+        deadline = time.monotonic() + timeout
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                self.ws.settimeout(remaining)
+                self._dispatch(json.loads(self.ws.recv()))
+        except self._websocket.WebSocketTimeoutException:
+            pass
+        finally:
+            self.ws.settimeout(self.timeout)
+
+    def _dispatch(self, message):
+        """イベントを処理（必要なサブクラスで実装）"""
+
+    def close(self):
+        """接続を閉じ、コマンドごとの回数と平均所要時間をログに出力"""
+        if self.stats:
+            summary = ", ".join(
+                f"{method} {count}回 平均{total / count * 1000:.1f}ms"
+                for method, (count, total) in sorted(self.stats.items())
+            )
+            logger.info(f"DevToolsコマンドの所要時間: {summary}")
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class CdpBackend(CdpConnection):
+    """DevTools Protocol で直接ボタンの探索とクリックを行う
+
+    Seleniumが起動したブラウザに接続し、操作中のページのターゲットに flatten モードでアタッチする。
+    別プロセスのiframe（クロスオリジンのVisualforceなど）は Target.setAutoAttach で
+    子セッションとしてアタッチし、フレームごとの実行コンテキストで Runtime.evaluate を実行する
+    （ドライバーを経由せず、フレームの切り替えも不要）。見つからない場合は DOM.performSearch
+    （closedなShadow Rootも対象）でも探す。クリックは要素の座標に Input.dispatchMouseEvent を送る。
+    """
+
+    def __init__(self, driver, timeout=10):
+        super().__init__(self.debugger_address(driver), timeout)
+        # sessionId -> {"parent": 親のsessionId, "target_id": ターゲット（=フレーム）のID}
+        self.sessions = {}
+        # (sessionId, frameId) -> 実行コンテキストのID（デフォルトのワールドのみ）
+        self.contexts = {}
+        self.pending = []
+        self.buttons = {}
+
+        target_id = self._page_target(driver)
+        self.root = self.send(
+            "Target.attachToTarget", {"targetId": target_id, "flatten": True}
+        )["sessionId"]
+        self.sessions[self.root] = {"parent": None, "target_id": target_id}
+        self._initialize(self.root)
+
+    def _initialize(self, session_id):
+        """セッションの実行コンテキストの通知と、子フレームの自動アタッチを有効にする"""
+        self.send("Runtime.enable", session_id=session_id)
+        self.send(
+            "Target.setAutoAttach",
+            {"autoAttach": True, "waitForDebuggerOnStart": False, "flatten": True},
+            session_id,
+        )
+
+    def _dispatch(self, message):
+        """イベントを処理（フレーム・実行コンテキスト・子セッションの追跡）"""
+        method = message.get("method")
+        params = message.get("params", {})
+        session_id = message.get("sessionId")
+        if method == "Runtime.executionContextCreated":
+            context = params["context"]
+            aux = context.get("auxData", {})
+            if aux.get("isDefault") and aux.get("frameId"):
+                self.contexts[(session_id, aux["frameId"])] = context["id"]
+        elif method == "Runtime.executionContextDestroyed":
+            context_id = params.get("executionContextId")
+            for key in [k for k, v in self.contexts.items() if k[0] == session_id and v == context_id]:
+                del self.contexts[key]
+        elif method == "Runtime.executionContextsCleared":
+            for key in [k for k in self.contexts if k[0] == session_id]:
+                del self.contexts[key]
+        elif method == "Target.attachedToTarget":
+            if params["targetInfo"]["type"] == "iframe":
+                self.sessions[params["sessionId"]] = {
+                    "parent": session_id,
+                    "target_id": params["targetInfo"]["targetId"],
+                }
+                # コマンドの応答待ちの間に届くため、初期化は次の操作の前に行う
+                self.pending.append(params["sessionId"])
+        elif method == "Target.detachedFromTarget":
+            self.sessions.pop(params["sessionId"], None)
+            for key in [k for k in self.contexts if k[0] == params["sessionId"]]:
+                del self.contexts[key]
+
+    def _drain(self):
+        """新しくアタッチした子セッションを初期化する"""
+        while self.pending:
+            session_id = self.pending.pop(0)
+            try:
+                self._initialize(session_id)
+            except CdpError as e:
+                logger.info(f"DevTools: 子フレームのセッションを初期化できませんでした: {e}")
+
+    def _frame_contexts(self):
+        """探索するフレームの (sessionId, frameId, 実行コンテキストID)（別プロセスのiframeを優先）"""
+        return sorted(
+            ((sid, frame_id, context_id) for (sid, frame_id), context_id in self.contexts.items()),
+            key=lambda item: item[0] == self.root,
+        )
+
+    @staticmethod
+    def _expression(script, args):
+        """execute_script 形式のスクリプト（arguments を参照）を式に変換"""
+        return f"(function () {{{script}}}).apply(null, {json.dumps(args, ensure_ascii=False)})"
+
+    def evaluate(self, session_id, context_id, script, *args, by_value=True):
+        """フレームの実行コンテキストでスクリプトを実行（引数はJSONに変換できる値のみ）"""
+        result = self.send(
+            "Runtime.evaluate",
+            {
+                "expression": self._expression(script, list(args)),
+                "contextId": context_id,
+                "returnByValue": by_value,
+            },
+            session_id,
+        )
+        if "exceptionDetails" in result:
+            raise CdpError(result["exceptionDetails"].get("text", "スクリプトの実行に失敗しました"))
+        return result["result"]
+
+    def call(self, element, script, *args):
+        """要素のフレームでスクリプトを実行（引数の CdpElement は要素として渡す）"""
+        return self._call_function(element, f"function () {{{script}}}", args)
+
+    def call_async(self, element, script, *args, timeout):
+        """要素のフレームで execute_async_script 形式のスクリプトを実行
+
+        スクリプトの最後の2つの引数には、タイムアウト（ミリ秒）と結果を返すコールバックを渡す。
+        """
+        declaration = (
+            "function (...args) { return new Promise((resolve) => "
+            f"(function () {{{script}}}).apply(this, [...args, resolve])); }}"
+        )
+        self.ws.settimeout(timeout + 5)
+        try:
+            return self._call_function(
+                element, declaration, [*args, int(timeout * 1000)], await_promise=True
+            )
+        finally:
+            self.ws.settimeout(self.timeout)
+
+    def _call_function(self, element, declaration, args, await_promise=False):
+        """Runtime.callFunctionOn で関数を実行して結果（値）を返す"""
+        arguments = [
+            {"objectId": arg.object_id} if isinstance(arg, CdpElement) else {"value": arg}
+            for arg in args
+        ]
+        result = self.send(
+            "Runtime.callFunctionOn",
+            {
+                "functionDeclaration": declaration,
+                "objectId": element.object_id,
+                "arguments": arguments,
+                "returnByValue": True,
+                "awaitPromise": await_promise,
+            },
+            element.session_id,
+        )
+        if "exceptionDetails" in result:
+            raise CdpError(result["exceptionDetails"].get("text", "スクリプトの実行に失敗しました"))
+        return result["result"].get("value")
+
+    def find_element(self, script, args, timeout, search_query=None):
+        """すべてのフレームでスクリプトを実行し、要素が見つかるまで待機する
+
+        Args:
+            script: 要素（またはnull）を返す execute_script 形式のスクリプト
+            args: スクリプトの引数（JSONに変換できる値）
+            timeout: 待機する最大時間（秒）
+            search_query: 見つからない場合に DOM.performSearch で探すクエリ（XPathなど）
+
+        Returns:
+            CdpElement: 見つからない場合はNone
+        """
+        deadline = time.monotonic() + timeout
+        rounds = 0
+        while True:
+            self._drain()
+            for session_id, frame_id, context_id in self._frame_contexts():
+                try:
+                    result = self.evaluate(session_id, context_id, script, *args, by_value=False)
+                except CdpError:
+                    # ナビゲーション中などで実行コンテキストが破棄された
+                    continue
+                if result.get("subtype") == "node":
+                    return CdpElement(session_id, result["objectId"], frame_id)
+            if search_query and rounds % 5 == 4:
+                element = self._search(search_query)
+                if element:
+                    return element
+            if time.monotonic() >= deadline:
+                return None
+            self._pump(min(0.1, max(0.0, deadline - time.monotonic())))
+            rounds += 1
+
+    def _search(self, query):
+        """DOM.performSearch ですべてのセッションのDOMを探す（Shadow Root内も対象）"""
+        for session_id in list(self.sessions):
+            try:
+                self.send("DOM.getDocument", {"depth": -1, "pierce": True}, session_id)
+                search = self.send("DOM.performSearch", {"query": query}, session_id)
+            except CdpError:
+                continue
+            try:
+                if search["resultCount"]:
+                    node_ids = self.send(
+                        "DOM.getSearchResults",
+                        {"searchId": search["searchId"], "fromIndex": 0, "toIndex": 1},
+                        session_id,
+                    )["nodeIds"]
+                    obj = self.send("DOM.resolveNode", {"nodeId": node_ids[0]}, session_id)["object"]
+                    return CdpElement(session_id, obj["objectId"])
+            except CdpError:
+                continue
+            finally:
+                try:
+                    self.send("DOM.discardSearchResults", {"searchId": search["searchId"]}, session_id)
+                except CdpError:
+                    pass
+        return None
+
+    def find_button(self, target_button, css, xpath, timeout):
+        """出勤・退勤ボタンを探す（同じ処理の中で見つけたボタンは再利用する）
+
+        Returns:
+            dict: element, frame_path, id, value, disabled を持つ辞書。見つからない場合はNone
+        """
+        element = self.buttons.get(target_button)
+        state = None
+        if element is not None:
+            try:
+                state = self.call(element, _ELEMENT_STATE_JS, element)
+            except CdpError:
+                element = None
+        if state is None:
+            if target_button in _BUTTON_IDS:
+                target_ids = [_BUTTON_IDS[target_button]]
+                target_values = [target_button]
+            else:
+                target_ids = list(_BUTTON_IDS.values())
+                target_values = list(_BUTTON_IDS.keys())
+            query = " | ".join(f'//*[@id="{target_id}"]' for target_id in target_ids)
+            element = self.find_element(
+                _CDP_BUTTON_JS, [target_ids, target_values, css, xpath], timeout, query
+            )
+            if element is None:
+                return None
+            state = self.call(element, _ELEMENT_STATE_JS, element)
+            self.buttons[target_button] = element
+        return {
+            "element": element,
+            "frame_path": [f"cdp:{element.frame_id or element.session_id}"],
+            **state,
+        }
+
+    def click(self, element):
+        """要素の中心に Input.dispatchMouseEvent でクリックを送る"""
+        self.send("DOM.scrollIntoViewIfNeeded", {"objectId": element.object_id}, element.session_id)
+        quads = self.send(
+            "DOM.getContentQuads", {"objectId": element.object_id}, element.session_id
+        )["quads"]
+        if not quads:
+            raise CdpError("要素が表示されていないためクリックできません")
+        quad = quads[0]
+        offset_x, offset_y = self._frame_offset(element.session_id)
+        x = sum(quad[0::2]) / 4 + offset_x
+        y = sum(quad[1::2]) / 4 + offset_y
+        for event in ("mouseMoved", "mousePressed", "mouseReleased"):
+            params = {"type": event, "x": x, "y": y}
+            if event != "mouseMoved":
+                params.update({"button": "left", "clickCount": 1})
+            self.send("Input.dispatchMouseEvent", params, self.root)
+
+    def _frame_offset(self, session_id):
+        """子セッション（別プロセスのiframe）の左上の、ページ上の座標"""
+        x = y = 0.0
+        while self.sessions[session_id]["parent"]:
+            info = self.sessions[session_id]
+            parent = info["parent"]
+            owner = self.send("DOM.getFrameOwner", {"frameId": info["target_id"]}, parent)
+            content = self.send(
+                "DOM.getBoxModel", {"backendNodeId": owner["backendNodeId"]}, parent
+            )["model"]["content"]
+            x += content[0]
+            y += content[1]
+            session_id = parent
+        return x, y
+
+
+class LeanRequestFilter(CdpConnection):
+    """軽量モードのリクエストの振り分け（Chrome/Edge）
+
+    操作中のタブ（と別プロセスのiframe）で Fetch.enable によりブロック対象のリクエストを一時停止し、
+    URLが許可リストに一致するものは Fetch.continueRequest で続行、それ以外は Fetch.failRequest で中止する。
+    一時停止したリクエストは応答するまで止まるため、専用の接続とスレッドで処理する
+    （接続が切れた場合はブラウザが一時停止を解除する）。
+    """
+
+    def __init__(self, driver, lean, timeout=10):
+        super().__init__(self.debugger_address(driver), timeout)
+        self.lean = lean
+        self.patterns = lean_request_patterns(lean)
+        # 初期化する子セッションと、一時停止したリクエスト (sessionId, requestId, URL)
+        self.pending = []
+        self.paused = []
+        self.stop_event = threading.Event()
+
+        target_id = self._page_target(driver)
+        self.root = self.send(
+            "Target.attachToTarget", {"targetId": target_id, "flatten": True}
+        )["sessionId"]
+        self._initialize(self.root)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _initialize(self, session_id):
+        """セッションのリクエストの一時停止と、子フレームの自動アタッチを有効にする"""
+        self.send("Fetch.enable", {"patterns": self.patterns}, session_id)
+        self.send(
+            "Target.setAutoAttach",
+            {"autoAttach": True, "waitForDebuggerOnStart": False, "flatten": True},
+            session_id,
+        )
+
+    def _dispatch(self, message):
+        """一時停止したリクエストと新しい子セッションを記録（応答は _resolve で送る）"""
+        method = message.get("method")
+        params = message.get("params", {})
+        if method == "Fetch.requestPaused":
+            self.paused.append(
+                (message.get("sessionId"), params["requestId"], params["request"]["url"])
+            )
+        elif method == "Target.attachedToTarget" and params["targetInfo"]["type"] == "iframe":
+            self.pending.append(params["sessionId"])
+
+    def _serve(self):
+        """停止するまでイベントを受信して、一時停止したリクエストを振り分ける"""
+        while not self.stop_event.is_set():
+            try:
+                # 初期化中（コマンドの応答待ちの間）に届いたものも含めて処理する
+                self._resolve()
+                self.ws.settimeout(0.5)
+                try:
+                    message = json.loads(self.ws.recv())
+                finally:
+                    self.ws.settimeout(self.timeout)
+            except self._websocket.WebSocketTimeoutException:
+                continue
+            except Exception as e:
+                if not self.stop_event.is_set():
+                    logger.info(f"軽量モード: リクエストの振り分けを終了します: {e}")
+                break
+            self._dispatch(message)
+
+    def _resolve(self):
+        """記録した子セッションを初期化し、一時停止したリクエストを続行または中止する"""
+        while self.pending or self.paused:
+            if self.pending:
+                session_id = self.pending.pop(0)
+                try:
+                    self._initialize(session_id)
+                except CdpError as e:
+                    logger.info(f"軽量モード: 子フレームのセッションを初期化できませんでした: {e}")
+                continue
+            session_id, request_id, url = self.paused.pop(0)
+            try:
+                if lean_request_allowed(url, self.lean):
+                    self.send("Fetch.continueRequest", {"requestId": request_id}, session_id)
+                else:
+                    self.send(
+                        "Fetch.failRequest",
+                        {"requestId": request_id, "errorReason": "BlockedByClient"},
+                        session_id,
+                    )
+            except CdpError:
+                # ナビゲーションなどでリクエストが既に取り消された
+                pass
+
+    def close(self):
+        """振り分けを停止して接続を閉じる"""
+        self.stop_event.set()
+        self.thread.join()
+        super().close()
+
+
+def process_tree_rss(root_pid):
+    """root_pid の子孫プロセス（root_pid 自身は除く）のRSSの合計（バイト）
+
+    psutil があれば使用し、なければ /proc を読む（Linux）。
+    ブラウザのプロセス間の共有メモリは重複して数えるため、実際より多めになる。
+
+    Returns:
+        int: RSSの合計。計測できない場合はNone
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        total = 0
+        for child in psutil.Process(root_pid).children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children = {}
+    rss = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # comm に空白や括弧が含まれる場合があるため、最後の ")" の後ろを分割する
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+            for line in (entry / "status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    rss[int(entry.name)] = int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    total = 0
+    pending = list(children.get(root_pid, []))
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, []))
+    return total
+
+
+class SharedBrowser:
+    """1つのChrome/Edgeを起動し、ユーザーごとに分離したブラウザコンテキストで処理する
+
+    ユーザーごとに Target.createBrowserContext でシークレットウィンドウ相当のコンテキスト
+    （Cookie・ストレージ・キャッシュを共有しない）を作成してタブを開き、起動済みのブラウザに
+    接続したWebDriver（debuggerAddress）でそのタブを操作する。
+    ブラウザのプロセスを共有するため、ユーザーごとにブラウザを起動するより使用メモリが少ない。
+    実行中は子プロセスのRSSの合計を定期的に計測する。
+    """
+
+    def __init__(self, config_path="config.json", sample_interval=0.5):
+        self.host = SalesforceAutoCheckInOut(
+            config_path,
+            overrides={"user_data_dir": "", "auto_close": True, "driver_backend": "selenium"},
+        )
+        if self.host.config.get("browser", "auto") not in ("auto", "chrome", "edge"):
+            raise ValueError("共有ブラウザモードは Chrome/Edge のみ対応しています")
+        self.host.setup_driver()
+        self.address = CdpConnection.debugger_address(self.host.driver)
+        self.browser = "edge" if "ms:edgeOptions" in self.host.driver.capabilities else "chrome"
+        self.connection = CdpConnection(self.address)
+        self.lock = threading.Lock()
+        self.active = 0
+
+        self.baseline = process_tree_rss(_os.getpid())
+        self.peak = (self.baseline, 0)
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(
+            target=self._sample_memory, args=(sample_interval,), daemon=True
+        )
+        self.sampler.start()
+
+    def open(self, automation):
+        """ユーザー用のブラウザコンテキストとタブを作成し、そのタブを操作するWebDriverを返す
+
+        Returns:
+            tuple: (WebDriver, browserContextId)
+        """
+        with self.lock:
+            context_id = self.connection.send("Target.createBrowserContext")["browserContextId"]
+            target_id = self.connection.send(
+                "Target.createTarget", {"url": "about:blank", "browserContextId": context_id}
+            )["targetId"]
+            self.active += 1
+        driver = None
+        try:
+            driver = automation._attach_to_browser(self.browser, self.address)
+            handle = next((h for h in driver.window_handles if h.endswith(target_id)), None)
+            if handle is None:
+                raise RuntimeError("作成したタブが見つかりません")
+            driver.switch_to.window(handle)
+        except Exception:
+            if driver is not None:
+                driver.quit()
+            self.close_context(context_id)
+            raise
+        return driver, context_id
+
+    def close_context(self, context_id):
+        """ブラウザコンテキストを破棄（タブ・Cookie・キャッシュも破棄される）"""
+        with self.lock:
+            self.active -= 1
+            try:
+                self.connection.send("Target.disposeBrowserContext", {"browserContextId": context_id})
+            except Exception as e:
+                logger.warning(f"ブラウザコンテキストを破棄できませんでした: {e}")
+
+    def _sample_memory(self, interval):
+        """子プロセスのRSSの合計を計測し、最大値とその時点の同時実行数を記録"""
+        while not self.stop_event.wait(interval):
+            rss = process_tree_rss(_os.getpid())
+            if rss is not None and rss > self.peak[0]:
+                self.peak = (rss, self.active)
+
+    def memory_report(self):
+        """メモリ使用量の計測結果
+
+        Returns:
+            dict: baseline, peak（バイト）、peak_users、per_user（1ユーザーあたりの増加量）。計測できない場合はNone
+        """
+        if self.baseline is None:
+            return None
+        peak, users = self.peak
+        return {
+            "baseline": self.baseline,
+            "peak": peak,
+            "peak_users": users,
+            "per_user": (peak - self.baseline) / users if users else None,
+        }
+
+    def close(self):
+        """ブラウザを閉じる"""
+        self.stop_event.set()
+        self.sampler.join()
+        self.connection.close()
+        self.host.close()
+
+
+class PunchPhaseError(Exception):
+    """打刻の段階の失敗
+
+    Attributes:
+        fatal: 再試行しても解決しない場合True（ログインの拒否、設定の誤りなど）
+    """
+
+    def __init__(self, message, fatal=False):
+        super().__init__(message)
+        self.fatal = fatal
+
+
+# 打刻の段階（この順に実行する）と表示名
+_PUNCH_PHASES = {
+    "driver": "ブラウザ起動",
+    "login": "ログイン",
+    "widget": "ウィジェット",
+    "http": "HTTPでの打刻",
+    "location": "勤務場所タブ",
+    "verify": "打刻の状態",
+    "click": "ボタンのクリック",
+    "confirm": "打刻の確認",
+}
+
+# 段階ごとの再試行の既定値（recovery.phases で変更できる）
+#   retries: 同じセッションで再試行する回数
+#   required: Falseの場合、再試行しても失敗したら警告のみで次の段階へ進む
+# クリックは失敗しても打刻が記録されている場合があるため、同じページでは再試行せず、
+# 再読み込み（または再起動）して打刻の状態を確認してからクリックし直す
+_PHASE_POLICIES = {
+    "driver": {"retries": 1, "required": True},
+    "login": {"retries": 1, "required": True},
+    "widget": {"retries": 0, "required": False},
+    "http": {"retries": 0, "required": False},
+    "location": {"retries": 1, "required": False},
+    "verify": {"retries": 0, "required": True},
+    "click": {"retries": 0, "required": True},
+    "confirm": {"retries": 0, "required": True},
+}
 
 
 class SalesforceAutoCheckInOut:
     """Salesforce自動出勤・退勤クラス"""
 
-    def __init__(self, config_path="config.json"):
-        """初期化"""
+    def __init__(self, config_path="config.json", overrides=None):
+        """初期化
+
+        Args:
+            config_path: 設定ファイルのパス（ベースディレクトリからの相対パス）
+            overrides: 設定ファイルの値を上書きする辞書（バッチ実行時のユーザー情報など）
+        """
+        setup_logging()
+        _load_selenium()
         self.base_dir = self._get_base_dir()
         self.config = self.load_config(config_path)
+        self.config.update(overrides or {})
+        configure_logging(self.config.get("logging"))
         self.driver = None
+        # 起動に使用したドライバーのパス（Selenium Managerに任せた場合はNone）
+        self.driver_path = None
+        self.http_client = None
+        # ログインの同時実行数を制限するセマフォ（スケジューラーが設定）
+        self.login_gate = None
+        self.cache_dir = Path(self.base_dir) / "cache"
+        self.driver_cache = DriverCache(self.base_dir)
+        self.spans = SpanRecorder(self.base_dir, self.config)
+        self.screenshots = ScreenshotWriter(
+            Path(self.base_dir) / "screenshots", self.config.get("screenshots", {})
+        )
+        self.locator_chain = self._compile_locator_chain()
+        self.locator_stats = self._load_locator_stats()
+        self.page_context = PageContext()
+        # DevTools Protocol のバックエンド（driver_backend が "cdp" の場合のみ）
+        self.cdp = None
+        # 軽量モードのリクエストの振り分け（lean_mode.enabled が true の場合のみ）
+        self.lean_filter = None
+        # 共有ブラウザモードの場合のブラウザとブラウザコンテキスト
+        self.shared_browser = None
+        self.shared_context = None
+        # ログインが拒否された場合の理由（再試行しない）
+        self.login_error = None
+        # WebDriverのコマンドの所要時間の記録（profiler.enabled が true の場合のみ）
+        settings = self.config.get("profiler", {})
+        self.profiler = (
+            CommandProfiler(self.base_dir, settings) if settings.get("enabled", False) else None
+        )
 
     def _get_base_dir(self):
         """実行ファイルのベースディレクトリを取得"""
@@ -87,7 +2853,7 @@ class SalesforceAutoCheckInOut:
             return config
         except FileNotFoundError:
             logger.error(f"設定ファイル '{full_path}' が見つかりません")
-            print(f"\nエラー: config.json が見つかりません")
+            print("\nエラー: config.json が見つかりません")
             print(f"場所: {full_path}")
             print("\nconfig.json を実行ファイルと同じフォルダに配置してください。")
             input("Enterキーを押して終了...")
@@ -98,19 +2864,43 @@ class SalesforceAutoCheckInOut:
             input("Enterキーを押して終了...")
             sys.exit(1)
 
+    @_traced("setup_driver")
     def setup_driver(self):
-        """WebDriverをセットアップ（Chrome/Edge/Firefoxを自動検出）"""
+        """WebDriverをセットアップ（Chrome/Edge/Firefoxを自動検出、または browser: "remote" でSelenium Grid）
+
+        Raises:
+            PunchPhaseError: どのブラウザも起動できなかった場合（再試行の対象）
+        """
+        if self.shared_browser is not None:
+            # 共有ブラウザのブラウザコンテキストにタブを開いて操作する
+            self.driver, self.shared_context = self.shared_browser.open(self)
+            try:
+                self._prepare_driver(f"{self.shared_browser.browser} (shared)")
+            except Exception:
+                self._discard_driver()
+                raise
+            logger.info("共有ブラウザにブラウザコンテキストを作成しました")
+            return
+
         # 優先順位: config指定 > Chrome > Edge > Firefox
         browser_priority = self.config.get("browser", "auto")
 
         if browser_priority == "auto":
             browsers_to_try = ["chrome", "edge", "firefox"]
+            # 前回起動に成功したブラウザを最初に試す（失敗した場合のみ他を試す）
+            working = self.driver_cache.working_browser()
+            if working in browsers_to_try:
+                browsers_to_try.remove(working)
+                browsers_to_try.insert(0, working)
+                logger.info(f"前回起動に成功した{working.capitalize()}から試します")
         else:
             browsers_to_try = [browser_priority]
 
         for browser in browsers_to_try:
             try:
-                if browser == "chrome":
+                if browser == "remote":
+                    self.driver = self._setup_remote()
+                elif browser == "chrome":
                     self.driver = self._setup_chrome()
                 elif browser == "edge":
                     self.driver = self._setup_edge()
@@ -118,20 +2908,44 @@ class SalesforceAutoCheckInOut:
                     self.driver = self._setup_firefox()
                 else:
                     continue
-
-                if self.driver:
-                    self.driver.implicitly_wait(10)
-                    logger.info(f"{browser.capitalize()} WebDriverを起動しました")
-                    return
             except Exception as e:
                 logger.warning(f"{browser.capitalize()}の起動に失敗: {e}")
                 continue
+            if not self.driver:
+                continue
 
-        logger.error("利用可能なブラウザが見つかりませんでした")
-        sys.exit(1)
+            # 起動後の設定に失敗した場合は、起動したブラウザを閉じてから次のブラウザを試す
+            try:
+                self._prepare_driver(browser)
+            except Exception as e:
+                logger.warning(f"{browser.capitalize()}の起動後の設定に失敗: {e}")
+                self._discard_driver()
+                continue
+            if browser != "remote":
+                self.driver_cache.remember_working(browser, self.driver_path)
+            logger.info(f"{browser.capitalize()} WebDriverを起動しました")
+            return
+
+        raise PunchPhaseError("利用可能なブラウザが見つかりませんでした")
+
+    def _prepare_driver(self, browser):
+        """起動したWebDriverの共通の設定（プロファイラー・軽量モード・DevTools・暗黙の待機）"""
+        if self.profiler:
+            self.profiler.attach(self.driver)
+        self.spans.annotate(browser=browser)
+        self._apply_lean_blocking()
+        self._attach_cdp_backend()
+        self.driver.implicitly_wait(10)
+
+    def _chrome_options(self, remote=False):
+        """Chromeのオプションを作成（ローカル・リモート共通）
+
+        Args:
+            remote: リモート（Selenium Grid）で起動する場合True（ローカルのパスは指定しない）
+        """
+        with _startup_stage("ChromeのOptions"):
+            from selenium.webdriver.chrome.options import Options as ChromeOptions
 
-    def _setup_chrome(self):
-        """Chrome WebDriverをセットアップ"""
         chrome_options = ChromeOptions()
 
         # ヘッドレスモードの設定（設定ファイルで変更可能）
@@ -142,7 +2956,6 @@ class SalesforceAutoCheckInOut:
         # 基本オプション
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--start-maximized")
         chrome_options.add_argument("--disable-blink-features=AutomationControlled")
         chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         chrome_options.add_experimental_option("useAutomationExtension", False)
@@ -176,6 +2989,8 @@ class SalesforceAutoCheckInOut:
             # 翻訳プロンプトを無効化
             "translate.enabled": False,
         }
+        # 軽量モードの場合は画面サイズを固定し、画像の読み込みを止める
+        self._apply_lean_chromium_options(chrome_options, prefs)
         chrome_options.add_experimental_option("prefs", prefs)
 
         # 追加のオプション
@@ -184,18 +2999,35 @@ class SalesforceAutoCheckInOut:
         chrome_options.add_argument("--disable-infobars")
         chrome_options.add_argument("--disable-translate")
 
-        # ユーザーデータディレクトリの指定（オプション）
-        if "user_data_dir" in self.config and self.config["user_data_dir"]:
+        # ユーザーデータディレクトリの指定（オプション。リモートでは使用しない）
+        if not remote and self.config.get("user_data_dir"):
             chrome_options.add_argument(f"user-data-dir={self.config['user_data_dir']}")
 
-        if WEBDRIVER_MANAGER_AVAILABLE:
-            service = ChromeService(ChromeDriverManager().install())
-            return webdriver.Chrome(service=service, options=chrome_options)
-        else:
+        return chrome_options
+
+    def _setup_chrome(self):
+        """Chrome WebDriverをセットアップ"""
+        chrome_options = self._chrome_options()
+        with _startup_stage("ChromeのService"):
+            from selenium.webdriver.chrome.service import Service as ChromeService
+
+        def launch(driver_path):
+            if driver_path:
+                service = ChromeService(driver_path)
+                return webdriver.Chrome(service=service, options=chrome_options)
             return webdriver.Chrome(options=chrome_options)
 
-    def _setup_edge(self):
-        """Edge WebDriverをセットアップ"""
+        return self._launch_with_driver_cache("chrome", launch)
+
+    def _edge_options(self, remote=False):
+        """Edgeのオプションを作成（ローカル・リモート共通）
+
+        Args:
+            remote: リモート（Selenium Grid）で起動する場合True（ローカルのパスは指定しない）
+        """
+        with _startup_stage("EdgeのOptions"):
+            from selenium.webdriver.edge.options import Options as EdgeOptions
+
         edge_options = EdgeOptions()
 
         # ヘッドレスモード
@@ -206,7 +3038,6 @@ class SalesforceAutoCheckInOut:
         # 基本オプション
         edge_options.add_argument("--no-sandbox")
         edge_options.add_argument("--disable-dev-shm-usage")
-        edge_options.add_argument("--start-maximized")
         edge_options.add_argument("--disable-blink-features=AutomationControlled")
 
         # 言語設定（日本語優先）
@@ -238,6 +3069,8 @@ class SalesforceAutoCheckInOut:
             # 翻訳プロンプトを無効化
             "translate.enabled": False,
         }
+        # 軽量モードの場合は画面サイズを固定し、画像の読み込みを止める
+        self._apply_lean_chromium_options(edge_options, prefs)
         edge_options.add_experimental_option("prefs", prefs)
 
         # 追加のオプション
@@ -248,14 +3081,31 @@ class SalesforceAutoCheckInOut:
         edge_options.add_experimental_option("excludeSwitches", ["enable-automation"])
         edge_options.add_experimental_option("useAutomationExtension", False)
 
-        if WEBDRIVER_MANAGER_AVAILABLE:
-            service = EdgeService(EdgeChromiumDriverManager().install())
-            return webdriver.Edge(service=service, options=edge_options)
-        else:
+        return edge_options
+
+    def _setup_edge(self):
+        """Edge WebDriverをセットアップ"""
+        edge_options = self._edge_options()
+        with _startup_stage("EdgeのService"):
+            from selenium.webdriver.edge.service import Service as EdgeService
+
+        def launch(driver_path):
+            if driver_path:
+                service = EdgeService(driver_path)
+                return webdriver.Edge(service=service, options=edge_options)
             return webdriver.Edge(options=edge_options)
 
-    def _setup_firefox(self):
-        """Firefox WebDriverをセットアップ"""
+        return self._launch_with_driver_cache("edge", launch)
+
+    def _firefox_options(self, remote=False):
+        """Firefoxのオプションを作成（ローカル・リモート共通）
+
+        Args:
+            remote: リモート（Selenium Grid）で起動する場合True（ローカルのパスは指定しない）
+        """
+        with _startup_stage("FirefoxのOptions"):
+            from selenium.webdriver.firefox.options import Options as FirefoxOptions
+
         firefox_options = FirefoxOptions()
 
         # ヘッドレスモード
@@ -300,30 +3150,195 @@ class SalesforceAutoCheckInOut:
         # 翻訳プロンプトを無効化
         firefox_options.set_preference("browser.translations.enable", False)
 
+        # 軽量モード（画面サイズ固定・画像の読み込み停止・eager）
+        lean = self._lean_settings()
+        if lean:
+            width, height = lean["window_size"]
+            firefox_options.add_argument(f"--width={width}")
+            firefox_options.add_argument(f"--height={height}")
+            firefox_options.page_load_strategy = lean["page_load_strategy"]
+            if "Image" in lean["block_resource_types"]:
+                firefox_options.set_preference("permissions.default.image", 2)
+
         # その他の設定
         firefox_options.set_preference("browser.tabs.warnOnClose", False)
         firefox_options.set_preference("browser.shell.checkDefaultBrowser", False)
 
-        if WEBDRIVER_MANAGER_AVAILABLE:
-            service = FirefoxService(GeckoDriverManager().install())
-            return webdriver.Firefox(service=service, options=firefox_options)
-        else:
+        return firefox_options
+
+    def _setup_firefox(self):
+        """Firefox WebDriverをセットアップ"""
+        firefox_options = self._firefox_options()
+        with _startup_stage("FirefoxのService"):
+            from selenium.webdriver.firefox.service import Service as FirefoxService
+
+        def launch(driver_path):
+            if driver_path:
+                service = FirefoxService(driver_path)
+                return webdriver.Firefox(service=service, options=firefox_options)
             return webdriver.Firefox(options=firefox_options)
 
+        return self._launch_with_driver_cache("firefox", launch)
+
+    def _setup_remote(self):
+        """Selenium Grid（リモートのWebDriver）でブラウザのセッションを作成
+
+        remote.url のGridに、remote.browser（chrome/edge/firefox）のオプションで
+        セッションを作成する。オプションはローカルで起動する場合と同じ。
+        """
+        settings = self.config.get("remote", {})
+        url = settings.get("url")
+        browser = settings.get("browser", "chrome")
+        if not url:
+            raise ValueError("remote.url（GridのURL）が設定されていません")
+        options = {
+            "chrome": self._chrome_options,
+            "edge": self._edge_options,
+            "firefox": self._firefox_options,
+        }[browser](remote=True)
+        with _startup_stage(f"リモートセッション作成 ({browser})"):
+            driver = webdriver.Remote(command_executor=url, options=options)
+        logger.info(f"Selenium Grid（{url}）で{browser.capitalize()}のセッションを作成しました")
+        return driver
+
+    def _attach_cdp_backend(self):
+        """driver_backend が "cdp" の場合、DevTools Protocol に直接接続する（できない場合はSelenium）"""
+        if self.config.get("driver_backend", "selenium") != "cdp":
+            return
+        try:
+            self.cdp = CdpBackend(self.driver)
+        except Exception as e:
+            logger.warning(f"DevToolsに接続できないため、Seleniumで操作します: {e}")
+            return
+        self.spans.annotate(backend="cdp")
+        logger.info("ボタンの探索とクリックはDevTools Protocolで行います")
+
+    def _drop_cdp_backend(self, error):
+        """DevTools Protocol での操作に失敗した場合、以降はSeleniumで操作する"""
+        logger.warning(f"DevToolsでの操作に失敗したため、Seleniumに切り替えます: {error}")
+        self.cdp.close()
+        self.cdp = None
+
+    def _attach_to_browser(self, browser, address):
+        """起動済みのChrome/Edge（DevToolsのアドレス）に接続するWebDriverを作成"""
+        if browser == "edge":
+            from selenium.webdriver.edge.options import Options
+            from selenium.webdriver.edge.service import Service
+
+            factory = webdriver.Edge
+        else:
+            from selenium.webdriver.chrome.options import Options
+            from selenium.webdriver.chrome.service import Service
+
+            factory = webdriver.Chrome
+        options = Options()
+        options.debugger_address = address
+
+        def launch(driver_path):
+            if driver_path:
+                return factory(service=Service(driver_path), options=options)
+            return factory(options=options)
+
+        return self._launch_with_driver_cache(browser, launch)
+
+    def _lean_settings(self):
+        """軽量モードの設定（無効の場合はNone）"""
+        settings = self.config.get("lean_mode", {})
+        if not settings.get("enabled", False):
+            return None
+        return {**_LEAN_DEFAULTS, **settings}
+
+    def _apply_lean_chromium_options(self, options, prefs):
+        """Chrome/Edgeのオプションに軽量モードを反映（無効の場合は最大化して起動）"""
+        lean = self._lean_settings()
+        if not lean:
+            options.add_argument("--start-maximized")
+            return
+        width, height = lean["window_size"]
+        options.add_argument(f"--window-size={width},{height}")
+        options.page_load_strategy = lean["page_load_strategy"]
+        # 画像は許可リストのURLを除いてリクエスト単位でブロックする（_apply_lean_blocking）
+
+    def _apply_lean_blocking(self):
+        """軽量モードのリクエストのブロックをDevToolsで設定（Chrome/Edgeのみ）"""
+        lean = self._lean_settings()
+        if not lean:
+            return
+        if not hasattr(self.driver, "execute_cdp_cmd"):
+            logger.info("軽量モードのリクエストのブロックはChrome/Edgeのみ対応しています")
+            return
+        try:
+            self.lean_filter = LeanRequestFilter(self.driver, lean)
+        except Exception as e:
+            logger.warning(f"軽量モードのリクエストのブロックを設定できませんでした: {e}")
+            return
+        logger.info(
+            f"軽量モード: {len(self.lean_filter.patterns)}件のパターンに一致するリクエストを"
+            "ブロックします（許可リストのURLを除く）"
+        )
+
+    def _launch_with_driver_cache(self, browser, launch):
+        """キャッシュしたドライバーでブラウザを起動
+
+        前回と異なるバージョンのブラウザで起動に失敗した場合は、
+        バックグラウンドでのドライバー更新を待って1回だけ再試行する。
+
+        Args:
+            browser: "chrome" / "edge" / "firefox"
+            launch: ドライバーのパス（Noneの場合はSelenium Managerに任せる）を受け取り、WebDriverを返す関数
+        """
+        start = time.perf_counter()
+        with _startup_stage(f"ドライバー解決 ({browser})"):
+            driver_path, refresh = self.driver_cache.resolve(browser)
+        logger.info(
+            f"{browser.capitalize()}ドライバーを解決しました（{time.perf_counter() - start:.3f}秒）: "
+            f"{driver_path or 'Selenium Manager'}"
+        )
+        try:
+            with _startup_stage(f"ブラウザ起動 ({browser})"):
+                driver = launch(driver_path)
+        except Exception:
+            if refresh is None:
+                raise
+            logger.info("キャッシュのドライバーで起動できなかったため、更新を待って再試行します")
+            refresh.join()
+            if not refresh.driver_path or refresh.driver_path == driver_path:
+                raise
+            driver_path = refresh.driver_path
+            driver = launch(driver_path)
+
+        # 起動後の設定が成功してから「前回起動に成功したブラウザ」として記録する（setup_driver）
+        self.driver_path = driver_path
+        return driver
+
+    @_traced("login")
     def login(self):
-        """Salesforceにログイン"""
+        """Salesforceにログイン（保存済みのセッションが有効ならフォーム入力を省略）"""
+        if self._restore_session():
+            self.spans.annotate(method="session_cache")
+            return True
+
+        self.spans.annotate(method="form")
+        self.login_error = None
+        # スケジューラーから実行された場合は、組織ごとのログインの同時実行数を制限する
+        login_gate = self.login_gate
+        if login_gate is not None:
+            with self.spans.span("login_gate_wait"):
+                login_gate.acquire()
         try:
             logger.info("Salesforceにアクセスします...")
             self.driver.get(self.config["salesforce_url"])
 
-            # ログインページの読み込み待機
-            time.sleep(2)
-
-            # ユーザー名入力
+            # ユーザー名入力（ログインフォームが表示され次第入力）
             logger.info("ユーザー名を入力します...")
-            username_field = WebDriverWait(self.driver, 20).until(
-                EC.presence_of_element_located((By.ID, "username"))
+            username_field = self._wait_for_signal(
+                "ログインフォーム表示",
+                EC.presence_of_element_located((By.ID, "username")),
+                self._readiness_timeout("login_form"),
             )
+            if username_field is None:
+                raise TimeoutException()
+            login_host = urlparse(self.driver.current_url).netloc
             username_field.clear()
             username_field.send_keys(self.config["username"])
 
@@ -338,21 +3353,25 @@ class SalesforceAutoCheckInOut:
             login_button = self.driver.find_element(By.ID, "Login")
             login_button.click()
 
-            # ログイン後のページ読み込み待機
-            time.sleep(5)
-            logger.info("ログインに成功しました")
-
-            # ページが完全に読み込まれるまで追加待機
-            WebDriverWait(self.driver, 10).until(
-                lambda d: d.execute_script("return document.readyState") == "complete"
+            # ログインホストから遷移するまで待機（ログインエラーは即座に検出）
+            outcome = self._wait_for_signal(
+                "ログイン後の遷移",
+                lambda d: self._login_outcome(d, login_host),
+                self._readiness_timeout("url_change"),
             )
-            logger.info("ページの読み込みが完了しました")
-
-            # TeamSpiritウィジェットの読み込みを待つ
-            logger.info("TeamSpiritウィジェットの読み込みを待機中...")
-            time.sleep(10)
-            logger.info("追加待機が完了しました")
+            if login_gate is not None:
+                login_gate.release()
+                login_gate = None
+            if outcome is None:
+                raise TimeoutException()
+            if outcome != "ok":
+                logger.error(f"ログインに失敗しました: {outcome}")
+                self.login_error = outcome
+                return False
+            logger.info("ログインに成功しました")
 
+            self.wait_for_lightning_ready()
+            self._save_session()
             return True
 
         except TimeoutException:
@@ -364,165 +3383,575 @@ class SalesforceAutoCheckInOut:
         except Exception as e:
             logger.error(f"ログイン中にエラーが発生しました: {e}")
             return False
+        finally:
+            if login_gate is not None:
+                login_gate.release()
+
+    @_traced("wait_for_lightning_ready")
+    def wait_for_lightning_ready(self):
+        """Lightningのページが操作可能になるまで待機
+
+        固定時間の待機ではなく、以下のシグナルを順に確認し、
+        満たされた時点で次へ進む（各シグナルにタイムアウトあり）:
+            1. document.readyState == "complete"
+            2. force-aloha-page のShadow Root内にVisualforce iframeが出現
+            3. DOMの変更とリソース読み込みが一定時間止まる（アイドル）
+
+        Returns:
+            bool: すべてのシグナルがタイムアウト前に満たされた場合True
+        """
+        start = time.perf_counter()
+
+        ready_state = self._wait_for_signal(
+            "document.readyState",
+            lambda d: d.execute_script("return document.readyState") == "complete",
+            self._readiness_timeout("ready_state"),
+        )
+        if ready_state:
+            logger.info("ページの読み込みが完了しました")
+
+        logger.info("TeamSpiritウィジェットの読み込みを待機中...")
+        widget = self._wait_for_signal(
+            "force-aloha-page (Shadow DOM)",
+            lambda d: d.execute_script(_ALOHA_IFRAME_JS) is not None,
+            self._readiness_timeout("aloha_page"),
+        )
+
+        idle = self._wait_for_dom_idle()
+
+        logger.info(
+            f"Lightningの準備待機が完了しました（合計 {time.perf_counter() - start:.2f}秒）"
+        )
+        return bool(ready_state and widget and idle)
+
+    def _wait_for_dom_idle(self):
+        """MutationObserverとリソース読み込み数でDOMのアイドル状態を待機"""
+        quiet_ms = int(self._readiness_config().get("idle_window_ms", 500))
+        timeout = self._readiness_timeout("idle")
+        start = time.perf_counter()
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            idle = self.driver.execute_async_script(
+                _DOM_IDLE_JS, quiet_ms, int(timeout * 1000)
+            )
+        except Exception as e:
+            logger.warning(f"準備シグナル「DOMアイドル」の確認中にエラー: {e}")
+            return False
+        elapsed = time.perf_counter() - start
+        if idle:
+            logger.info(f"準備シグナル「DOMアイドル」: {elapsed:.2f}秒")
+        else:
+            logger.warning(f"準備シグナル「DOMアイドル」がタイムアウトしました（{timeout}秒）")
+        return bool(idle)
+
+    def _wait_for_signal(self, name, condition, timeout):
+        """準備シグナルを待機し、所要時間をログ出力する
+
+        Returns:
+            条件の戻り値。タイムアウトした場合はNone
+        """
+        start = time.perf_counter()
+        try:
+            result = WebDriverWait(self.driver, timeout, poll_frequency=0.2).until(
+                condition
+            )
+        except TimeoutException:
+            logger.warning(f"準備シグナル「{name}」がタイムアウトしました（{timeout}秒）")
+            return None
+        logger.info(f"準備シグナル「{name}」: {time.perf_counter() - start:.2f}秒")
+        return result
+
+    @staticmethod
+    def _login_outcome(driver, login_host):
+        """ログインボタン押下後の状態を判定（未確定の場合はFalse）"""
+        error = driver.execute_script(_LOGIN_ERROR_JS)
+        if error:
+            return error
+        if urlparse(driver.current_url).netloc != login_host:
+            return "ok"
+        return False
+
+    def _readiness_config(self):
+        """準備待機の設定を取得"""
+        return self.config.get("readiness", {})
+
+    def _readiness_timeout(self, signal):
+        """準備シグナルごとのタイムアウト（秒）を取得"""
+        return float(
+            self._readiness_config().get(
+                f"{signal}_timeout", _READINESS_TIMEOUTS[signal]
+            )
+        )
+
+    def _session_cache_enabled(self):
+        """セッション保存が利用可能かどうか（有効にした場合で、Chrome/Edgeかつ暗号化が利用可能な場合のみ）"""
+        if not self.config.get("session_cache", {}).get("enabled", False):
+            return False
+        return hasattr(self.driver, "execute_cdp_cmd") and _encryption_available()
+
+    def _session_path(self):
+        """組織（ログインURLのホスト）とユーザー名ごとのセッション保存先"""
+        org = urlparse(self.config["salesforce_url"]).netloc
+        key = hashlib.sha256(f"{org}\n{self.config['username']}".encode("utf-8"))
+        return self.cache_dir / "sessions" / f"{key.hexdigest()[:32]}.bin"
+
+    def _save_session(self):
+        """ログイン後のCookieを暗号化して保存"""
+        if not self._session_cache_enabled():
+            return
+        try:
+            cookies = self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+            session = {
+                "saved_at": time.time(),
+                "home_url": self.driver.current_url,
+                "cookies": [
+                    {k: v for k, v in cookie.items() if k in _COOKIE_PARAM_KEYS}
+                    for cookie in cookies
+                ],
+            }
+            path = self._session_path()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = _protect(json.dumps(session).encode("utf-8"), self.cache_dir)
+            with open(path, "wb") as f:
+                f.write(data)
+            logger.info(f"セッションを保存しました（Cookie {len(cookies)}件）")
+        except Exception as e:
+            logger.warning(f"セッションを保存できませんでした: {e}")
+
+    def _restore_session(self):
+        """保存済みのCookieを復元し、ログインフォームを経由せずにホーム画面を開く
+
+        Returns:
+            bool: セッションが受け入れられた場合True（拒否された場合は保存済みセッションを削除）
+        """
+        if not self._session_cache_enabled():
+            return False
+        path = self._session_path()
+        try:
+            with open(path, "rb") as f:
+                session = json.loads(_unprotect(f.read(), self.cache_dir))
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"保存済みセッションを読み込めませんでした: {e}")
+            self._discard_session()
+            return False
+
+        max_age = float(self.config.get("session_cache", {}).get("max_age_hours", 12))
+        now = time.time()
+        if now - session["saved_at"] > max_age * 3600:
+            logger.info("保存済みセッションの有効期限が切れています")
+            self._discard_session()
+            return False
+        cookies = [
+            cookie
+            for cookie in session["cookies"]
+            if cookie.get("expires", -1) <= 0 or cookie["expires"] > now
+        ]
+
+        try:
+            logger.info("保存済みセッションでSalesforceにアクセスします...")
+            self.driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+            self.driver.get(session["home_url"])
+            outcome = self._wait_for_signal(
+                "セッション復元",
+                self._session_outcome,
+                self._readiness_timeout("url_change"),
+            )
+        except Exception as e:
+            logger.warning(f"セッションの復元中にエラーが発生しました: {e}")
+            outcome = None
+
+        if outcome != "ok":
+            logger.info("保存済みセッションが拒否されたため、ログインフォームからログインします")
+            self._discard_session()
+            try:
+                self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            except Exception:
+                pass
+            return False
 
-    def click_checkin_button(self, work_location=None):
-        """出勤ボタンをクリック"""
-        # 勤務場所が指定されている場合、先にタブをクリック
-        if work_location:
-            if not self._click_location_tab(work_location):
-                logger.warning(
-                    f"勤務場所「{work_location}」の選択に失敗しましたが、続行します"
-                )
+        logger.info("保存済みセッションでログインしました（ログインフォームを省略）")
+        self.wait_for_lightning_ready()
+        return True
+
+    @staticmethod
+    def _session_outcome(driver):
+        """セッション復元後の状態を判定（未確定の場合はFalse）"""
+        return driver.execute_script(_SESSION_OUTCOME_JS) or False
+
+    def _discard_session(self):
+        """保存済みセッションを削除"""
+        try:
+            self._session_path().unlink()
+        except FileNotFoundError:
+            pass
 
-        return self._click_button("checkin", "出勤")
+    def _require_selector(self, button_type):
+        """ボタンのセレクタータイプを確認（不正な場合は再試行しない）"""
+        selector_type = self.config["buttons"][button_type]["selector_type"]
+        if not self._by_type(selector_type):
+            raise PunchPhaseError(f"不正なセレクタータイプ: {selector_type}", fatal=True)
+
+    def _phase_driver(self, state):
+        """ブラウザを起動"""
+        self.setup_driver()
+
+    def _phase_login(self, state):
+        """ログイン（拒否された場合は再試行しない）"""
+        if not self.login():
+            raise PunchPhaseError(
+                self.login_error or "ログインできませんでした",
+                fatal=self.login_error is not None,
+            )
 
-    def click_checkout_button(self, work_location=None):
-        """退勤ボタンをクリック"""
-        # 退勤前に出勤済みかチェック
-        if not self._check_already_checked_in():
+    def _phase_widget(self, state):
+        """TeamSpiritのウィジェットが表示されるまで待機（ページのフレームやボタンの記憶は破棄）"""
+        self.page_context.reset(self.driver)
+        if self.cdp:
+            self.cdp.buttons = {}
+        self.driver.switch_to.default_content()
+        if self.driver.execute_script(_ALOHA_IFRAME_JS) is None:
+            self.wait_for_lightning_ready()
+            if self.driver.execute_script(_ALOHA_IFRAME_JS) is None:
+                raise PunchPhaseError("TeamSpiritのウィジェットが表示されません")
+
+    def _phase_http(self, state):
+        """HTTPで打刻（http_punch.enabled が true の場合のみ。結果が出た場合は以降の段階を省略）"""
+        return self._try_http_punch(state["action"], state["work_location"])
+
+    def _phase_location(self, state):
+        """勤務場所タブをクリック（勤務場所の指定がない場合は何もしない）"""
+        if state["work_location"] and not self._click_location_tab(state["work_location"]):
+            raise PunchPhaseError(f"勤務場所「{state['work_location']}」を選択できませんでした")
+
+    def _phase_verify(self, state):
+        """打刻の状態を確認（打刻済み・未出勤の場合はクリックせずに終了）"""
+        self._require_selector("checkin")
+        punch_state = self.read_punch_state()
+        if punch_state is None:
+            raise PunchPhaseError("出勤・退勤ボタンが見つかりません")
+        state["punch_state"] = punch_state
+        if state["action"] == "出勤":
+            if punch_state["state"] in ("checked_in", "checked_out"):
+                return "already_done"
+        elif punch_state["state"] == "not_checked_in":
             logger.warning("まだ出勤していません。退勤処理をスキップします。")
             return "not_checked_in"
+        elif punch_state["state"] == "checked_out":
+            return "already_done"
+        return None
 
-        # 勤務場所が指定されている場合、先にタブをクリック
-        if work_location:
-            if not self._click_location_tab(work_location):
-                logger.warning(
-                    f"勤務場所「{work_location}」の選択に失敗しましたが、続行します"
-                )
+    def _phase_click(self, state):
+        """出勤・退勤ボタンをクリック"""
+        button_type = "checkin" if state["action"] == "出勤" else "checkout"
+        self._require_selector(button_type)
+        result = self._click_button(button_type, state["action"])
+        if result is False:
+            raise PunchPhaseError(f"{state['action']}ボタンをクリックできませんでした")
+        if result == "already_done":
+            return result
+        state["clicked"] = result
+        return None
 
-        return self._click_button("checkout", "退勤")
+    def _phase_confirm(self, state):
+        """打刻が記録されたことを確認（証拠が現れた時点で終了、confirm.timeout 秒で失敗）"""
+        if self._confirm_punch(state):
+            return True
+        raise PunchPhaseError(f"{state['action']}の打刻を確認できませんでした")
 
-    def _click_location_tab(self, location_name):
-        """勤務場所タブをクリック（自宅、本社など）"""
-        try:
-            logger.info(f"勤務場所「{location_name}」タブを探しています...")
+    @_traced("confirm_punch")
+    def _confirm_punch(self, state):
+        """クリックしたボタンのフレームで、打刻が記録された証拠を待つ
 
-            # Shadow DOM内のiframeで探す
-            try:
-                js_code = """
-                const alohaPage = document.querySelector('force-aloha-page');
-                if (alohaPage && alohaPage.shadowRoot) {
-                    const vfIframe = alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]');
-                    return vfIframe;
-                }
-                return null;
-                """
-                vf_iframe = self.driver.execute_script(js_code)
+        証拠は、打刻時刻の欄（status.start_time_selector / end_time_selector）が埋まること、
+        または打刻要求（confirm.request_pattern に一致するURL）の応答後もボタンが無効のままであること。
+        応答を観測できない場合は、タイムアウトの時点でボタンが無効なら成功とする。
 
-                if vf_iframe:
-                    self.driver.switch_to.frame(vf_iframe)
-                    time.sleep(2)
-            except Exception as e:
-                logger.info(f"Shadow DOM探索: {e}")
-
-            # タブ要素を探す（複数のセレクタで試行）
-            tab_selectors = [
-                f"//div[text()='{location_name}']",
-                f"//span[text()='{location_name}']",
-                f"//button[text()='{location_name}']",
-                f"//*[contains(@class, 'tab') and text()='{location_name}']",
-                f"//*[@role='tab' and text()='{location_name}']",
-            ]
+        Returns:
+            bool: 確認できた場合True
+        """
+        action = state["action"]
+        clicked = state["clicked"]
+        settings = self.config.get("confirm", {})
+        timeout = float(settings.get("timeout", 15))
+        time_key = "start_time" if action == "出勤" else "end_time"
+        time_selector = self.config.get("status", {}).get(
+            f"{time_key}_selector", "#pwStartTime" if action == "出勤" else "#pwEndTime"
+        )
+        previous_time = (state.get("punch_state") or {}).get(time_key)
+        args = (
+            _BUTTON_IDS[action],
+            action,
+            time_selector,
+            previous_time,
+            int((time.perf_counter() - clicked["clicked_at"]) * 1000),
+            settings.get("request_pattern", "/apexremote"),
+            int(settings.get("settle_ms", 300)),
+        )
 
-            for selector in tab_selectors:
-                try:
-                    tabs = self.driver.find_elements(By.XPATH, selector)
-                    for tab in tabs:
-                        if tab.text.strip() == location_name:
-                            tab.click()
-                            logger.info(
-                                f"★ 勤務場所「{location_name}」タブをクリックしました"
-                            )
-                            time.sleep(2)
-                            return True
-                except:
-                    continue
+        logger.info(f"{action}の打刻が記録されたことを確認しています...")
+        start = time.perf_counter()
+        element = clicked["element"]
+        try:
+            if isinstance(element, CdpElement):
+                result = self.cdp.call_async(element, _PUNCH_CONFIRM_JS, *args, timeout=timeout)
+            else:
+                result = self._wait_in_page(_PUNCH_CONFIRM_JS, *args, timeout=timeout)
+        except CdpError as e:
+            logger.warning(f"打刻の確認中にエラーが発生しました: {e}")
+            result = None
+        elapsed = time.perf_counter() - start
+
+        if result is None:
+            self.spans.annotate(result="interrupted")
+            logger.error(f"✗ 打刻の確認中にページが切り替わりました（{elapsed:.2f}秒）")
+            return False
+        if not result["confirmed"]:
+            reasons = {
+                "http_error": f"打刻要求がエラーになりました（HTTP {result.get('status')}）",
+                "rejected": "打刻要求の応答後にボタンが有効に戻りました（打刻が拒否されました）",
+                "timeout": f"{timeout:g}秒以内に打刻時刻の欄が埋まらず、打刻要求の応答も確認できませんでした",
+            }
+            self.spans.annotate(result=result["reason"])
+            logger.error(f"✗ {reasons.get(result['reason'], result['reason'])}")
+            return False
 
-            # JavaScriptで探す
-            js_find_tab = f"""
-            const allElements = document.querySelectorAll('[class*="tab"], [role="tab"], button, div, span');
-            for (const el of allElements) {{
-                if (el.textContent.trim() === '{location_name}') {{
-                    el.click();
-                    return true;
-                }}
-            }}
-            return false;
-            """
-            result = self.driver.execute_script(js_find_tab)
-            if result:
-                logger.info(
-                    f"★ 勤務場所「{location_name}」タブをクリックしました（JS）"
-                )
-                time.sleep(2)
-                return True
+        evidence = {
+            "time_cell": f"打刻時刻 {result.get('time')}",
+            "response": "打刻要求の応答とボタンの無効化",
+            "button_disabled": "ボタンの無効化のみ（打刻要求の応答は観測できませんでした）",
+        }[result["evidence"]]
+        self.spans.annotate(evidence=result["evidence"])
+        if result["evidence"] == "button_disabled":
+            logger.warning(f"✓ 打刻を確認しました（{evidence}、{elapsed:.2f}秒）")
+        else:
+            logger.info(f"✓ 打刻を確認しました（{evidence}、{elapsed:.2f}秒）")
+        return True
 
-            logger.warning(f"勤務場所「{location_name}」タブが見つかりませんでした")
+    def _driver_alive(self):
+        """ブラウザ（WebDriverのセッション）が応答するか"""
+        try:
+            self.driver.current_url
+            return True
+        except Exception:
             return False
 
-        except Exception as e:
-            logger.error(f"勤務場所タブのクリック中にエラーが発生しました: {e}")
-            return False
+    def _discard_driver(self):
+        """ブラウザを破棄（起動し直す前に呼ぶ。応答しない場合も例外は出さない）"""
+        if self.cdp:
+            try:
+                self.cdp.close()
+            except Exception:
+                pass
+            self.cdp = None
+        if self.lean_filter:
+            try:
+                self.lean_filter.close()
+            except Exception:
+                pass
+            self.lean_filter = None
+        if self.http_client:
+            self.http_client.close()
+            self.http_client = None
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning(f"ブラウザを閉じられませんでした: {e}")
+            self.driver = None
+        if self.shared_context is not None:
+            self.shared_browser.close_context(self.shared_context)
+            self.shared_context = None
+
+    def _phase_policy(self, phase):
+        """段階の再試行の設定（_PHASE_POLICIES に recovery.phases を上書き）"""
+        overrides = self.config.get("recovery", {}).get("phases", {}).get(phase, {})
+        policy = {**_PHASE_POLICIES[phase], **overrides}
+        if phase == "click":
+            # 二重打刻を防ぐため、クリックは設定にかかわらず同じページで再試行しない
+            policy.update(retries=0, required=True)
+        return policy
+
+    def _run_phases(self, action_type, work_location, first_phase="driver"):
+        """打刻の段階を順に実行し、失敗した段階だけをやり直す
+
+        失敗した段階は、まず同じセッションでその段階だけを retries 回まで再試行する。
+        それでも失敗した場合はページを再読み込みしてウィジェットの段階から
+        （recovery.reloads 回まで）、さらにブラウザを起動し直して最初から
+        （recovery.relaunches 回まで）やり直す。ブラウザが応答しない場合と、
+        ログインまでの段階の失敗は再読み込みを省略する。
+
+        Returns:
+            tuple: (結果（_click_button と同じ意味）, 失敗した段階（成功した場合はNone）)
+        """
+        settings = self.config.get("recovery", {})
+        reloads = int(settings.get("reloads", 1))
+        relaunches = int(settings.get("relaunches", 1))
+        retry_delay = float(settings.get("retry_delay", 1))
+
+        phases = list(_PUNCH_PHASES)
+        state = {"action": action_type, "work_location": work_location}
+        index = phases.index(first_phase)
+        attempt = 1
+        while index < len(phases):
+            phase = phases[index]
+            label = _PUNCH_PHASES[phase]
+            policy = self._phase_policy(phase)
+            try:
+                with self.spans.span(f"phase.{phase}", attempt=attempt):
+                    result = getattr(self, f"_phase_{phase}")(state)
+            except Exception as e:
+                logger.warning(f"✗ 段階「{label}」に失敗しました（{attempt}回目）: {e}")
+                if getattr(e, "fatal", False):
+                    return False, phase
+                alive = self._driver_alive()
+                # ブラウザの起動はブラウザがない状態から再試行する
+                if (alive or phase == "driver") and attempt <= int(policy["retries"]):
+                    attempt += 1
+                    logger.info(f"★ 段階「{label}」を再試行します")
+                    time.sleep(retry_delay)
+                    continue
+                if not policy["required"] and alive:
+                    logger.warning(f"段階「{label}」を省略して続行します")
+                    index += 1
+                    attempt = 1
+                    continue
+                if alive and index > phases.index("login") and reloads > 0:
+                    reloads -= 1
+                    logger.info("★ ページを再読み込みして、ウィジェットの待機からやり直します")
+                    try:
+                        self.driver.refresh()
+                        index = phases.index("widget")
+                        attempt = 1
+                        continue
+                    except Exception as e:
+                        logger.warning(f"ページを再読み込みできませんでした: {e}")
+                if relaunches > 0:
+                    relaunches -= 1
+                    logger.info("★ ブラウザを起動し直して、最初からやり直します")
+                    self._discard_driver()
+                    index = 0
+                    attempt = 1
+                    continue
+                return False, phase
+            if result is not None:
+                return result, None
+            index += 1
+            attempt = 1
+        return True, None
+
+    @_traced("http_punch")
+    def _try_http_punch(self, action_type, work_location=None):
+        """ブラウザの代わりにHTTPで打刻を試みる（http_punch.enabled が true の場合のみ）
+
+        Returns:
+            打刻結果（_click_button と同じ意味）。ブラウザでのクリックに
+            フォールバックする場合はNone
+        """
+        settings = self.config.get("http_punch", {})
+        if not settings.get("enabled", False) or not hasattr(self.driver, "execute_cdp_cmd"):
+            return None
 
-    def _check_already_checked_in(self):
-        """出勤済みかどうかをチェック"""
         try:
-            logger.info("出勤済みかどうかをチェックしています...")
+            page_url = settings.get("timesheet_url") or self.driver.execute_script(
+                _ALOHA_IFRAME_SRC_JS
+            )
+            if not page_url:
+                raise HttpPunchUnavailable("TeamSpiritのページのURLを取得できません")
 
-            # 出勤ボタンを探す
-            button_config = self.config["buttons"]["checkin"]
-            selector_type = button_config["selector_type"]
-            selector_value = button_config["selector_value"]
+            if self.http_client is None:
+                self.http_client = PooledHttpClient()
+            self.http_client.add_cookies(
+                self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+            )
 
-            by_type_map = {
-                "id": By.ID,
-                "name": By.NAME,
-                "class": By.CLASS_NAME,
-                "xpath": By.XPATH,
-                "css": By.CSS_SELECTOR,
-                "link_text": By.LINK_TEXT,
-                "partial_link_text": By.PARTIAL_LINK_TEXT,
-            }
+            logger.info(f"HTTPで{action_type}処理を行います...")
+            start = time.perf_counter()
+            result = TeamSpiritHttpPunch(self.http_client, page_url, settings).punch(
+                action_type, work_location
+            )
+            logger.info(
+                f"HTTPでの{action_type}処理が完了しました: {result}"
+                f"（{time.perf_counter() - start:.2f}秒）"
+            )
+            return result
+        except (HttpPunchUnavailable, OSError, http.client.HTTPException) as e:
+            logger.warning(f"HTTPでの打刻を中止し、ブラウザで処理します: {e}")
+            if getattr(e, "submitted", False):
+                # 送信済みの打刻を画面に反映させてから、ブラウザで状態を確認する
+                self.driver.refresh()
+                self.wait_for_lightning_ready()
+            return None
 
-            by_type = by_type_map.get(selector_type.lower())
-            if not by_type:
-                logger.error(f"不正なセレクタータイプ: {selector_type}")
-                return False
+    @_traced("location_tab")
+    def _click_location_tab(self, location_name):
+        """勤務場所タブをクリック（自宅、本社など）
 
-            # 出勤ボタンを探す（出勤ボタンのみを対象）
-            checkin_button = self._find_button_in_frames(
-                by_type, selector_value, target_button="出勤"
-            )
+        Visualforceのiframeとタブが現れるまでDOMの変更を監視して待機し
+        （location_tab_timeout 秒まで）、クリック後はタブが選択状態になるまで待機する。
+        """
+        self.spans.annotate(location=location_name)
+        timeout = float(self.config.get("location_tab_timeout", 10))
+        deadline = time.monotonic() + timeout
+        if self.cdp:
+            try:
+                tab = self.cdp.find_element(_CDP_LOCATION_TAB_JS, [location_name], timeout)
+                if tab is None:
+                    logger.warning(f"勤務場所「{location_name}」タブが見つかりませんでした")
+                    return False
+                self.cdp.click(tab)
+                logger.info(f"★ 勤務場所「{location_name}」タブをクリックしました（DevTools）")
+                return True
+            except Exception as e:
+                self._drop_cdp_backend(e)
+        try:
+            logger.info(f"勤務場所「{location_name}」タブを探しています...")
 
-            # 見つからなかった場合、IDで探す
-            if checkin_button is None:
-                checkin_button = self._find_button_by_id_everywhere("btnStInput")
+            # ボタンを見つけたフレーム、またはShadow DOM内のVisualforce iframeに切り替える
+            # （見つからない場合はメインフレームで探す）
+            if not self.page_context.enter() and self._wait_for_frame_path(
+                ["force-aloha-page >>> iframe[name^='vfFrameId']"], timeout
+            ) is None:
+                logger.info("Visualforceのiframeが見つからないため、メインフレームで探します")
+                self.driver.switch_to.default_content()
 
-            if checkin_button is None:
-                logger.warning("出勤ボタンが見つからないため、出勤状態を確認できません")
+            found = self._wait_in_page(
+                _LOCATION_TAB_WAIT_JS, location_name,
+                timeout=max(0.0, deadline - time.monotonic()),
+            )
+            if not found:
+                logger.warning(f"勤務場所「{location_name}」タブが見つかりませんでした")
                 return False
 
-            # ボタンが無効化されているかチェック（disabled="true"なら出勤済み）
-            is_disabled = checkin_button.get_attribute("disabled")
-            if is_disabled is not None:
-                logger.info("✓ 出勤済みです")
-                return True
-            else:
-                logger.warning("✗ まだ出勤していません")
-                return False
+            tab = found["element"]
+            try:
+                tab.click()
+                logger.info(f"★ 勤務場所「{location_name}」タブをクリックしました")
+            except Exception:
+                self.driver.execute_script("arguments[0].click();", tab)
+                logger.info(f"★ 勤務場所「{location_name}」タブをクリックしました（JS）")
+
+            selected = self._wait_in_page(
+                _TAB_SELECTED_JS, tab,
+                timeout=float(self.config.get("location_tab_settle", 2)),
+            )
+            if not selected:
+                logger.info("タブの選択状態を確認できませんでした（そのまま続行します）")
+            return True
 
         except Exception as e:
-            logger.error(f"出勤状態のチェック中にエラーが発生しました: {e}")
+            logger.error(f"勤務場所タブのクリック中にエラーが発生しました: {e}")
             return False
-        finally:
-            # メインフレームに戻る
-            try:
-                self.driver.switch_to.default_content()
-            except:
-                pass
 
+    @_traced("click_button")
     def _click_button(self, button_type, button_name):
-        """指定されたボタンをクリック"""
+        """指定されたボタンをクリック
+
+        Returns:
+            クリックしたボタン（_find_button_in_frames の戻り値にクリックした時刻 clicked_at を追加）。
+            既に押されている場合は "already_done"、失敗した場合はFalse
+        """
         try:
             button_config = self.config["buttons"][button_type]
             selector_type = button_config["selector_type"]
@@ -531,525 +3960,1784 @@ class SalesforceAutoCheckInOut:
             logger.info(f"{button_name}ボタンを探しています...")
 
             # セレクタータイプに応じて要素を検索
-            by_type_map = {
-                "id": By.ID,
-                "name": By.NAME,
-                "class": By.CLASS_NAME,
-                "xpath": By.XPATH,
-                "css": By.CSS_SELECTOR,
-                "link_text": By.LINK_TEXT,
-                "partial_link_text": By.PARTIAL_LINK_TEXT,
-            }
-
-            by_type = by_type_map.get(selector_type.lower())
+            by_type = self._by_type(selector_type)
             if not by_type:
                 logger.error(f"不正なセレクタータイプ: {selector_type}")
                 return False
 
-            # まずボタンの存在を確認（メインフレームとiframe）- target_buttonを指定
-            button = self._find_button_in_frames(
+            # Shadow DOM・iframeを横断してボタンを探す - target_buttonを指定
+            located = self._find_button_in_frames(
                 by_type, selector_value, target_button=button_name
             )
 
-            # 見つからなかった場合、IDで直接探す（フォールバック）
-            if button is None:
-                logger.info(
-                    f"{button_name}ボタンをIDで直接探します（フォールバック）..."
-                )
-                button_id = "btnStInput" if button_name == "出勤" else "btnEtInput"
-                button = self._find_button_by_id_everywhere(button_id)
-
-            if button is None:
+            if located is None:
                 logger.error(
                     f"{button_name}ボタンが見つかりませんでした（タイムアウト）"
                 )
                 return False
 
+            self.spans.annotate(button=button_name, strategy=located["strategy"])
+
             # ボタンが無効化されているかチェック（既に押された状態）
-            is_disabled = button.get_attribute("disabled")
-            if is_disabled is not None:
+            if located["disabled"]:
                 logger.info(f"既に{button_name}済みです")
                 return "already_done"
+            button = located["element"]
 
-            # ボタンをクリック
+            # ボタンをクリック（記録されたかどうかは _confirm_punch で確認する）
+            if isinstance(button, CdpElement):
+                self.cdp.click(button)
+                logger.info(f"{button_name}ボタンをクリックしました（DevTools）")
+                return {**located, "clicked_at": time.perf_counter()}
             try:
                 button.click()
                 logger.info(f"{button_name}ボタンをクリックしました")
-                time.sleep(3)
-                return True
-            except Exception as e:
+            except Exception:
                 # JavaScriptでクリックを試行
                 logger.info("JavaScriptでクリックを試行します...")
                 self.driver.execute_script("arguments[0].click();", button)
                 logger.info(f"{button_name}ボタンをクリックしました")
-                time.sleep(3)
-                return True
+            return {**located, "clicked_at": time.perf_counter()}
 
         except Exception as e:
             logger.error(f"{button_name}ボタンのクリック中にエラーが発生しました: {e}")
             return False
 
-    def _find_button_in_frames(self, by_type, selector_value, target_button=None):
-        """メインフレームとすべてのiframe内でボタンを探す
+    @_traced("find_button", outcome=lambda button: "ok" if button else "not_found")
+    def _find_button_in_frames(self, by_type, selector_value, target_button=None):
+        """探索戦略チェーンでボタンを探す
+
+        同じ処理の中で探索済みのフレームやボタンがあれば（ページコンテキスト）、探索せずに再利用する。
+        なければ前回成功した戦略から順に、各戦略をその予算（budget秒）内で試す。
+        ボタンが見つかるか button_timeout 秒経過するまでチェーンを繰り返す。
+        戦略ごとの成功・失敗回数と所要時間は cache/locator_stats.json に保存される。
+
+        Args:
+            by_type: Byタイプ
+            selector_value: セレクター値
+            target_button: 探しているボタン名（"出勤" または "退勤"）。Noneの場合は両方対象
+
+        Returns:
+            dict: element, frame_path, id, value, disabled, strategy を持つ辞書。見つからない場合はNone
+        """
+        if self.cdp:
+            try:
+                return self._find_button_cdp(by_type, selector_value, target_button)
+            except Exception as e:
+                self._drop_cdp_backend(e)
+
+        button = self._button_from_page_context(target_button)
+        if button:
+            self.spans.annotate(strategy=button["strategy"])
+            logger.info(
+                f"★探索済みのボタンを再利用します: id={button['id']}, value={button['value']}, "
+                f"disabled={button['disabled']}, frame_path={button['frame_path']}"
+            )
+            return button
+
+        timeout = float(self.config.get("button_timeout", 60))
+        deadline = time.monotonic() + timeout
+        # フレームパスの戦略はボタンのIDを使うため、探すボタンが決まっている場合のみ試す
+        chain = [
+            strategy
+            for strategy in self._ordered_locator_chain()
+            if strategy["deep"] or target_button in _BUTTON_IDS
+        ]
+        if not chain:
+            logger.warning(
+                "出勤・退勤の両方を探す場合に使える探索戦略（deep）がありません。"
+                "locator_chain を確認してください"
+            )
+            return None
+        logger.info("探索戦略の順序: " + " → ".join(s["name"] for s in chain))
+
+        try:
+            while True:
+                for strategy in chain:
+                    budget = max(0.0, min(strategy["budget"], deadline - time.monotonic()))
+                    start = time.perf_counter()
+                    button = self._run_locator_strategy(
+                        strategy, by_type, selector_value, target_button, budget
+                    )
+                    elapsed = time.perf_counter() - start
+                    self._record_locator_stat(strategy["name"], button is not None, elapsed)
+
+                    if button:
+                        button["strategy"] = strategy["name"]
+                        self.page_context.remember(target_button, button)
+                        self.spans.annotate(strategy=strategy["name"])
+                        if "waited" in button:
+                            self.spans.annotate(widget_wait=button["waited"])
+                            logger.info(f"ウィジェットの出現まで {button['waited']:.2f}秒")
+                        logger.info(
+                            f"★探索戦略「{strategy['name']}」でボタン発見（{elapsed:.2f}秒）: "
+                            f"id={button['id']}, value={button['value']}, "
+                            f"disabled={button['disabled']}, frame_path={button['frame_path']}"
+                        )
+                        return button
+                    logger.info(
+                        f"探索戦略「{strategy['name']}」: 見つかりませんでした（{elapsed:.2f}秒）"
+                    )
+
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            self._save_locator_stats()
+
+        self.driver.switch_to.default_content()
+        logger.warning(
+            f"{target_button or '出勤/退勤'}ボタンが見つかりませんでした（{timeout}秒待機後）"
+        )
+        return None
+
+    def _find_button_cdp(self, by_type, selector_value, target_button):
+        """DevTools Protocol でボタンを探す（button_timeout 秒まで待機）"""
+        timeout = float(self.config.get("button_timeout", 60))
+        css, xpath = self._selector_for_js(by_type, selector_value)
+        start = time.perf_counter()
+        button = self.cdp.find_button(target_button, css, xpath, timeout)
+        if button is None:
+            logger.warning(
+                f"{target_button or '出勤/退勤'}ボタンが見つかりませんでした（{timeout}秒待機後）"
+            )
+            return None
+        button["strategy"] = "cdp"
+        self.spans.annotate(strategy="cdp")
+        logger.info(
+            f"★DevToolsでボタン発見（{time.perf_counter() - start:.2f}秒）: "
+            f"id={button['id']}, value={button['value']}, "
+            f"disabled={button['disabled']}, frame_path={button['frame_path']}"
+        )
+        return button
+
+    def _button_from_page_context(self, target_button):
+        """ページコンテキストからボタンを取得する
+
+        保持しているボタンがあればその状態を更新して返し、なければ
+        保持しているフレームでボタンのIDを1回だけ確認する（待機しない）。
+
+        Returns:
+            dict: _find_button_in_frames と同じ形式（strategy は "page_context"）。見つからない場合はNone
+        """
+        context = self.page_context
+        button = context.button(target_button)
+        if button is None and target_button in _BUTTON_IDS and context.enter():
+            info = self._wait_in_page(
+                _SELECTOR_WAIT_JS, f'[id="{_BUTTON_IDS[target_button]}"]', None, timeout=0
+            )
+            if info:
+                button = {
+                    "element": info["element"],
+                    "frame_path": list(context.frame_path),
+                    "id": info["id"],
+                    "value": info["value"],
+                    "disabled": info["disabled"],
+                }
+                context.buttons[target_button] = button
+        if button is None:
+            return None
+        return {**button, "strategy": "page_context"}
+
+    def _run_locator_strategy(
+        self, strategy, by_type, selector_value, target_button, budget
+    ):
+        """1つの探索戦略を予算（秒）の範囲で試す
+
+        フレームパスで定義された戦略は、iframeとボタンが現れるまで
+        ページ内でDOMの変更を監視して待機する（execute_async_script）。
+        deep 戦略は1回探索するごとに、DOMが変更されるまで待機してから再探索する。
+        """
+        if not strategy["deep"]:
+            # ページ内での待機が予算いっぱいまでブロックするため、1回だけ試す
+            return self._wait_for_locator_strategy(strategy, target_button, budget)
+
+        deadline = time.monotonic() + budget
+        while True:
+            button = self._locate_button_deep(by_type, selector_value, target_button)
+            remaining = deadline - time.monotonic()
+            if button or remaining <= 0:
+                return button
+            self._wait_in_page(_DOM_CHANGE_JS, timeout=remaining)
+
+    def _wait_for_locator_strategy(self, strategy, target_button, timeout):
+        """フレームパスとセレクターで定義された戦略で、ボタンが現れるまで待機する
+
+        Returns:
+            dict: element, frame_path, frames, id, value, disabled, waited を持つ辞書
+            （frames は切り替えたiframe要素、waited はiframeとボタンの出現を待った秒数）。
+            見つからない場合はNone
+        """
+        value = (
+            strategy["value"]
+            .replace("{button_id}", _BUTTON_IDS[target_button])
+            .replace("{button_value}", target_button)
+        )
+        css, xpath = self._selector_for_js(strategy["by_type"], value)
+        start = time.monotonic()
+        frames = self._wait_for_frame_path(strategy["frames"], timeout)
+        if frames is None:
+            return None
+
+        info = self._wait_in_page(
+            _SELECTOR_WAIT_JS, css, xpath,
+            timeout=max(0.0, timeout - (time.monotonic() - start)),
+        )
+        if not info:
+            return None
+        return {
+            "element": info["element"],
+            "frame_path": list(strategy["frames"]),
+            "id": info["id"],
+            "value": info["value"],
+            "disabled": info["disabled"],
+            "frames": frames,
+            "waited": round(time.monotonic() - start, 3),
+        }
+
+    def _wait_for_frame_path(self, path, timeout):
+        """メインフレームから、各iframeが現れるのを待ちながらフレームパスに従って切り替える
+
+        Returns:
+            list: 切り替えたiframe要素（メインフレームの場合は空）。
+            timeout 秒以内に切り替えられなかった場合はNone
+        """
+        deadline = time.monotonic() + timeout
+        frames = []
+        try:
+            self.driver.switch_to.default_content()
+            for step in path:
+                found = self._wait_in_page(
+                    _FRAME_WAIT_JS, step, timeout=max(0.0, deadline - time.monotonic())
+                )
+                if not found:
+                    return None
+                self.driver.switch_to.frame(found["element"])
+                frames.append(found["element"])
+            return frames
+        except Exception as e:
+            logger.info(f"フレーム {path} への切り替えに失敗しました: {e}")
+            return None
+
+    def _wait_in_page(self, script, *args, timeout):
+        """待機用のスクリプトを現在のフレームで実行する（最後の引数にミリ秒のタイムアウトを渡す）
+
+        Returns:
+            スクリプトの結果。タイムアウトした場合や、待機中にページが切り替わった場合はNone
+        """
+        try:
+            self.driver.set_script_timeout(timeout + 5)
+            return self.driver.execute_async_script(script, *args, int(timeout * 1000))
+        except Exception as e:
+            logger.info(f"ページ内での待機が中断されました: {e}")
+            return None
+
+    def _compile_locator_chain(self):
+        """config.json の locator_strategies を解釈する（起動時に1回だけ実行）"""
+        definitions = (
+            self.config.get("locator_strategies") or _DEFAULT_LOCATOR_STRATEGIES
+        )
+        default_budget = float(self.config.get("locator_budget", 3))
+
+        chain = []
+        for index, definition in enumerate(definitions):
+            name = definition.get("name") or f"strategy_{index}"
+            strategy = {
+                "name": name,
+                "order": index,
+                "deep": bool(definition.get("deep", False)),
+                "frames": list(definition.get("frames", [])),
+                "budget": float(definition.get("budget", default_budget)),
+                "by_type": None,
+                "value": None,
+            }
+            if not strategy["deep"]:
+                selector = definition.get("selector", {})
+                by_type = self._by_type(selector.get("type", "id"))
+                value = selector.get("value")
+                if not value or self._selector_for_js(by_type, value) == (None, None):
+                    logger.warning(
+                        f"探索戦略「{name}」のセレクターが不正なため無視します: {selector}"
+                    )
+                    continue
+                strategy["by_type"] = by_type
+                strategy["value"] = value
+            chain.append(strategy)
+        return chain
+
+    def _ordered_locator_chain(self):
+        """最後に成功した戦略が先頭になるよう並べ替えたチェーンを返す"""
+
+        def sort_key(strategy):
+            last_hit = self.locator_stats.get(strategy["name"], {}).get("last_hit", 0)
+            return (-last_hit, strategy["order"])
+
+        return sorted(self.locator_chain, key=sort_key)
+
+    def _record_locator_stat(self, name, hit, elapsed):
+        """探索戦略の成功・失敗と所要時間を記録"""
+        stat = self.locator_stats.setdefault(
+            name, {"hits": 0, "misses": 0, "total_ms": 0.0}
+        )
+        stat["hits" if hit else "misses"] += 1
+        stat["total_ms"] = round(stat["total_ms"] + elapsed * 1000, 1)
+        stat["last_ms"] = round(elapsed * 1000, 1)
+        if hit:
+            stat["last_hit"] = time.time()
+
+    def _load_locator_stats(self):
+        """探索戦略の統計を読み込む"""
+        try:
+            with open(self.cache_dir / "locator_stats.json", "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_locator_stats(self):
+        """探索戦略の統計を保存（一時ファイル経由で置き換え）"""
+        try:
+            self.cache_dir.mkdir(exist_ok=True)
+            path = self.cache_dir / "locator_stats.json"
+            tmp_path = path.with_suffix(f".{_os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.locator_stats, f, ensure_ascii=False, indent=2)
+            _os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"探索戦略の統計を保存できませんでした: {e}")
+
+    def _locate_button_deep(self, by_type, selector_value, target_button=None):
+        """注入したJavaScriptで1回の往復ごとに1ドキュメント分を探索
+
+        各ドキュメント内ではopenなShadow Rootと同一オリジンのiframeを
+        ブラウザ内で再帰的に探索する。クロスオリジンのiframe（Visualforceなど）は
+        中身を参照できないため、そのiframeに切り替えてから同じ探索を行う。
+
+        Returns:
+            dict: element, frame_path, frames, id, value, disabled を持つ辞書。見つからない場合はNone
+        """
+        if target_button in _BUTTON_IDS:
+            target_ids = [_BUTTON_IDS[target_button]]
+            target_values = [target_button]
+        else:
+            target_ids = list(_BUTTON_IDS.values())
+            target_values = list(_BUTTON_IDS.keys())
+        css, xpath = self._selector_for_js(by_type, selector_value)
+
+        max_frames = int(self.config.get("max_frames", 20))
+        pending = [[]]
+        visited = 0
+
+        while pending and visited < max_frames:
+            path = pending.pop(0)
+            visited += 1
+            frames = self._switch_to_frame_path(path)
+            if frames is None:
+                continue
+
+            try:
+                info = self.driver.execute_script(
+                    _DEEP_LOCATOR_JS, target_ids, target_values, css, xpath
+                )
+                if info and info["found"] and info["path"]:
+                    # 同一オリジンのiframe内で発見: そのフレームに切り替えて要素を取得
+                    path = path + info["path"]
+                    frames = self._switch_to_frame_path(path)
+                    if frames is None:
+                        continue
+                    info = self.driver.execute_script(
+                        _DEEP_LOCATOR_JS, target_ids, target_values, css, xpath
+                    )
+                    if not info or not info["found"] or info["path"]:
+                        continue
+            except WebDriverException as e:
+                # 探索中にフレームが削除された・古くなった場合は、次のフレームを探索する
+                logger.info(f"フレーム {path} の探索に失敗しました: {e.msg or type(e).__name__}")
+                self.driver.switch_to.default_content()
+                continue
+            if not info:
+                continue
+
+            if info["found"]:
+                return {
+                    "element": info["element"],
+                    "frame_path": path,
+                    "frames": frames,
+                    "id": info["id"],
+                    "value": info["value"],
+                    "disabled": info["disabled"],
+                }
+
+            pending.extend(path + frame["path"] for frame in info["opaque"])
+
+        self.driver.switch_to.default_content()
+        return None
+
+    def _switch_to_frame_path(self, path):
+        """メインフレームから、フレームパスに従ってフレームを切り替える
+
+        フレームパスの各要素は、deepFrames のインデックス（int）または
+        ">>>" でShadow Rootを貫通するCSSセレクター（str）。
+
+        Returns:
+            list: 切り替えたiframe要素（メインフレームの場合は空）。失敗した場合はNone
+        """
+        frames = []
+        try:
+            self.driver.switch_to.default_content()
+            for step in path:
+                if isinstance(step, str):
+                    iframe = self.driver.execute_script(_PIERCING_QUERY_JS, step)
+                else:
+                    iframe = self.driver.execute_script(_FRAME_AT_JS, step)
+                if iframe is None:
+                    return None
+                self.driver.switch_to.frame(iframe)
+                frames.append(iframe)
+            return frames
+        except Exception as e:
+            logger.info(f"フレーム {path} への切り替えに失敗しました: {e}")
+            return None
+
+    @staticmethod
+    def _by_type(selector_type):
+        """設定のセレクタータイプをByタイプに変換（不正な場合はNone）"""
+        return {
+            "id": By.ID,
+            "name": By.NAME,
+            "class": By.CLASS_NAME,
+            "xpath": By.XPATH,
+            "css": By.CSS_SELECTOR,
+            "link_text": By.LINK_TEXT,
+            "partial_link_text": By.PARTIAL_LINK_TEXT,
+        }.get(selector_type.lower())
+
+    @staticmethod
+    def _selector_for_js(by_type, selector_value):
+        """設定のセレクターをJavaScript探索用の (CSS, XPath) に変換"""
+        value = selector_value.replace('"', '\\"')
+        if by_type == By.ID:
+            return f'[id="{value}"]', None
+        if by_type == By.NAME:
+            return f'[name="{value}"]', None
+        if by_type == By.CLASS_NAME:
+            return f".{selector_value}", None
+        if by_type == By.CSS_SELECTOR:
+            return selector_value, None
+        if by_type == By.XPATH:
+            return None, selector_value
+        return None, None
+
+    @_traced("screenshot")
+    def take_screenshot(self, filename):
+        """スクリーンショットを撮影（保存はバックグラウンドで行う）
+
+        screenshots.clip が "widget" の場合はTeamSpiritのウィジェットの範囲のみを撮影する
+        （メインフレームに切り替える）。Chrome/Edgeでは screenshots.format で
+        jpeg/webp を指定できる（Firefoxは常にPNG）。
+        """
+        self.spans.annotate(label=filename)
+        settings = self.config.get("screenshots", {})
+        image_format = settings.get("format", "png")
+        if image_format not in _SCREENSHOT_EXTENSIONS:
+            image_format = "png"
+        try:
+            prefix = self.config.get("screenshot_prefix")
+            if prefix:
+                filename = f"{prefix}_{filename}"
+
+            widget = None
+            if settings.get("clip", "window") == "widget":
+                self.driver.switch_to.default_content()
+                widget = self.driver.execute_script(_WIDGET_RECT_JS)
+
+            if hasattr(self.driver, "execute_cdp_cmd"):
+                params = {"format": image_format}
+                if image_format != "png":
+                    params["quality"] = int(settings.get("quality", 80))
+                if widget:
+                    params["clip"] = {
+                        key: widget[key] for key in ("x", "y", "width", "height")
+                    }
+                    params["clip"]["scale"] = 1
+                    params["captureBeyondViewport"] = True
+                data = self.driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"]
+            else:
+                image_format = "png"
+                if widget:
+                    data = widget["element"].screenshot_as_png
+                else:
+                    data = self.driver.get_screenshot_as_png()
+
+            self.screenshots.submit(filename, data, _SCREENSHOT_EXTENSIONS[image_format])
+            if not settings.get("async", True):
+                self.screenshots.flush()
+        except Exception as e:
+            logger.error(f"スクリーンショットの撮影に失敗しました: {e}")
+
+    def close(self):
+        """ブラウザを閉じる（保存中のスクリーンショットは書き込みを待つ）"""
+        self.screenshots.flush()
+        if self.http_client:
+            self.http_client.close()
+        if self.cdp:
+            self.cdp.close()
+            self.cdp = None
+        if self.lean_filter:
+            self.lean_filter.close()
+            self.lean_filter = None
+        if self.driver:
+            self.driver.quit()
+            if self.shared_context is not None:
+                self.shared_browser.close_context(self.shared_context)
+                self.shared_context = None
+                logger.info("ブラウザコンテキストを閉じました")
+            else:
+                logger.info("ブラウザを閉じました")
+        if self.profiler:
+            self.profiler.report()
+            self.profiler.records = []
+
+    @_traced("read_punch_state")
+    def read_punch_state(self):
+        """ログイン済みのブラウザで打刻の状態を読み取る（クリックやスクリーンショットは行わない）
+
+        Returns:
+            dict: state, checkin_disabled, checkout_disabled, location, start_time, end_time。
+            ボタンが見つからない場合はNone
+        """
+        button_config = self.config["buttons"]["checkin"]
+        by_type = self._by_type(button_config["selector_type"])
+        if not by_type:
+            logger.error(f"不正なセレクタータイプ: {button_config['selector_type']}")
+            return None
+
+        if self.page_context.driver is not self.driver:
+            # ブラウザを起動し直した場合のみ破棄する（ページの遷移は PageContext が検出する）
+            self.page_context.reset(self.driver)
+        settings = self.config.get("status", {})
+        time_selectors = {
+            "start_time": settings.get("start_time_selector", "#pwStartTime"),
+            "end_time": settings.get("end_time_selector", "#pwEndTime"),
+        }
+        try:
+            # ボタンが見つかったフレームに切り替わった状態で読み取る
+            located = self._find_button_in_frames(
+                by_type, button_config["selector_value"], target_button="出勤"
+            )
+            if located is None:
+                return None
+            if isinstance(located["element"], CdpElement):
+                state = self.cdp.call(located["element"], _PUNCH_STATE_JS, _BUTTON_IDS, time_selectors)
+            else:
+                state = self.driver.execute_script(_PUNCH_STATE_JS, _BUTTON_IDS, time_selectors)
+        finally:
+            self.driver.switch_to.default_content()
+
+        if state["checkin_disabled"] is None:
+            state["state"] = "unknown"
+        elif not state["checkin_disabled"]:
+            state["state"] = "not_checked_in"
+        elif state["checkout_disabled"]:
+            state["state"] = "checked_out"
+        else:
+            state["state"] = "checked_in"
+        self.spans.annotate(result=state["state"])
+        logger.info(
+            f"打刻の状態: {state['state']}（勤務場所: {state['location'] or '-'}、"
+            f"出勤: {state['start_time'] or '-'}、退勤: {state['end_time'] or '-'}）"
+        )
+        return state
+
+    @_traced("status")
+    def status(self):
+        """ログインして打刻の状態を読み取る（読み取り専用）
+
+        Returns:
+            dict: username, state, checkin_disabled, checkout_disabled, location,
+            start_time, end_time, error
+        """
+        result = {
+            "username": self.config.get("username"),
+            "state": "unknown",
+            "checkin_disabled": None,
+            "checkout_disabled": None,
+            "location": None,
+            "start_time": None,
+            "end_time": None,
+            "error": None,
+        }
+        try:
+            self.setup_driver()
+            if not self.login():
+                result["error"] = "ログインに失敗しました"
+                return result
+            state = self.read_punch_state()
+            if state is None:
+                result["error"] = "出勤・退勤ボタンが見つかりませんでした"
+            else:
+                result.update(state)
+        except SystemExit as e:
+            result["error"] = f"処理が中断されました（終了コード: {e.code}）"
+        except Exception as e:
+            logger.error(f"状態の確認中にエラーが発生しました: {e}")
+            result["error"] = str(e) or type(e).__name__
+        finally:
+            if self.config.get("auto_close", True):
+                self.close()
+        return result
+
+    @_traced("perform_action")
+    def perform_action(self, action_type, work_location=None, first_phase="widget"):
+        """出勤または退勤を段階ごとに実行し、結果を記録
 
         Args:
-            by_type: Byタイプ
-            selector_value: セレクター値
-            target_button: 探しているボタン名（"出勤" または "退勤"）。Noneの場合は両方対象
+            action_type: "出勤" または "退勤"
+            work_location: 勤務場所（"自宅" など）。Noneの場合は選択しない
+            first_phase: 開始する段階（ログイン済みのブラウザで行う場合は "widget"、
+                ブラウザの起動から行う場合は "driver"）
+
+        Returns:
+            bool: 成功（既に出勤/退勤済みを含む）の場合True
         """
+        self.spans.annotate(action=action_type, work_location=work_location)
+        if action_type not in ("出勤", "退勤"):
+            logger.error(f"不正なアクションタイプ: {action_type}")
+            return False
 
-        # target_buttonに対応するIDを決定
-        if target_button == "出勤":
-            target_ids = ["btnStInput"]
-            target_values = ["出勤"]
-        elif target_button == "退勤":
-            target_ids = ["btnEtInput"]
-            target_values = ["退勤"]
+        result, failed_phase = self._run_phases(action_type, work_location, first_phase)
+        self.spans.annotate(result=result if isinstance(result, str) else bool(result))
+        if failed_phase:
+            self.spans.annotate(failed_phase=failed_phase)
+
+        # 結果に応じた処理
+        if failed_phase == "login":
+            self.take_screenshot(f"{action_type}_login_failed")
+            success = False
+        elif result == "already_done":
+            # 既に出勤/退勤済みの場合
+            self.take_screenshot(f"{action_type}_already_done")
+            logger.info(f"既に{action_type}済みです。処理を完了します。")
+            success = True
+        elif result == "not_checked_in":
+            # まだ出勤していない場合（退勤時のみ）
+            self.take_screenshot(f"{action_type}_not_checked_in")
+            logger.error("まだ出勤していません。先に出勤してください。")
+            success = False
+        elif result:
+            # 成功した場合
+            self.take_screenshot(f"{action_type}_success")
+            logger.info(f"{action_type}処理が完了しました！")
+            success = True
         else:
-            target_ids = ["btnStInput", "btnEtInput"]
-            target_values = ["出勤", "退勤"]
+            # 失敗した場合
+            self.take_screenshot(f"{action_type}_failed")
+            logger.error(f"{action_type}処理に失敗しました（段階: {_PUNCH_PHASES.get(failed_phase, '-')}）")
+            success = False
 
-        # まずShadow DOM内のiframeを探す（TeamSpirit/Salesforce Lightning対応）
+        return success
+
+    @_traced("execute")
+    def execute(self, action_type, work_location=None):
+        """出勤または退勤を実行
+
+        Args:
+            action_type: "出勤" または "退勤"
+            work_location: 勤務場所（"自宅" など）。Noneの場合は選択しない
+        """
+        self.spans.annotate(action=action_type, work_location=work_location)
         try:
-            logger.info("Shadow DOM内のVisualforce iframeを探しています...")
-            button = self._find_button_in_shadow_dom(
-                by_type, selector_value, target_button
-            )
-            if button:
-                return button
+            location_info = f"（{work_location}）" if work_location else ""
+            logger.info(f"{'='*50}")
+            logger.info(f"{action_type}{location_info}処理を開始します")
+            logger.info(f"{'='*50}")
+
+            # ブラウザの起動から段階ごとに実行（失敗した段階のみやり直す）
+            return self.perform_action(action_type, work_location, first_phase="driver")
+
         except Exception as e:
-            logger.info(f"Shadow DOM探索: {e}")
+            logger.error(f"処理中にエラーが発生しました: {e}")
+            self.take_screenshot(f"{action_type}_error")
+            return False
+        finally:
+            # メインフレームに戻る
+            try:
+                self.driver.switch_to.default_content()
+            except:
+                pass
 
-        # メインフレームで探す（詳細チェック）
-        try:
-            logger.info("メインフレームでボタンを探しています...")
+            # 自動クローズの設定確認
+            if self.config.get("auto_close", True):
+                self.close()
+            else:
+                self.screenshots.flush()
+                logger.info("ブラウザは開いたままです（auto_close=false）")
 
-            # まず詳細にすべての要素を確認
-            logger.info("メインフレームの全要素をチェック中...")
-            inputs = self.driver.find_elements(By.TAG_NAME, "input")
-            buttons = self.driver.find_elements(By.TAG_NAME, "button")
-            logger.info(
-                f"メインフレーム: {len(inputs)}個のinput要素、{len(buttons)}個のbutton要素"
-            )
 
-            # 指定されたボタンのみを探す
-            for idx, elem in enumerate(inputs + buttons):
-                try:
-                    elem_id = elem.get_attribute("id")
-                    elem_value = elem.get_attribute("value")
-                    elem_text = elem.text
-                    if (
-                        elem_value in target_values
-                        or elem_text in target_values
-                        or elem_id in target_ids
-                    ):
-                        logger.info(
-                            f"★メインフレームでボタン発見: id={elem_id}, value={elem_value}, text={elem_text}"
-                        )
-                        return elem
-                except:
-                    pass
+class CheckInOutDaemon:
+    """ログイン済みのブラウザを常駐させ、ローカルソケット経由で打刻を受け付ける
 
-            # XPathで再度探す
-            button = WebDriverWait(self.driver, 5).until(
-                EC.presence_of_element_located((by_type, selector_value))
-            )
-            logger.info("メインフレームでボタンを発見しました")
-            return button
-        except TimeoutException:
-            logger.info("メインフレームにボタンが見つかりませんでした")
+    起動時に1回だけブラウザの起動とログインを行い、以降は
+    keepalive_interval 秒ごとにページを再読み込みしてセッションを維持する。
+    接続情報（ポート番号と認証トークン）は cache/daemon.json に書き出す。
+    """
 
-        # iframe内を探す
-        iframes = self.driver.find_elements(By.TAG_NAME, "iframe")
-        logger.info(f"{len(iframes)}個のiframeが見つかりました")
+    def __init__(self, automation):
+        self.automation = automation
+        self.daemon_config = automation.config.get("daemon", {})
+        self.info_path = automation.cache_dir / "daemon.json"
+        self.token = secrets.token_hex(16)
+        self.lock = threading.Lock()
+        self.refresh_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.server = None
 
-        for i, iframe in enumerate(iframes):
-            try:
-                logger.info(f"iframe[{i}]でボタンを探しています...")
-                self.driver.switch_to.frame(iframe)
+    def serve(self):
+        """ブラウザを起動してログインし、停止要求まで打刻要求を受け付ける"""
+        automation = self.automation
+        try:
+            automation.setup_driver()
+        except PunchPhaseError as e:
+            logger.error(f"常駐モード: {e}")
+            return False
+        if not automation.login():
+            automation.take_screenshot("daemon_login_failed")
+            automation.close()
+            logger.error("常駐モード: ログインに失敗したため終了します")
+            return False
+
+        port = int(self.daemon_config.get("port", 0))
+        self.server = _DaemonServer(("127.0.0.1", port), _DaemonRequestHandler)
+        self.server.daemon_instance = self
+        self._write_info(self.server.server_address[1])
 
-                # iframe内のbody要素が読み込まれるまで待機
+        keep_alive = threading.Thread(target=self._keep_alive, daemon=True)
+        keep_alive.start()
+
+        logger.info(
+            f"常駐モードを開始しました（127.0.0.1:{self.server.server_address[1]}）"
+        )
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
+            self.refresh_event.set()
+            self.server.server_close()
+            self._remove_info()
+            with self.lock:
+                automation.close()
+            logger.info("常駐モードを終了しました")
+        return True
+
+    def handle_request(self, request):
+        """クライアントからの要求を処理し、応答（辞書）を返す"""
+        if request.get("token") != self.token:
+            return {"success": False, "error": "認証トークンが一致しません"}
+
+        command = request.get("action")
+        if command == "ping":
+            return {"success": True}
+        if command == "stop":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {"success": True}
+        if command == "状態":
+            with self.lock:
                 try:
-                    logger.info(f"iframe[{i}]のbody要素の読み込みを待機中...")
-                    WebDriverWait(self.driver, 15).until(
-                        EC.presence_of_element_located((By.TAG_NAME, "body"))
-                    )
-                    logger.info(f"iframe[{i}]のbody要素が読み込まれました")
+                    self._ensure_session()
+                    state = self.automation.read_punch_state()
                 except Exception as e:
-                    logger.warning(f"iframe[{i}]のbody読み込み待機エラー: {e}")
+                    return {"success": False, "error": str(e)}
+            if state is None:
+                return {"success": False, "error": "出勤・退勤ボタンが見つかりませんでした"}
+            return {
+                "success": True,
+                "status": {
+                    "username": self.automation.config.get("username"),
+                    **state,
+                    "error": None,
+                },
+            }
+        if command not in ["出勤", "退勤"]:
+            return {"success": False, "error": f"不正なアクションタイプ: {command}"}
 
-                # デバッグ: iframe内のinputボタンをすべてリスト
+        work_location = request.get("work_location")
+        location_info = f"（{work_location}）" if work_location else ""
+        with self.lock:
+            logger.info(f"常駐モード: {command}{location_info}要求を受け付けました")
+            try:
+                self._ensure_session()
+                success = self.automation.perform_action(command, work_location)
+            except Exception as e:
+                logger.error(f"常駐モード: 処理中にエラーが発生しました: {e}")
+                self.automation.take_screenshot(f"{command}_error")
+                success = False
+            finally:
                 try:
-                    # TeamSpiritウィジェットの読み込みを待つ（動的読み込み対応）
-                    logger.info("iframe内のコンテンツ読み込みを待機中...")
-                    max_wait = 60  # 最大60秒待機（30秒→60秒に延長）
-                    wait_interval = 5  # 5秒ごとにチェック（3秒→5秒に延長）
-                    button_found = False
+                    self.automation.driver.switch_to.default_content()
+                except Exception:
+                    pass
+        # 打刻後のウィジェットを次の要求に備えて再読み込み（応答後にバックグラウンドで実行）
+        self.refresh_event.set()
+        return {"success": success}
+
+    def _keep_alive(self):
+        """一定間隔（または打刻直後）にページを再読み込みしてセッションを維持"""
+        interval = float(self.daemon_config.get("keepalive_interval", 600))
+        while not self.stop_event.is_set():
+            self.refresh_event.wait(interval)
+            self.refresh_event.clear()
+            if self.stop_event.is_set():
+                break
+            with self.lock:
+                try:
+                    self.automation.driver.refresh()
+                    self._ensure_session()
+                    self.automation.wait_for_lightning_ready()
+                except Exception as e:
+                    logger.warning(f"常駐モード: セッション維持中にエラーが発生しました: {e}")
+
+    def _ensure_session(self):
+        """ログイン画面に戻されている場合は再ログインする"""
+        driver = self.automation.driver
+        driver.switch_to.default_content()
+        if driver.execute_script("return !!document.getElementById('username');"):
+            logger.info("常駐モード: セッションが切れたため再ログインします")
+            if not self.automation.login():
+                raise RuntimeError("再ログインに失敗しました")
+
+    def _write_info(self, port):
+        """接続情報を書き出す（認証トークンを含むため、所有者のみ読み書きできるファイルにする）"""
+        self.info_path.parent.mkdir(exist_ok=True)
+        tmp_path = self.info_path.with_suffix(".tmp")
+        fd = _os.open(tmp_path, _os.O_WRONLY | _os.O_CREAT | _os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {"port": port, "token": self.token, "pid": _os.getpid()}, f, indent=2
+            )
+        _os.replace(tmp_path, self.info_path)
 
-                    for attempt in range(max_wait // wait_interval):
-                        time.sleep(wait_interval)
+    def _remove_info(self):
+        """接続情報を削除"""
+        try:
+            self.info_path.unlink()
+        except FileNotFoundError:
+            pass
 
-                        # inputタグとbuttonタグの両方を探す
-                        inputs = self.driver.find_elements(By.TAG_NAME, "input")
-                        buttons = self.driver.find_elements(By.TAG_NAME, "button")
-                        all_elements = inputs + buttons
 
-                        logger.info(
-                            f"iframe[{i}]内に{len(inputs)}個のinput要素、{len(buttons)}個のbutton要素が見つかりました（{attempt + 1}回目のチェック）"
-                        )
+class _DaemonServer(socketserver.ThreadingTCPServer):
+    """常駐モードのソケットサーバー"""
 
-                        # すべての要素をチェック
-                        for idx, elem in enumerate(all_elements):
-                            try:
-                                elem_id = elem.get_attribute("id")
-                                elem_type = elem.get_attribute("type")
-                                elem_value = elem.get_attribute("value")
-                                elem_text = elem.text
-                                elem_class = elem.get_attribute("class")
-
-                                # 出勤または退勤ボタンを発見
-                                if elem_value in ["出勤", "退勤"] or elem_text in [
-                                    "出勤",
-                                    "退勤",
-                                ]:
-                                    logger.info(
-                                        f"  ★ボタン発見[{idx}]: id={elem_id}, type={elem_type}, value={elem_value}, text={elem_text}, class={elem_class}"
-                                    )
-                                    button_found = True
-                                else:
-                                    # すべての要素をログ出力（type=buttonは必ず出力）
-                                    if elem_type == "button" or idx < 30:
-                                        logger.info(
-                                            f"  要素[{idx}]: id={elem_id}, type={elem_type}, value={elem_value}, text={elem_text}"
-                                        )
-                            except:
-                                pass
-
-                        if button_found:
-                            logger.info(f"iframe[{i}]内で出勤/退勤ボタンを発見しました")
-                            break
-
-                    if not button_found:
-                        logger.warning(
-                            f"iframe[{i}]内に出勤/退勤ボタンが見つかりませんでした（{max_wait}秒待機後）"
-                        )
-                except Exception as debug_e:
-                    logger.warning(f"デバッグ情報取得エラー: {debug_e}")
+    daemon_threads = True
+    allow_reuse_address = True
 
-                button = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((by_type, selector_value))
-                )
-                logger.info(f"iframe[{i}]でボタンを発見しました")
-                return button
 
-            except TimeoutException:
-                logger.info(f"iframe[{i}]にボタンが見つかりませんでした")
-                self.driver.switch_to.default_content()
-                continue
-            except Exception as e:
-                logger.warning(f"iframe[{i}]のチェック中にエラー: {e}")
-                self.driver.switch_to.default_content()
-                continue
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """1行のJSON要求を受け取り、1行のJSON応答を返す"""
 
-        # すべてのフレームで見つからなかった
-        self.driver.switch_to.default_content()
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.daemon_instance.handle_request(request)
+        except (ValueError, AttributeError) as e:
+            response = {"success": False, "error": f"不正な要求です: {e}"}
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def request_daemon(action, work_location=None, timeout=300):
+    """常駐モードのプロセスに要求を送る
+
+    接続できた後のタイムアウトや切断は、常駐プロセスが打刻中の可能性があるため
+    Noneではなく失敗の応答を返す（呼び出し側がその場で打刻し直して二重に打刻しないように）。
+
+    Returns:
+        dict: 常駐モードの応答。常駐モードが起動していない場合
+              （接続情報がない・壊れている、または接続が拒否された）はNone
+    """
+    info_path = _base_dir / "cache" / "daemon.json"
+    try:
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        port, token = int(info["port"]), info["token"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError, ValueError):
         return None
 
-    def _find_button_in_shadow_dom(self, by_type, selector_value, target_button=None):
-        """Shadow DOM内のVisualforce iframe内でボタンを探す（TeamSpirit/Salesforce Lightning対応）
+    request = {"token": token, "action": action, "work_location": work_location}
+    try:
+        sock = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+    except ConnectionRefusedError:
+        # 接続情報が残っているが常駐プロセスは終了している
+        return None
+    except OSError as e:
+        return {"success": False, "error": f"常駐モードに接続できませんでした: {e}"}
+
+    try:
+        with sock:
+            sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+            response = sock.makefile("rb").readline()
+    except socket.timeout:
+        return {
+            "success": False,
+            "error": f"常駐モードが{timeout:g}秒以内に応答しませんでした（打刻の状態を確認してください）",
+        }
+    except OSError as e:
+        response = None
+        logger.warning(f"常駐モードとの通信に失敗しました: {e}")
+    if not response:
+        return {
+            "success": False,
+            "error": "常駐モードが応答せずに切断しました（打刻の状態を確認してください）",
+        }
+    return json.loads(response.decode("utf-8"))
 
-        Args:
-            by_type: Byタイプ
-            selector_value: セレクター値
-            target_button: 探しているボタン名（"出勤" または "退勤"）。Noneの場合は両方対象
-        """
-        try:
-            logger.info("force-aloha-page のShadow DOMを探索中...")
-
-            # target_buttonに対応するIDと値を決定
-            if target_button == "出勤":
-                target_ids = ["btnStInput"]
-                target_values = ["出勤"]
-            elif target_button == "退勤":
-                target_ids = ["btnEtInput"]
-                target_values = ["退勤"]
-            else:
-                target_ids = ["btnStInput", "btnEtInput"]
-                target_values = ["出勤", "退勤"]
-
-            # JavaScriptでShadow DOM内のiframeを取得
-            js_code = """
-            // force-aloha-pageのShadow Root内のiframeを取得
-            const alohaPage = document.querySelector('force-aloha-page');
-            if (!alohaPage || !alohaPage.shadowRoot) {
-                return null;
-            }
-            
-            // Shadow root内のVisualforce iframeを取得
-            const vfIframe = alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]');
-            return vfIframe;
-            """
 
-            vf_iframe = self.driver.execute_script(js_code)
+def daemon(args):
+    """常駐モード
+
+    使用方法: python main.py daemon [stop]
+    """
+    if args and args[0] == "stop":
+        response = request_daemon("stop", timeout=10)
+        if response is None:
+            print("常駐モードは起動していません")
+        elif response.get("success"):
+            print("常駐モードを停止しました")
+        else:
+            print(f"常駐モードを停止できませんでした: {response.get('error')}")
+            sys.exit(1)
+        sys.exit(0)
 
-            if vf_iframe:
-                logger.info("★ Visualforce iframe (Shadow DOM内) を発見しました！")
+    if request_daemon("ping", timeout=5):
+        print("常駐モードは既に起動しています")
+        sys.exit(1)
 
-                # iframeに切り替え
-                self.driver.switch_to.frame(vf_iframe)
-                logger.info("Visualforce iframeに切り替えました")
+    automation = SalesforceAutoCheckInOut()
+    sys.exit(0 if CheckInOutDaemon(automation).serve() else 1)
 
-                # iframe内のコンテンツが読み込まれるまで待機
-                time.sleep(5)
 
-                # ボタンを探す
-                logger.info(
-                    f"iframe内で{target_button or '出勤/退勤'}ボタンを探しています..."
-                )
+def seed_drivers(args):
+    """ドライバーをキャッシュに事前登録する
 
-                # 複数のセレクタで検索（target_buttonに応じて絞り込み）
-                button_selectors = []
-                for btn_id in target_ids:
-                    button_selectors.append((By.ID, btn_id))
-                for btn_value in target_values:
-                    button_selectors.append(
-                        (By.XPATH, f"//input[@type='button' and @value='{btn_value}']")
-                    )
-                    button_selectors.append(
-                        (By.CSS_SELECTOR, f"input[value='{btn_value}']")
-                    )
+    使用方法:
+        python main.py seed-drivers                      … インストール済みの全ブラウザのドライバーを取得して登録
+        python main.py seed-drivers chrome [ドライバー]  … 指定したドライバーのファイルを登録（オフライン環境用）
+    """
+    browsers = [args[0]] if args else ["chrome", "edge", "firefox"]
+    driver_path = args[1] if len(args) >= 2 else None
+    if any(browser not in _BROWSER_VERSION_COMMANDS for browser in browsers):
+        print("使用方法: python main.py seed-drivers [chrome|edge|firefox] [ドライバーのファイル]")
+        sys.exit(1)
 
-                # まず指定されたセレクタで探す
-                try:
-                    button = self.driver.find_element(by_type, selector_value)
-                    btn_value = button.get_attribute("value")
-                    if btn_value in target_values:
-                        logger.info(
-                            f"★ Shadow DOM内のiframeで{target_button or btn_value}ボタンを発見しました！"
-                        )
-                        return button
-                except:
-                    pass
+    setup_logging()
+    cache = DriverCache(_base_dir)
+    success = True
+    for browser in browsers:
+        try:
+            path = cache.seed(browser, driver_path)
+            print(f"✓ {browser}: {path}")
+        except Exception as e:
+            print(f"✗ {browser}: {e}")
+            success = False
+    sys.exit(0 if success else 1)
 
-                # 代替セレクタで探す
-                for sel_by, sel_value in button_selectors:
-                    try:
-                        button = self.driver.find_element(sel_by, sel_value)
-                        btn_id = button.get_attribute("id")
-                        btn_value = button.get_attribute("value")
-                        if btn_id in target_ids or btn_value in target_values:
-                            logger.info(
-                                f"★ Shadow DOM内のiframeでボタンを発見: id={btn_id}, value={btn_value}"
-                            )
-                            return button
-                    except:
-                        continue
 
-                # デバッグ: iframe内の全要素をログに出力
-                inputs = self.driver.find_elements(By.TAG_NAME, "input")
-                logger.info(f"Shadow DOM iframe内: {len(inputs)}個のinput要素")
-                for idx, inp in enumerate(inputs[:30]):
-                    try:
-                        inp_id = inp.get_attribute("id")
-                        inp_type = inp.get_attribute("type")
-                        inp_value = inp.get_attribute("value")
-                        logger.info(
-                            f"  input[{idx}]: id={inp_id}, type={inp_type}, value={inp_value}"
-                        )
-                        if inp_value in target_values:
-                            logger.info(f"★ {inp_value}ボタンを発見！")
-                            return inp
-                    except:
-                        pass
+def grid(args):
+    """Selenium Grid のスロット数を表示する
 
-                logger.info("Shadow DOM内のiframeにボタンが見つかりませんでした")
-                self.driver.switch_to.default_content()
-            else:
-                logger.info("force-aloha-page または Shadow DOM が見つかりませんでした")
+    使用方法: python main.py grid [GridのURL ...]（省略時は config.json の remote.url / remote.urls）
+    """
+    automation = SalesforceAutoCheckInOut()
+    settings = automation.config.get("remote", {})
+    urls = args or settings.get("urls") or [settings.get("url")]
+    browser = settings.get("browser", "chrome")
+    if not any(urls):
+        print("使用方法: python main.py grid [GridのURL ...]（または config.json の remote.url を設定）")
+        sys.exit(1)
 
-            return None
+    total = 0
+    for url in filter(None, urls):
+        slots, busy = grid_capacity(url, browser)
+        total += slots
+        print(f"{'✓' if slots else '✗'} {url}: {browser} のスロット {slots}（使用中 {busy}）")
+    print(f"合計: {total}スロット")
+    sys.exit(0 if total else 1)
+
+
+def probe(args):
+    """インストール済みのブラウザを実際に起動して確認し、自動選択の結果を記録する
+
+    使用方法:
+        python main.py probe                   … Chrome/Edge/Firefox の順に確認
+        python main.py probe edge firefox      … 指定したブラウザのみ確認
+    """
+    browsers = args or ["chrome", "edge", "firefox"]
+    if any(browser not in _BROWSER_VERSION_COMMANDS for browser in browsers):
+        print("使用方法: python main.py probe [chrome|edge|firefox ...]")
+        sys.exit(1)
 
+    # 起動の確認だけなので画面は表示しない
+    automation = SalesforceAutoCheckInOut(overrides={"headless": True})
+    setup = {
+        "chrome": automation._setup_chrome,
+        "edge": automation._setup_edge,
+        "firefox": automation._setup_firefox,
+    }
+    working = []
+    for browser in browsers:
+        start = time.perf_counter()
+        try:
+            driver = setup[browser]()
+            driver.quit()
         except Exception as e:
-            logger.warning(f"Shadow DOM探索中にエラー: {e}")
-            try:
-                self.driver.switch_to.default_content()
-            except:
-                pass
-            return None
+            print(f"✗ {browser}: {str(e).splitlines()[0] if str(e) else type(e).__name__}")
+            continue
+        working.append(browser)
+        print(
+            f"✓ {browser}: バージョン {installed_browser_version(browser) or '不明'}"
+            f"（{time.perf_counter() - start:.1f}秒で起動）"
+        )
 
-    def _find_button_by_id_everywhere(self, button_id):
-        """IDを使ってメインフレームとすべてのiframe内でボタンを探す"""
-        logger.info(f"ID '{button_id}' でボタンを探索開始...")
+    if not working:
+        automation.driver_cache.forget_working()
+        print("起動できるブラウザがありません")
+        sys.exit(1)
 
-        # まずShadow DOM内を探す
-        try:
-            logger.info("Shadow DOM内でIDを検索中...")
-            js_code = """
-            const alohaPage = document.querySelector('force-aloha-page');
-            if (alohaPage && alohaPage.shadowRoot) {
-                const vfIframe = alohaPage.shadowRoot.querySelector('iframe[name^="vfFrameId"]');
-                return vfIframe;
+    # 自動選択の優先順位で最初に起動できたブラウザを記録
+    driver_path = automation.driver_cache._existing_path(
+        automation.driver_cache._load().get(working[0], {}).get("driver_path")
+    )
+    automation.driver_cache.remember_working(working[0], driver_path)
+    print(f"自動選択（browser: \"auto\"）では {working[0]} を最初に使用します")
+    sys.exit(0)
+
+
+def load_roster(roster_path):
+    """名簿ファイル（CSV/JSON）を読み込む
+
+    各行（各要素）は username, password, action, work_location を持つ。
+    password にはパスワードそのものではなく参照（env:環境変数名 / file:ファイルパス）を指定できる。
+    """
+    path = Path(roster_path)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.suffix.lower() == ".json":
+            entries = json.load(f)
+        else:
+            entries = list(csv.DictReader(f))
+
+    roster = []
+    for index, entry in enumerate(entries, 1):
+        username = (entry.get("username") or "").strip()
+        action = (entry.get("action") or "").strip()
+        if action == "status":
+            action = "状態"
+        if not username or action not in ["出勤", "退勤", "状態"]:
+            raise ValueError(
+                f"名簿の{index}件目: username と action（出勤/退勤/状態）は必須です"
+            )
+        roster.append(
+            {
+                "username": username,
+                "password": (entry.get("password") or "").strip(),
+                "action": action,
+                "work_location": (entry.get("work_location") or "").strip() or None,
+            }
+        )
+    return roster
+
+
+def resolve_password(reference):
+    """パスワード参照を解決する
+
+    - env:NAME  … 環境変数 NAME の値
+    - file:PATH … ファイル PATH の1行目
+    - それ以外  … 値をそのままパスワードとして使用
+    """
+    if reference.startswith("env:"):
+        name = reference[len("env:"):]
+        if name not in _os.environ:
+            raise ValueError(f"環境変数 {name} が設定されていません")
+        return _os.environ[name]
+    if reference.startswith("file:"):
+        with open(reference[len("file:"):], "r", encoding="utf-8") as f:
+            return f.readline().rstrip("\r\n")
+    return reference
+
+
+def grid_capacity(url, browser, timeout=5):
+    """Selenium Grid の /status から、指定したブラウザのスロット数を取得する
+
+    Returns:
+        tuple: (スロット数, 使用中のスロット数)。取得できない場合は (0, 0)
+    """
+    import urllib.request
+
+    try:
+        with urllib.request.urlopen(url.rstrip("/") + "/status", timeout=timeout) as response:
+            status = json.load(response)["value"]
+    except Exception as e:
+        logger.warning(f"Selenium Grid（{url}）の状態を取得できませんでした: {e}")
+        return 0, 0
+
+    # Grid（ハブ）は nodes、単体のノードは node を返す
+    nodes = status.get("nodes") or ([status["node"]] if status.get("node") else [])
+    browser_name = "MicrosoftEdge" if browser == "edge" else browser
+    slots = busy = 0
+    for node in nodes:
+        if node.get("availability", "UP") != "UP":
+            continue
+        for slot in node.get("slots", []):
+            if slot.get("stereotype", {}).get("browserName") == browser_name:
+                slots += 1
+                busy += 1 if slot.get("session") else 0
+    return slots, busy
+
+
+def assign_remote_nodes(roster, settings):
+    """名簿のユーザーを、Gridごとのスロット数に比例して割り振る
+
+    remote.url（1つ）または remote.urls（複数のGrid・単体のノード）の /status から
+    remote.browser のスロット数を取得し、各ユーザーに remote_url を割り当てる。
+
+    Returns:
+        tuple: (remote_url を追加した名簿, 全体のスロット数)
+    """
+    urls = settings.get("urls") or [settings.get("url")]
+    browser = settings.get("browser", "chrome")
+    capacity = {}
+    for url in filter(None, urls):
+        slots, busy = grid_capacity(url, browser)
+        logger.info(f"Selenium Grid（{url}）: {browser} のスロット {slots}（使用中 {busy}）")
+        if slots:
+            capacity[url] = slots
+    if not capacity:
+        raise RuntimeError(f"{browser} を実行できるSelenium Gridのノードがありません")
+
+    assigned = {url: 0 for url in capacity}
+    distributed = []
+    for entry in roster:
+        # 割り当て済みの件数とスロット数の比が最も小さいGridに割り当てる
+        url = min(capacity, key=lambda u: ((assigned[u] + 1) / capacity[u], -capacity[u]))
+        assigned[url] += 1
+        distributed.append({**entry, "remote_url": url})
+    return distributed, sum(capacity.values())
+
+
+def _run_batch_entry(entry, config_path, login_gate=None, shared_browser=None):
+    """名簿の1ユーザー分を処理する（ワーカープロセス、または共有ブラウザモードのスレッドで実行）
+
+    ブラウザはユーザーごとに新しく起動し、user_data_dir は使用しない
+    （WebDriverが一時プロファイルを作成するため、Cookieやストレージは共有されない）。
+
+    Args:
+        login_gate: ログインの同時実行数を制限するセマフォ（スケジューラーから実行する場合）
+        shared_browser: 共有ブラウザモードの SharedBrowser（ブラウザコンテキストで分離する）
+    """
+    start = time.perf_counter()
+    result = {
+        "username": entry["username"],
+        "action": entry["action"],
+        "work_location": entry["work_location"],
+        "success": False,
+        "error": None,
+    }
+    try:
+        automation = SalesforceAutoCheckInOut(
+            config_path,
+            overrides={
+                "username": entry["username"],
+                "password": resolve_password(entry["password"]),
+                "user_data_dir": "",
+                "auto_close": True,
+                "screenshot_prefix": re.sub(r"[^\w.-]", "_", entry["username"]),
+            },
+        )
+        if entry.get("remote_url"):
+            # assign_remote_nodes で割り当てたGridでセッションを作成する
+            automation.config["browser"] = "remote"
+            automation.config["remote"] = {
+                **automation.config.get("remote", {}),
+                "url": entry["remote_url"],
             }
-            return null;
-            """
-            vf_iframe = self.driver.execute_script(js_code)
+        automation.login_gate = login_gate
+        automation.shared_browser = shared_browser
+        if entry["action"] == "状態":
+            result["status"] = automation.status()
+            result["error"] = result["status"]["error"]
+            result["success"] = result["error"] is None
+        else:
+            result["success"] = bool(
+                automation.execute(entry["action"], entry["work_location"])
+            )
+    except SystemExit as e:
+        result["error"] = f"処理が中断されました（終了コード: {e.code}）"
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    result["elapsed"] = round(time.perf_counter() - start, 1)
+    if shared_browser is None:
+        # ワーカープロセスは atexit を経ずに終了するため、ここでログを書き込む
+        flush_logging()
+    return result
+
+
+def run_batch(roster, config_path="config.json", max_workers=None):
+    """名簿のユーザーを並列に処理する
+
+    Args:
+        roster: load_roster の戻り値
+        config_path: 共通の設定ファイル
+        max_workers: 同時に起動するブラウザ数の上限（Noneの場合はCPUコア数）
+
+    Returns:
+        list: ユーザーごとの結果（名簿の順）
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workers = max(1, min(max_workers or _os.cpu_count() or 1, len(roster)))
+    logger.info(f"バッチ処理を開始します: {len(roster)}件（並列数: {workers}）")
+
+    results = [None] * len(roster)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_run_batch_entry, entry, config_path): index
+            for index, entry in enumerate(roster)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                entry = roster[index]
+                results[index] = {
+                    "username": entry["username"],
+                    "action": entry["action"],
+                    "work_location": entry["work_location"],
+                    "success": False,
+                    "error": f"ワーカープロセスが異常終了しました: {e}",
+                    "elapsed": None,
+                }
+            result = results[index]
+            logger.info(
+                f"[{result['username']}] {result['action']}: "
+                f"{'成功' if result['success'] else '失敗'}"
+            )
+    return results
+
+
+def print_batch_summary(results):
+    """ユーザーごとの結果を表形式で表示"""
+    rows = [("ユーザー", "処理", "勤務場所", "結果", "所要時間", "エラー")]
+    for result in results:
+        rows.append(
+            (
+                result["username"],
+                result["action"],
+                result["work_location"] or "-",
+                "✓ 成功" if result["success"] else "✗ 失敗",
+                "-" if result["elapsed"] is None else f"{result['elapsed']}秒",
+                result["error"] or "",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    succeeded = sum(1 for result in results if result["success"])
+    print(f"\n成功: {succeeded}件 / 失敗: {len(results) - succeeded}件")
+
+
+def run_shared(roster, config_path="config.json", max_contexts=None):
+    """名簿のユーザーを、1つのブラウザのブラウザコンテキストで並列に処理する
+
+    Args:
+        roster: load_roster の戻り値
+        config_path: 共通の設定ファイル
+        max_contexts: 同時に開くブラウザコンテキスト数の上限
+
+    Returns:
+        tuple: (ユーザーごとの結果（名簿の順）, メモリ使用量の計測結果)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = max(1, min(max_contexts or 4, len(roster)))
+    logger.info(f"共有ブラウザモードで処理を開始します: {len(roster)}件（同時実行数: {workers}）")
+    browser = SharedBrowser(config_path)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda entry: _run_batch_entry(entry, config_path, shared_browser=browser),
+                    roster,
+                )
+            )
+    finally:
+        browser.close()
+    for result in results:
+        logger.info(
+            f"[{result['username']}] {result['action']}: "
+            f"{'成功' if result['success'] else '失敗'}"
+        )
+    return results, browser.memory_report()
+
+
+def print_memory_report(report):
+    """共有ブラウザモードのメモリ使用量を表示"""
+    if report is None:
+        print("\nメモリ使用量: 計測できません（psutil をインストールするか、Linuxで実行してください）")
+        return
+    mb = 1024 * 1024
+    print(
+        f"\nメモリ使用量（子プロセスのRSSの合計）: 起動直後 {report['baseline'] / mb:.0f}MB / "
+        f"最大 {report['peak'] / mb:.0f}MB（同時 {report['peak_users']}ユーザー）"
+    )
+    if report["per_user"] is not None:
+        print(f"1ユーザーあたり 約{report['per_user'] / mb:.0f}MB")
+
+
+def shared(args):
+    """共有ブラウザモード（1つのブラウザをブラウザコンテキストで分離して複数ユーザーを処理）
+
+    使用方法: python main.py shared 名簿ファイル [同時実行数]
+    """
+    if not args:
+        print("使用方法: python main.py shared 名簿ファイル(.csv/.json) [同時実行数]")
+        sys.exit(1)
 
-            if vf_iframe:
-                logger.info("★ Shadow DOM内のVisualforce iframeを発見")
-                self.driver.switch_to.frame(vf_iframe)
-                time.sleep(3)
+    try:
+        roster = load_roster(args[0])
+        max_contexts = int(args[1]) if len(args) >= 2 else None
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
 
-                button = self.driver.find_element(By.ID, button_id)
-                logger.info(f"★ Shadow DOM内でID '{button_id}' のボタンを発見しました")
-                return button
-        except Exception as e:
-            logger.info(f"Shadow DOM内でIDが見つかりませんでした: {e}")
-            try:
-                self.driver.switch_to.default_content()
-            except:
-                pass
+    if not roster:
+        print("名簿にユーザーがいません")
+        sys.exit(1)
 
-        # メインフレームで探す
-        try:
-            self.driver.switch_to.default_content()
-            button = self.driver.find_element(By.ID, button_id)
-            logger.info(f"★メインフレームでID '{button_id}' のボタンを発見しました")
-            return button
-        except:
-            pass
+    config = SalesforceAutoCheckInOut().config
+    max_contexts = max_contexts or config.get("shared_browser", {}).get("max_contexts", 4)
+    try:
+        results, report = run_shared(roster, max_contexts=max_contexts)
+    except (CdpError, PunchPhaseError, ValueError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+    if all(entry["action"] == "状態" for entry in roster):
+        print(json.dumps([_status_output(result) for result in results], ensure_ascii=False, indent=2))
+    else:
+        print_batch_summary(results)
+    print_memory_report(report)
+    sys.exit(0 if all(result["success"] for result in results) else 1)
+
+
+def _status_output(result):
+    """バッチ処理の結果を状態確認の出力（JSON）の形式にする"""
+    return result.get("status") or {
+        "username": result["username"],
+        "state": "unknown",
+        "error": result["error"],
+    }
+
+
+def status(args):
+    """打刻の状態を確認してJSONで出力する（クリックやスクリーンショットは行わない）
+
+    使用方法: python main.py 状態
+    常駐モードが起動している場合は、常駐プロセスのブラウザで確認する。
+    """
+    response = request_daemon("状態")
+    if response is not None:
+        result = response.get("status") or {
+            "username": None,
+            "state": "unknown",
+            "error": response.get("error"),
+        }
+    else:
+        result = SalesforceAutoCheckInOut().status()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(0 if not result.get("error") else 1)
 
-        # すべてのiframeで探す
-        iframes = self.driver.find_elements(By.TAG_NAME, "iframe")
-        for i, iframe in enumerate(iframes):
-            try:
-                self.driver.switch_to.default_content()
-                self.driver.switch_to.frame(iframe)
 
-                # iframe内のbody要素が読み込まれるまで待機
-                logger.info(f"iframe[{i}]のbody要素の読み込みを待機中...")
-                WebDriverWait(self.driver, 15).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
+def batch(args):
+    """名簿を使ったバッチ処理
 
-                # さらに動的コンテンツの読み込みを待つ
-                time.sleep(5)
-                logger.info(f"iframe[{i}]のコンテンツ読み込み完了")
+    使用方法: python main.py batch 名簿ファイル [並列数]
+    """
+    if not args:
+        print("使用方法: python main.py batch 名簿ファイル(.csv/.json) [並列数]")
+        sys.exit(1)
 
-                button = self.driver.find_element(By.ID, button_id)
-                logger.info(f"★iframe[{i}]でID '{button_id}' のボタンを発見しました")
-                return button
-            except Exception as e:
-                logger.info(f"iframe[{i}]でボタンが見つかりませんでした: {e}")
-                continue
+    try:
+        roster = load_roster(args[0])
+        max_workers = int(args[1]) if len(args) >= 2 else None
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
 
-        self.driver.switch_to.default_content()
-        logger.warning(f"ID '{button_id}' のボタンはどこにも見つかりませんでした")
-        return None
+    if not roster:
+        print("名簿にユーザーがいません")
+        sys.exit(1)
 
-    def take_screenshot(self, filename):
-        """スクリーンショットを保存"""
+    config = SalesforceAutoCheckInOut().config
+    max_workers = max_workers or config.get("batch", {}).get("max_workers")
+    if config.get("browser") == "remote":
+        # Selenium Grid のスロット数に応じて割り振り、並列数もスロット数に合わせる
         try:
-            screenshot_dir = Path(self.base_dir) / "screenshots"
-            screenshot_dir.mkdir(exist_ok=True)
-            filepath = (
-                screenshot_dir
-                / f"{filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            )
-            self.driver.save_screenshot(str(filepath))
-            logger.info(f"スクリーンショットを保存しました: {filepath}")
-        except Exception as e:
-            logger.error(f"スクリーンショットの保存に失敗しました: {e}")
+            roster, capacity = assign_remote_nodes(roster, config.get("remote", {}))
+        except RuntimeError as e:
+            print(f"エラー: {e}")
+            sys.exit(1)
+        max_workers = max_workers or capacity
+    results = run_batch(roster, max_workers=max_workers)
+    if all(entry["action"] == "状態" for entry in roster):
+        # 状態の確認のみの場合はJSONで出力（監視用）
+        print(json.dumps([_status_output(result) for result in results], ensure_ascii=False, indent=2))
+    else:
+        print_batch_summary(results)
 
-    def close(self):
-        """ブラウザを閉じる"""
-        if self.driver:
-            self.driver.quit()
-            logger.info("ブラウザを閉じました")
+    # 終了コード（1人でも失敗した場合は1）
+    sys.exit(0 if all(result["success"] for result in results) else 1)
 
-    def execute(self, action_type, work_location=None):
-        """出勤または退勤を実行
 
-        Args:
-            action_type: "出勤" または "退勤"
-            work_location: 勤務場所（"自宅" など）。Noneの場合は選択しない
-        """
-        try:
-            location_info = f"（{work_location}）" if work_location else ""
-            logger.info(f"{'='*50}")
-            logger.info(f"{action_type}{location_info}処理を開始します")
-            logger.info(f"{'='*50}")
+# スケジュールの曜日の表記
+_WEEKDAYS = {
+    "月": 0, "火": 1, "水": 2, "木": 3, "金": 4, "土": 5, "日": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
 
-            # WebDriverセットアップ
-            self.setup_driver()
 
-            # ログイン
-            if not self.login():
-                self.take_screenshot(f"{action_type}_login_failed")
-                return False
+def _parse_window(window):
+    """"08:45-09:15" を ((8, 45), (9, 15)) に変換"""
+    try:
+        start, end = (
+            tuple(int(part) for part in value.strip().split(":"))
+            for value in window.split("-")
+        )
+        if len(start) != 2 or len(end) != 2 or start >= end:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"時間帯の形式が正しくありません（例: 08:45-09:15）: {window}")
+    return start, end
+
+
+def _parse_weekdays(weekdays):
+    """["月", "火"] / "月火水木金" / ["mon", "tue"] を曜日番号の集合に変換"""
+    if isinstance(weekdays, str):
+        weekdays = list(weekdays) if all(c in _WEEKDAYS for c in weekdays) else weekdays.split(",")
+    try:
+        return {_WEEKDAYS[str(day).strip().lower()] for day in weekdays}
+    except KeyError as e:
+        raise ValueError(f"曜日の表記が正しくありません: {e.args[0]}")
+
+
+def load_holidays(path):
+    """休日ファイル（1行に1日、YYYY-MM-DD または YYYY/MM/DD。# 以降はコメント）を読み込む"""
+    holidays = set()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            value = line.split("#", 1)[0].strip()
+            if value:
+                holidays.add(datetime.strptime(value.split()[0].replace("/", "-"), "%Y-%m-%d").date())
+    return holidays
+
+
+def load_schedule(schedule_path):
+    """スケジュールファイル（JSON）を読み込む
+
+    users の各要素は username, password, action, window（"08:45-09:15"）を持ち、
+    weekdays（既定は月〜金）、work_location、holidays（休日ファイル）を指定できる。
+    password には名簿と同様に参照（env:環境変数名 / file:ファイルパス）を指定できる。
+    """
+    path = Path(schedule_path)
+    with open(path, "r", encoding="utf-8-sig") as f:
+        schedule = json.load(f)
+
+    def holidays_at(value):
+        if not value:
+            return set()
+        holiday_path = Path(value)
+        if not holiday_path.is_absolute():
+            holiday_path = path.parent / holiday_path
+        return load_holidays(holiday_path)
+
+    common_holidays = holidays_at(schedule.get("holidays"))
+    entries = []
+    for index, user in enumerate(schedule.get("users", []), 1):
+        username = (user.get("username") or "").strip()
+        action = (user.get("action") or "").strip()
+        if not username or action not in ["出勤", "退勤"] or not user.get("window"):
+            raise ValueError(
+                f"スケジュールの{index}件目: username, action（出勤/退勤）, window は必須です"
+            )
+        entries.append(
+            {
+                "username": username,
+                "password": user.get("password") or "",
+                "action": action,
+                "work_location": (user.get("work_location") or "").strip() or None,
+                "window": _parse_window(user["window"]),
+                "weekdays": _parse_weekdays(user.get("weekdays", "月火水木金")),
+                "holidays": common_holidays | holidays_at(user.get("holidays")),
+            }
+        )
+    schedule["entries"] = entries
+    return schedule
+
+
+class PunchScheduler:
+    """スケジュールに従って出勤・退勤を実行する
+
+    ユーザーごとの時間帯（window）に、同じ時間帯のユーザーを均等に割り振り、
+    さらにランダムなずれ（ジッター）を加えて実行する。時間帯の後半は再試行のために空けておき、
+    失敗した場合は retry_interval 秒後に、時間帯の終わりまで max_attempts 回まで再試行する。
+    ログインフォームの入力は、組織ごとに max_concurrent_logins 件までに制限する
+    （ワーカープロセス間で共有するセマフォを使用）。
+    """
+
+    def __init__(self, schedule, config, config_path="config.json"):
+        self.schedule = schedule
+        self.config = config
+        self.config_path = config_path
+        self.max_attempts = int(schedule.get("max_attempts", 3))
+        self.retry_interval = float(schedule.get("retry_interval", 60))
+        self.spread = min(1.0, max(0.0, float(schedule.get("spread", 0.6))))
+        self.org = urlparse(config.get("salesforce_url", "")).netloc
+        self.queue = []
+        self.sequence = 0
+        self.results = []
+
+    def plan_day(self, day, now=None):
+        """指定日の実行時刻を決めてキューに入れる
+
+        Returns:
+            list: (実行時刻, エントリー) のリスト（時刻順）
+        """
+        import heapq
+        import random
 
-            # 出勤または退勤
-            if action_type == "出勤":
-                result = self.click_checkin_button(work_location)
-            elif action_type == "退勤":
-                result = self.click_checkout_button(work_location)
-            else:
-                logger.error(f"不正なアクションタイプ: {action_type}")
-                return False
+        now = now or datetime.now()
+        groups = {}
+        for entry in self.schedule["entries"]:
+            if day.weekday() not in entry["weekdays"] or day in entry["holidays"]:
+                continue
+            groups.setdefault(entry["window"], []).append(entry)
+
+        planned = []
+        for (start, end), entries in groups.items():
+            window_start = datetime.combine(day, datetime.min.time()).replace(hour=start[0], minute=start[1])
+            window_end = datetime.combine(day, datetime.min.time()).replace(hour=end[0], minute=end[1])
+            if now >= window_end:
+                for entry in entries:
+                    logger.warning(
+                        f"[{entry['username']}] {entry['action']}の時間帯を過ぎているためスキップします"
+                        f"（{window_start:%H:%M}-{window_end:%H:%M}）"
+                    )
+                continue
 
-            # 結果に応じた処理
-            if result == "already_done":
-                # 既に出勤/退勤済みの場合
-                self.take_screenshot(f"{action_type}_already_done")
-                logger.info(f"既に{action_type}済みです。処理を完了します。")
-                success = True
-            elif result == "not_checked_in":
-                # まだ出勤していない場合（退勤時のみ）
-                self.take_screenshot(f"{action_type}_not_checked_in")
-                logger.error("まだ出勤していません。先に出勤してください。")
-                success = False
-            elif result:
-                # 成功した場合
-                self.take_screenshot(f"{action_type}_success")
-                logger.info(f"{action_type}処理が完了しました！")
-                success = True
-            else:
-                # 失敗した場合
-                self.take_screenshot(f"{action_type}_failed")
-                logger.error(f"{action_type}処理に失敗しました")
-                success = False
+            # 開始済みの時間帯は、残りの時間に割り振る
+            spread_start = max(window_start, now)
+            spread_seconds = (window_end - spread_start).total_seconds() * self.spread
+            slot = spread_seconds / len(entries)
+            random.shuffle(entries)
+            for index, entry in enumerate(entries):
+                run_at = spread_start + timedelta(seconds=slot * index + random.uniform(0, slot))
+                job = {"entry": entry, "window_end": window_end, "attempt": 1}
+                heapq.heappush(self.queue, (run_at, self.sequence, job))
+                self.sequence += 1
+                planned.append((run_at, entry))
+        return sorted(planned, key=lambda item: item[0])
+
+    def run(self, once=False):
+        """スケジュールを実行（once の場合は当日分が終わったら終了）"""
+        import heapq
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+        workers = int(
+            self.schedule.get("max_workers")
+            or self.config.get("batch", {}).get("max_workers")
+            or _os.cpu_count()
+            or 1
+        )
+        if self.config.get("browser") == "remote":
+            # Selenium Grid のスロット数に応じて割り振る
+            self.schedule["entries"], capacity = assign_remote_nodes(
+                self.schedule["entries"], self.config.get("remote", {})
+            )
+            workers = int(self.schedule.get("max_workers") or capacity)
+        max_logins = int(self.schedule.get("max_concurrent_logins", 2))
+        manager = multiprocessing.Manager()
+        login_gates = {self.org: manager.BoundedSemaphore(max_logins)}
+        logger.info(
+            f"スケジューラーを開始します（並列数: {workers}、組織ごとの同時ログイン数: {max_logins}）"
+        )
 
-            # 結果確認のため少し待機
-            time.sleep(3)
+        today = datetime.now().date()
+        self._log_plan(self.plan_day(today))
+        next_plan = datetime.combine(today + timedelta(days=1), datetime.min.time())
+
+        running = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                while self.queue or running or not once:
+                    now = datetime.now()
+                    if not once and now >= next_plan:
+                        self._log_plan(self.plan_day(next_plan.date(), now))
+                        next_plan += timedelta(days=1)
+
+                    while self.queue and self.queue[0][0] <= now:
+                        _, _, job = heapq.heappop(self.queue)
+                        entry = job["entry"]
+                        logger.info(
+                            f"[{entry['username']}] {entry['action']}を実行します（{job['attempt']}回目）"
+                        )
+                        future = executor.submit(
+                            _run_batch_entry, entry, self.config_path, login_gates[self.org]
+                        )
+                        running[future] = job
+
+                    wake_at = [next_plan] if not once else []
+                    if self.queue:
+                        wake_at.append(self.queue[0][0])
+                    timeout = min([60.0] + [(t - now).total_seconds() for t in wake_at])
+                    done, _ = wait(list(running), timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(running.pop(future), future)
+        except KeyboardInterrupt:
+            logger.info("スケジューラーを停止します")
+        finally:
+            manager.shutdown()
+        return self.results
 
-            return success
+    def _finish(self, job, future):
+        """実行結果を記録し、失敗した場合は時間帯内で再試行する"""
+        import heapq
 
+        entry = job["entry"]
+        try:
+            result = future.result()
         except Exception as e:
-            logger.error(f"処理中にエラーが発生しました: {e}")
-            self.take_screenshot(f"{action_type}_error")
-            return False
-        finally:
-            # メインフレームに戻る
-            try:
-                self.driver.switch_to.default_content()
-            except:
-                pass
+            result = {
+                "username": entry["username"],
+                "action": entry["action"],
+                "work_location": entry["work_location"],
+                "success": False,
+                "error": f"ワーカープロセスが異常終了しました: {e}",
+                "elapsed": None,
+            }
 
-            # 自動クローズの設定確認
-            if self.config.get("auto_close", True):
-                self.close()
-            else:
-                logger.info("ブラウザは開いたままです（auto_close=false）")
+        retry_at = datetime.now() + timedelta(seconds=self.retry_interval)
+        if (
+            not result["success"]
+            and job["attempt"] < self.max_attempts
+            and retry_at < job["window_end"]
+        ):
+            logger.warning(
+                f"[{entry['username']}] {entry['action']}に失敗しました。"
+                f"{retry_at:%H:%M:%S} に再試行します: {result['error'] or ''}"
+            )
+            retry = {**job, "attempt": job["attempt"] + 1}
+            heapq.heappush(self.queue, (retry_at, self.sequence, retry))
+            self.sequence += 1
+            return
+
+        logger.info(
+            f"[{entry['username']}] {entry['action']}: {'成功' if result['success'] else '失敗'}"
+            f"（{job['attempt']}回目）"
+        )
+        self.results.append(result)
+
+    @staticmethod
+    def _log_plan(planned):
+        for run_at, entry in planned:
+            logger.info(f"予定: {run_at:%Y-%m-%d %H:%M:%S} [{entry['username']}] {entry['action']}")
+
+
+def schedule(args):
+    """スケジュールに従って出勤・退勤を実行する
+
+    使用方法:
+        python main.py schedule スケジュールファイル           … 常駐して毎日実行
+        python main.py schedule スケジュールファイル --once    … 当日分のみ実行して終了
+        python main.py schedule スケジュールファイル --dry-run … 当日の実行予定を表示
+    """
+    options = [arg for arg in args if arg.startswith("--")]
+    paths = [arg for arg in args if not arg.startswith("--")]
+    if len(paths) != 1 or set(options) - {"--once", "--dry-run"}:
+        print("使用方法: python main.py schedule スケジュールファイル(.json) [--once|--dry-run]")
+        sys.exit(1)
+
+    try:
+        schedule_data = load_schedule(paths[0])
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+    config = SalesforceAutoCheckInOut().config
+    scheduler = PunchScheduler(schedule_data, config)
+
+    if "--dry-run" in options:
+        planned = scheduler.plan_day(datetime.now().date())
+        for run_at, entry in planned:
+            print(f"{run_at:%H:%M:%S}  {entry['username']}  {entry['action']}  {entry['work_location'] or '-'}")
+        print(f"\n本日の予定: {len(planned)}件")
+        sys.exit(0)
+
+    results = scheduler.run(once="--once" in options)
+    if results:
+        print_batch_summary(results)
+    sys.exit(0 if all(result["success"] for result in results) else 1)
+
+
+def print_usage():
+    """使用方法を表示"""
+    print("使用方法: python main.py [出勤|退勤] [勤務場所]")
+    print("例: python main.py 出勤 自宅")
+    print("打刻の状態（JSON）: python main.py 状態")
+    print("複数ユーザー: python main.py batch 名簿ファイル [並列数]")
+    print("複数ユーザー（共有ブラウザ）: python main.py shared 名簿ファイル [同時実行数]")
+    print("常駐モード: python main.py daemon [stop]")
+    print("スケジュール実行: python main.py schedule スケジュールファイル [--once|--dry-run]")
+    print("ドライバーの事前登録: python main.py seed-drivers [ブラウザ] [ドライバー]")
+    print("ブラウザの起動確認: python main.py probe [ブラウザ ...]")
+    print("Selenium Grid のスロット数: python main.py grid [GridのURL ...]")
+    print("起動時間の内訳: 各コマンドに --startup-profile を追加")
+    print("または: 出勤.exe / 退勤.exe / 在宅出勤.exe / 在宅退勤.exe をダブルクリック")
 
 
 def main():
     """メイン処理"""
     import os
 
+    global _startup_profile_enabled
+
+    # 起動時間の内訳を表示（どのコマンドにも指定可能）
+    if "--startup-profile" in sys.argv:
+        sys.argv.remove("--startup-profile")
+        _startup_profile_enabled = True
+        atexit.register(print_startup_profile)
+
+    if len(sys.argv) >= 2 and sys.argv[1] in ("-h", "--help"):
+        print_usage()
+        sys.exit(0)
+
     # 実行ファイル名から動作を自動判断
     exe_name = os.path.basename(sys.argv[0])
     action_type = None
     work_location = None
 
+    if len(sys.argv) >= 2 and sys.argv[1] == "batch":
+        batch(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "shared":
+        shared(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "daemon":
+        daemon(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "seed-drivers":
+        seed_drivers(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "probe":
+        probe(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "grid":
+        grid(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] == "schedule":
+        schedule(sys.argv[2:])
+    if len(sys.argv) >= 2 and sys.argv[1] in ("状態", "status"):
+        status(sys.argv[2:])
+
     if len(sys.argv) >= 2:
         # コマンドライン引数がある場合
         action_type = sys.argv[1]
@@ -1074,11 +5762,7 @@ def main():
             work_location = "恵比寿本社"
             print("退勤処理を開始します（恵比寿本社）...")
         else:
-            print("使用方法: python main.py [出勤|退勤] [勤務場所]")
-            print("例: python main.py 出勤 自宅")
-            print(
-                "または: 出勤.exe / 退勤.exe / 在宅出勤.exe / 在宅退勤.exe をダブルクリック"
-            )
+            print_usage()
             input("Enterキーを押して終了...")
             sys.exit(1)
 
@@ -1087,8 +5771,17 @@ def main():
         input("Enterキーを押して終了...")
         sys.exit(1)
 
-    automation = SalesforceAutoCheckInOut()
-    success = automation.execute(action_type, work_location)
+    # 常駐モードが起動している場合は処理を任せる
+    response = request_daemon(action_type, work_location)
+    if response is not None:
+        if response.get("error"):
+            print(f"常駐モード: {response['error']}")
+        success = response.get("success", False)
+    else:
+        automation = SalesforceAutoCheckInOut()
+        success = automation.execute(action_type, work_location)
+
+    print_startup_profile()
 
     # 結果表示
     location_info = f"（{work_location}）" if work_location else ""
@@ -1105,5 +5798,15 @@ def main():
     sys.exit(0 if success else 1)
 
 
+_STARTUP_TIMINGS.append(
+    (
+        "main.py の読み込み",
+        time.perf_counter() - _MODULE_LOAD_START,
+        len(sys.modules) - _MODULE_COUNT_START,
+    )
+)
+
 if __name__ == "__main__":
+    # PyInstallerでビルドした実行ファイルからワーカープロセスを起動するために必要
+    multiprocessing.freeze_support()
     main()
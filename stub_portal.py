@@ -0,0 +1,540 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Salesforce/TeamSpirit のローカルスタブ
+
+本番のSalesforceを使わずに動作確認・性能測定するためのHTTPサーバー。
+SalesforceAutoCheckInOut が実際に扱う以下の画面を再現する:
+    - ログイン画面（username / password / Login、エラー時は #error）
+    - Lightningのページ（force-aloha-page のShadow Root内に vfFrameId* のiframe）
+    - TeamSpiritのVisualforceページ（勤務場所タブ、出勤・退勤ボタンとその無効化状態、
+      Visualforce Remotingの設定）と、打刻要求を受け付ける /apexremote
+
+ログイン画面は 127.0.0.1、ログイン後のページは localhost で提供し、
+本番と同様にログイン後にホストが変わるようにしている。
+各画面の遅延（ミリ秒）とDOMの要素数は StubPortal の options で変更できる。
+
+使用方法:
+    python stub_portal.py [ポート番号] [--login-delay-ms 500 --dom-nodes 3000 ...]
+    python stub_portal.py --check-http-punch
+"""
+
+import argparse
+import json
+import secrets
+import sys
+import threading
+import time
+from html import escape
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# スタブのセッションID（Cookie "sid" の値）
+STUB_SESSION_ID = "stub-session"
+
+# ログインできるユーザー
+STUB_USERNAME = "stub@example.com"
+STUB_PASSWORD = "stub-password"
+
+# ログイン画面とログイン後のページのホスト（同じポートで待ち受ける）
+LOGIN_HOST = "127.0.0.1"
+APP_HOST = "localhost"
+
+# Visualforce Remotingのコントローラーとメソッド（config.json の http_punch と合わせる）
+STUB_CONTROLLER = "StubPunchController"
+STUB_METHOD = "punch"
+
+# 画像（1x1のPNG）。Lightningのページのバナーは軽量モードでブロックされ、
+# TeamSpiritのページのロゴ（/apex/ 以下の静的リソース）は許可リストに一致するため読み込まれる
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000b49444154789c6360000200000500017a5eab3f0000"
+    "000049454e44ae426082"
+)
+LIGHTNING_ASSET = "/img/lightning_banner.png"
+TEAMSPIRIT_ASSET = "/apex/resource/teamspirit_logo.png"
+
+# 遅延（ミリ秒）とDOMの要素数の既定値
+DEFAULT_OPTIONS = {
+    # ログインボタン押下から応答までの遅延
+    "login_delay_ms": 0,
+    # Lightningのページの応答の遅延
+    "lightning_delay_ms": 0,
+    # Lightningのページの表示から force-aloha-page にiframeが追加されるまでの遅延
+    "aloha_delay_ms": 0,
+    # Visualforceページの応答の遅延
+    "timesheet_delay_ms": 0,
+    # Visualforceページの表示から出勤・退勤ボタンが表示されるまでの遅延
+    "button_delay_ms": 0,
+    # 打刻要求（/apexremote）の応答の遅延
+    "punch_delay_ms": 0,
+    # Lightningのページ・Visualforceページそれぞれに追加するダミー要素の数
+    "dom_nodes": 0,
+    # 勤務場所タブ（先頭が初期選択）
+    "work_locations": ["恵比寿本社", "自宅"],
+}
+
+LOGIN_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>ログイン | Salesforce</title>
+</head>
+<body>
+<form id="login_form" method="post" action="/login">
+  <div id="error" style="{error_style}">{error}</div>
+  <input type="email" id="username" name="username">
+  <input type="password" id="password" name="pw">
+  <input type="submit" id="Login" name="Login" value="ログイン">
+</form>
+</body>
+</html>
+"""
+
+LIGHTNING_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>ホーム | Salesforce</title>
+</head>
+<body>
+<div class="oneHeader"><img src="{asset}" alt="">Lightning Experience</div>
+<div class="oneContent">{filler}</div>
+<force-aloha-page></force-aloha-page>
+<script>
+setTimeout(function () {{
+  var root = document.querySelector('force-aloha-page').attachShadow({{mode: 'open'}});
+  var iframe = document.createElement('iframe');
+  iframe.name = 'vfFrameId_' + Date.now();
+  iframe.src = '/apex/timesheet';
+  iframe.style.width = '100%';
+  iframe.style.height = '600px';
+  root.appendChild(iframe);
+}}, {aloha_delay_ms});
+</script>
+</body>
+</html>
+"""
+
+TIMESHEET_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>TeamSpirit</title>
+<script>
+var $VFRM = {{RemotingProviderImpl: function (config) {{ this.config = config; }}}};
+var Visualforce = {{remoting: {{Manager: {{add: function (provider) {{ window.stubProvider = provider.config; }}}}}}}};
+</script>
+<script>
+Visualforce.remoting.Manager.add(new $VFRM.RemotingProviderImpl({provider}));
+</script>
+</head>
+<body>
+<img class="pw_logo" src="{asset}" alt="TeamSpirit">
+<div class="pw_tabs" role="tablist">{tabs}</div>
+<div class="pw_base" id="pwBase"></div>
+<template id="pwButtons">
+  <input type="button" id="btnStInput" value="出勤" onclick="stubPunch(this, '出勤')" {checkin_disabled}>
+  <input type="button" id="btnEtInput" value="退勤" onclick="stubPunch(this, '退勤')" {checkout_disabled}>
+</template>
+<table class="pw_times">
+  <tr><th>出勤</th><td id="pwStartTime">{start_time}</td></tr>
+  <tr><th>退勤</th><td id="pwEndTime">{end_time}</td></tr>
+</table>
+<div class="pw_records">{filler}</div>
+<script>
+function stubSelectTab(tab) {{
+  document.querySelectorAll('.pw_tabs [role="tab"]').forEach(function (el) {{
+    el.classList.toggle('selected', el === tab);
+  }});
+}}
+function stubPunch(button, action) {{
+  var config = window.stubProvider;
+  var controller = Object.keys(config.actions)[0];
+  var method = config.actions[controller].ms[0];
+  var tab = document.querySelector('.pw_tabs .selected');
+  button.disabled = true;
+  fetch('/' + config.service, {{
+    method: 'POST',
+    headers: {{'Content-Type': 'application/json', 'X-User-Agent': 'Visualforce-Remoting'}},
+    body: JSON.stringify({{
+      action: controller, method: method.name, type: 'rpc', tid: 1,
+      data: [action, tab ? tab.textContent : null],
+      ctx: {{csrf: method.csrf, vid: config.vf.vid, ns: method.ns, ver: method.ver}}
+    }})
+  }}).then(function (response) {{ return response.json(); }}).then(function (results) {{
+    if (results[0].statusCode !== 200) {{
+      button.disabled = false;
+      return;
+    }}
+    var time = new Date().toTimeString().slice(0, 5);
+    if (action === '出勤') {{
+      document.getElementById('pwStartTime').textContent = time;
+      document.getElementById('btnEtInput').disabled = false;
+    }} else {{
+      document.getElementById('pwEndTime').textContent = time;
+    }}
+  }});
+}}
+setTimeout(function () {{
+  var template = document.getElementById('pwButtons');
+  document.getElementById('pwBase').appendChild(template.content.cloneNode(true));
+}}, {button_delay_ms});
+</script>
+</body>
+</html>
+"""
+
+
+def _filler(count):
+    """DOMの要素数を増やすためのダミー要素"""
+    return "".join(
+        f'<div class="slds-card"><span>レコード {index}</span></div>'
+        for index in range(count)
+    )
+
+
+class StubPortal:
+    """スタブの状態（打刻状態とCSRFトークン）と設定"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self.lock = threading.Lock()
+        self.csrf = secrets.token_hex(8)
+        self.reset()
+
+    def reset(self):
+        """打刻状態を初期化（未出勤）"""
+        with self.lock:
+            self.checked_in = False
+            self.checked_out = False
+            self.start_time = ""
+            self.end_time = ""
+            self.punches = []
+            self.logins = 0
+            # 読み込まれた画像のパス
+            self.assets = []
+
+    def delay(self, name):
+        """設定した遅延（name_delay_ms）だけ待機"""
+        time.sleep(self.options[f"{name}_delay_ms"] / 1000)
+
+    def login_html(self, error=""):
+        """ログイン画面"""
+        return LOGIN_HTML.format(
+            error=escape(error), error_style="" if error else "display:none"
+        )
+
+    def lightning_html(self):
+        """force-aloha-page を含むLightningのページ"""
+        return LIGHTNING_HTML.format(
+            asset=LIGHTNING_ASSET,
+            filler=_filler(self.options["dom_nodes"]),
+            aloha_delay_ms=int(self.options["aloha_delay_ms"]),
+        )
+
+    def provider(self):
+        """Visualforce Remotingの設定"""
+        return {
+            "vf": {"vid": "06600000000stub", "xhr": False},
+            "actions": {
+                STUB_CONTROLLER: {
+                    "ms": [
+                        {
+                            "name": STUB_METHOD,
+                            "len": 2,
+                            "ns": "",
+                            "ver": 58.0,
+                            "csrf": self.csrf,
+                            "authorization": "stub-authorization",
+                        }
+                    ],
+                    "prm": 0,
+                }
+            },
+            "service": "apexremote",
+        }
+
+    def timesheet_html(self):
+        """勤務場所タブと出勤・退勤ボタンを含むVisualforceページ"""
+        with self.lock:
+            checkin_disabled = self.checked_in
+            checkout_disabled = self.checked_out or not self.checked_in
+            start_time, end_time = self.start_time, self.end_time
+        tabs = "".join(
+            f'<div role="tab" class="tab{" selected" if index == 0 else ""}"'
+            f' onclick="stubSelectTab(this)">{escape(location)}</div>'
+            for index, location in enumerate(self.options["work_locations"])
+        )
+        return TIMESHEET_HTML.format(
+            provider=json.dumps(self.provider()),
+            asset=TEAMSPIRIT_ASSET,
+            tabs=tabs,
+            checkin_disabled='disabled="disabled"' if checkin_disabled else "",
+            checkout_disabled='disabled="disabled"' if checkout_disabled else "",
+            start_time=start_time,
+            end_time=end_time,
+            filler=_filler(self.options["dom_nodes"]),
+            button_delay_ms=int(self.options["button_delay_ms"]),
+        )
+
+    def punch(self, action, work_location):
+        """打刻を記録（失敗時はエラーメッセージを返す）"""
+        now = time.strftime("%H:%M")
+        with self.lock:
+            if action == "出勤":
+                if self.checked_in:
+                    return "既に出勤済みです"
+                self.checked_in = True
+                self.start_time = now
+            elif action == "退勤":
+                if not self.checked_in or self.checked_out:
+                    return "退勤できません"
+                self.checked_out = True
+                self.end_time = now
+            else:
+                return f"不正な打刻種別です: {action}"
+            self.punches.append({"action": action, "work_location": work_location})
+        return None
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """スタブのリクエストハンドラー"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def portal(self):
+        return self.server.portal
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/":
+            self._send_html(self.portal.login_html())
+        elif url.path == "/secur/frontdoor.jsp":
+            # ログイン後のホストでセッションのCookieを設定してホーム画面へ
+            session_id = parse_qs(url.query).get("sid", [""])[0]
+            if session_id != STUB_SESSION_ID:
+                self._redirect_to_login()
+                return
+            self._send(
+                302,
+                b"",
+                headers={
+                    "Set-Cookie": f"sid={STUB_SESSION_ID}; Path=/; HttpOnly",
+                    "Location": "/lightning/page/home",
+                },
+            )
+        elif url.path in (LIGHTNING_ASSET, TEAMSPIRIT_ASSET):
+            with self.portal.lock:
+                self.portal.assets.append(url.path)
+            self._send(200, PIXEL_PNG, "image/png")
+        elif url.path not in ("/lightning/page/home", "/apex/timesheet"):
+            self._send(404, b"not found", "text/plain")
+        elif not self._authenticated():
+            # 本番と同様、セッションがなければログイン画面へリダイレクト
+            self._redirect_to_login()
+        elif url.path == "/lightning/page/home":
+            self.portal.delay("lightning")
+            self._send_html(self.portal.lightning_html())
+        else:
+            self.portal.delay("timesheet")
+            self._send_html(self.portal.timesheet_html())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = urlparse(self.path).path
+        if path == "/login":
+            self._login(body)
+        elif path == "/apexremote":
+            self.portal.delay("punch")
+            self._send_json(200, [self._remoting_response(body)])
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def _login(self, body):
+        """ログインフォームの送信を処理"""
+        self.portal.delay("login")
+        form = parse_qs(body.decode("utf-8"))
+        username = form.get("username", [""])[0]
+        password = form.get("pw", [""])[0]
+        if (username, password) != (STUB_USERNAME, STUB_PASSWORD):
+            self._send_html(
+                self.portal.login_html(
+                    "ユーザー名とパスワードを確認してください。"
+                )
+            )
+            return
+        with self.portal.lock:
+            self.portal.logins += 1
+        self._send(
+            302,
+            b"",
+            headers={
+                "Location": f"http://{APP_HOST}:{self._port()}"
+                f"/secur/frontdoor.jsp?sid={STUB_SESSION_ID}"
+            },
+        )
+
+    def _redirect_to_login(self):
+        self._send(302, b"", headers={"Location": f"http://{LOGIN_HOST}:{self._port()}/"})
+
+    def _port(self):
+        return self.server.server_address[1]
+
+    def _remoting_response(self, body):
+        """Visualforce Remotingの要求を処理"""
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return {"statusCode": 400, "type": "exception", "message": "invalid json"}
+
+        error = None
+        if not self._authenticated():
+            error = "invalid session"
+        elif self.headers.get("X-User-Agent") != "Visualforce-Remoting":
+            error = "missing X-User-Agent"
+        elif request.get("ctx", {}).get("csrf") != self.portal.csrf:
+            error = "invalid csrf token"
+        elif (request.get("action"), request.get("method")) != (
+            STUB_CONTROLLER,
+            STUB_METHOD,
+        ):
+            error = "unknown method"
+        else:
+            data = request.get("data") or []
+            error = self.portal.punch(
+                data[0] if data else None, data[1] if len(data) > 1 else None
+            )
+
+        if error:
+            return {
+                "statusCode": 400,
+                "type": "exception",
+                "tid": request.get("tid"),
+                "message": error,
+            }
+        return {
+            "statusCode": 200,
+            "type": "rpc",
+            "tid": request.get("tid"),
+            "ref": False,
+            "action": request["action"],
+            "method": request["method"],
+            "result": True,
+        }
+
+    def _authenticated(self):
+        """Cookie "sid" がスタブのセッションIDと一致するか"""
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return "sid" in cookie and cookie["sid"].value == STUB_SESSION_ID
+
+    def _send_html(self, html):
+        self._send(200, html.encode("utf-8"), "text/html")
+
+    def _send_json(self, status, data):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type=None, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_portal(port=0, options=None):
+    """スタブをバックグラウンドのスレッドで起動
+
+    Args:
+        port: 待ち受けポート（0の場合は自動）
+        options: 遅延とDOMの要素数（DEFAULT_OPTIONS を参照）
+
+    Returns:
+        ThreadingHTTPServer: server.portal でスタブの状態、server.server_address でポートを参照できる
+    """
+    server = ThreadingHTTPServer((LOGIN_HOST, port), StubRequestHandler)
+    server.daemon_threads = True
+    server.portal = StubPortal(options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_http_punch():
+    """HTTPでの打刻（main.TeamSpiritHttpPunch）をスタブに対して確認する"""
+    from main import PooledHttpClient, TeamSpiritHttpPunch
+
+    server = start_stub_portal()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    settings = {
+        "controller": STUB_CONTROLLER,
+        "method": STUB_METHOD,
+        "args": ["{action}", "{work_location}"],
+    }
+    client = PooledHttpClient()
+    client.add_cookies([{"domain": "127.0.0.1", "name": "sid", "value": STUB_SESSION_ID}])
+    punch = TeamSpiritHttpPunch(client, f"{base_url}/apex/timesheet", settings)
+
+    results = [
+        ("退勤（未出勤）", punch.punch("退勤"), "not_checked_in"),
+        ("出勤", punch.punch("出勤", "自宅"), True),
+        ("出勤（出勤済み）", punch.punch("出勤"), "already_done"),
+        ("退勤", punch.punch("退勤", "自宅"), True),
+        ("退勤（退勤済み）", punch.punch("退勤"), "already_done"),
+    ]
+    client.close()
+    server.shutdown()
+
+    ok = True
+    for name, actual, expected in results:
+        passed = actual == expected
+        ok = ok and passed
+        print(f"{'✓' if passed else '✗'} {name}: {actual!r}（期待値: {expected!r}）")
+    return ok
+
+
+def add_option_arguments(parser):
+    """スタブの遅延とDOMの要素数の引数を追加（benchmark.py と共用）"""
+    for name, default in DEFAULT_OPTIONS.items():
+        if name == "work_locations":
+            continue
+        parser.add_argument(
+            "--" + name.replace("_", "-"), type=int, default=default, metavar="N"
+        )
+
+
+def options_from_arguments(args):
+    """引数からスタブの options を作成"""
+    return {
+        name: getattr(args, name)
+        for name in DEFAULT_OPTIONS
+        if name != "work_locations"
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--check-http-punch":
+        sys.exit(0 if check_http_punch() else 1)
+
+    parser = argparse.ArgumentParser(description="Salesforce/TeamSpirit のローカルスタブ")
+    parser.add_argument("port", nargs="?", type=int, default=8080)
+    add_option_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_stub_portal(args.port, options_from_arguments(args))
+    port = server.server_address[1]
+    print(f"スタブを起動しました: http://{LOGIN_HOST}:{port}/")
+    print(f"ユーザー名: {STUB_USERNAME} / パスワード: {STUB_PASSWORD}")
+    print("Ctrl+C で終了します")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,255 @@
+"""Chrome の DevTools Protocol のテストダブル
+
+CdpConnection が使う urllib.request.urlopen（/json/version）と websocket.create_connection を
+置き換え、ブラウザの代わりにコマンドへ応答する。ページのタブ（T1）と、ボタンがある
+別プロセスのiframe（VF、Target.setAutoAttach で子セッションとしてアタッチされる）、
+ブラウザコンテキストごとのCookie、Fetch.enable で一時停止したリクエストを再現する。
+"""
+
+import io
+import itertools
+import json
+import queue
+
+import websocket
+
+ADDRESS = "127.0.0.1:9222"
+PAGE_TARGET = "T1"
+FRAME_TARGET = "VF"
+# ページ上のiframeの左上の座標と、iframe内のボタンの位置（左上・右下）
+FRAME_OFFSET = (100.0, 200.0)
+BUTTON_RECT = (10.0, 10.0, 30.0, 20.0)
+BUTTON_STATE = {"id": "btnStInput", "value": "出勤", "disabled": False}
+
+
+class FakeChrome:
+    """DevTools Protocol のコマンドに応答するブラウザ
+
+    Attributes:
+        calls: 受信したコマンド（method, params, sessionId）
+        errors: エラーを返すコマンド（method -> メッセージ）
+        button_after: ボタンが見つかるまでのiframeでの Runtime.evaluate の回数（Noneの場合は見つからない）
+        search_results: DOM.performSearch の結果の件数
+        clicks: Input.dispatchMouseEvent の mousePressed の座標
+        cookies: ブラウザコンテキストのID -> {Cookie名: 値}
+        disposed: Target.disposeBrowserContext で破棄したブラウザコンテキストのID
+        requests: 一時停止したリクエストのID -> "paused" / "continued" / "blocked"
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.errors = {}
+        self.button_after = 0
+        self.search_results = 0
+        self.clicks = []
+        self.evaluations = 0
+        self.targets = {PAGE_TARGET: {"type": "page", "url": "about:blank", "context": ""}}
+        self.sessions = {}
+        self.cookies = {"": {}}
+        self.disposed = []
+        self.requests = {}
+        self.sockets = []
+        self.request_ids = itertools.count(1)
+
+    def install(self, monkeypatch):
+        """urlopen と create_connection をこのブラウザに置き換える"""
+        import urllib.request
+
+        def urlopen(url, timeout=None):
+            assert url == f"http://{ADDRESS}/json/version"
+            return io.BytesIO(json.dumps({"webSocketDebuggerUrl": "ws://fake"}).encode())
+
+        monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+        monkeypatch.setattr(websocket, "create_connection", lambda url, **kwargs: self.connect())
+        return self
+
+    def connect(self):
+        connection = FakeSocket(self)
+        self.sockets.append(connection)
+        return connection
+
+    def pause(self, url, resource_type, session_id=f"S-{PAGE_TARGET}"):
+        """最後に接続したクライアントに Fetch.requestPaused を送り、リクエストのIDを返す"""
+        request_id = f"R{next(self.request_ids)}"
+        self.requests[request_id] = "paused"
+        self.sockets[-1].event(
+            "Fetch.requestPaused",
+            {"requestId": request_id, "request": {"url": url}, "resourceType": resource_type},
+            session_id,
+        )
+        return request_id
+
+    def methods(self, session_id=None):
+        """受信したコマンド名（session_id を指定した場合はそのセッションのみ）"""
+        return [method for method, _, sid in self.calls if session_id is None or sid == session_id]
+
+    def handle(self, method, params, session_id, events):
+        """コマンドの結果を返す（イベントは events に追加する）"""
+        self.calls.append((method, params, session_id))
+        if method in self.errors:
+            raise FakeError(self.errors[method])
+        target_id = self.sessions.get(session_id)
+
+        if method == "Target.getTargets":
+            return {
+                "targetInfos": [
+                    {"targetId": tid, "type": info["type"], "url": info["url"]}
+                    for tid, info in self.targets.items()
+                ]
+            }
+        if method == "Target.attachToTarget":
+            session = f"S-{params['targetId']}"
+            self.sessions[session] = params["targetId"]
+            return {"sessionId": session}
+        if method == "Target.setAutoAttach":
+            if target_id == PAGE_TARGET:
+                child = f"S-{FRAME_TARGET}"
+                self.sessions[child] = FRAME_TARGET
+                events.append((
+                    "Target.attachedToTarget",
+                    {"sessionId": child, "targetInfo": {"type": "iframe", "targetId": FRAME_TARGET}},
+                    session_id,
+                ))
+            return {}
+        if method == "Runtime.enable":
+            context = {"id": len(self.calls), "auxData": {"isDefault": True, "frameId": target_id}}
+            events.append(("Runtime.executionContextCreated", {"context": context}, session_id))
+            return {}
+        if method == "Runtime.evaluate":
+            if target_id == FRAME_TARGET:
+                self.evaluations += 1
+                if self.button_after is not None and self.evaluations > self.button_after:
+                    return {"result": {"type": "object", "subtype": "node", "objectId": "button"}}
+            return {"result": {"type": "object", "subtype": "null", "value": None}}
+        if method == "Runtime.callFunctionOn":
+            return {"result": {"type": "object", "value": dict(BUTTON_STATE)}}
+        if method == "DOM.performSearch":
+            return {"searchId": "search", "resultCount": self.search_results}
+        if method == "DOM.getSearchResults":
+            return {"nodeIds": [42]}
+        if method == "DOM.resolveNode":
+            return {"object": {"objectId": "button"}}
+        if method == "DOM.getContentQuads":
+            left, top, right, bottom = BUTTON_RECT
+            return {"quads": [[left, top, right, top, right, bottom, left, bottom]]}
+        if method == "DOM.getFrameOwner":
+            return {"backendNodeId": 7}
+        if method == "DOM.getBoxModel":
+            return {"model": {"content": [*FRAME_OFFSET, 0, 0, 0, 0, 0, 0]}}
+        if method == "Input.dispatchMouseEvent":
+            if params["type"] == "mousePressed":
+                self.clicks.append((params["x"], params["y"], session_id))
+            return {}
+        if method == "Fetch.continueRequest":
+            self.requests[params["requestId"]] = "continued"
+            return {}
+        if method == "Fetch.failRequest":
+            self.requests[params["requestId"]] = "blocked"
+            return {}
+        if method == "Target.createBrowserContext":
+            context_id = f"C{len(self.cookies)}"
+            self.cookies[context_id] = {}
+            return {"browserContextId": context_id}
+        if method == "Target.createTarget":
+            target = f"T{len(self.targets) + 1}"
+            self.targets[target] = {
+                "type": "page",
+                "url": params["url"],
+                "context": params.get("browserContextId", ""),
+            }
+            return {"targetId": target}
+        if method == "Target.disposeBrowserContext":
+            context_id = params["browserContextId"]
+            self.cookies.pop(context_id)
+            self.targets = {
+                tid: info for tid, info in self.targets.items() if info["context"] != context_id
+            }
+            self.disposed.append(context_id)
+            return {}
+        return {}
+
+
+class FakeError(Exception):
+    """エラーの応答を返すコマンド"""
+
+
+class FakeSocket:
+    """websocket-client の WebSocket の代わり（応答とイベントをキューで返す。別スレッドから受信できる）"""
+
+    def __init__(self, chrome):
+        self.chrome = chrome
+        self.queue = queue.Queue()
+        self.timeout = None
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def event(self, method, params, session_id):
+        self.queue.put(json.dumps({"method": method, "params": params, "sessionId": session_id}))
+
+    def send(self, raw):
+        message = json.loads(raw)
+        events = []
+        try:
+            response = {"id": message["id"], "result": self.chrome.handle(
+                message["method"], message.get("params", {}), message.get("sessionId"), events
+            )}
+        except FakeError as e:
+            response = {"id": message["id"], "error": {"code": -32000, "message": str(e)}}
+        # 実際のブラウザと同様に、イベントはコマンドの応答より先に届く
+        for method, params, session_id in events:
+            self.event(method, params, session_id)
+        self.queue.put(json.dumps(response))
+
+    def recv(self):
+        try:
+            return self.queue.get(timeout=self.timeout)
+        except queue.Empty:
+            raise websocket.WebSocketTimeoutException() from None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDriver:
+    """DevTools のアドレスに接続したWebDriverの代わり（タブの切り替えとCookieのみ。ページは読み込めない）"""
+
+    def __init__(self, chrome, target_id=PAGE_TARGET):
+        self.chrome = chrome
+        self.target_id = target_id
+        self.capabilities = {"goog:chromeOptions": {"debuggerAddress": ADDRESS}}
+        self.switch_to = self
+        self.quit_count = 0
+
+    @property
+    def current_window_handle(self):
+        return self.target_id
+
+    @property
+    def current_url(self):
+        return self.chrome.targets[self.target_id]["url"]
+
+    @property
+    def window_handles(self):
+        return list(self.chrome.targets)
+
+    def window(self, handle):
+        self.target_id = handle
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def add_cookie(self, cookie):
+        context_id = self.chrome.targets[self.target_id]["context"]
+        self.chrome.cookies[context_id][cookie["name"]] = cookie["value"]
+
+    def get_cookies(self):
+        context_id = self.chrome.targets[self.target_id]["context"]
+        return [{"name": name, "value": value} for name, value in self.chrome.cookies[context_id].items()]
+
+    def get(self, url):
+        raise RuntimeError(f"net::ERR_CONNECTION_REFUSED ({url})")
+
+    def quit(self):
+        self.quit_count += 1
@@ -0,0 +1,44 @@
+"""テスト共通の設定
+
+main.py と stub_portal.py をリポジトリのルートから読み込み、
+ログ・キャッシュ・スクリーンショットはテストごとの一時ディレクトリに書き込む。
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def log_dir(tmp_path_factory):
+    """ログの出力先（setup_logging はプロセスで1回だけ設定するためセッション単位）"""
+    path = tmp_path_factory.mktemp("base")
+    original = main._base_dir
+    main._base_dir = path
+    yield path
+    main._base_dir = original
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    """SalesforceAutoCheckInOut のベースディレクトリ（config.json.sample を config.json として配置）"""
+    shutil.copy(ROOT / "config.json.sample", tmp_path / "config.json")
+    monkeypatch.setattr(main.SalesforceAutoCheckInOut, "_get_base_dir", lambda self: str(tmp_path))
+    return tmp_path
+
+
+def chrome_available():
+    """ローカルにChrome/Chromiumがインストールされている場合True"""
+    return main.installed_browser_version("chrome") is not None
+
+
+requires_chrome = pytest.mark.skipif(
+    not chrome_available(), reason="Chrome/Chromiumがインストールされていません"
+)
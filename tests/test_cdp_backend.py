@@ -0,0 +1,76 @@
+"""CdpBackend（DevTools Protocol でのボタンの探索とクリック）のテスト"""
+
+import pytest
+
+import cdp_double
+from main import CdpBackend
+
+
+@pytest.fixture
+def chrome(monkeypatch):
+    return cdp_double.FakeChrome().install(monkeypatch)
+
+
+@pytest.fixture
+def backend(chrome):
+    backend = CdpBackend(cdp_double.FakeDriver(chrome), timeout=1)
+    yield backend
+    backend.close()
+
+
+def test_attach_to_page_and_frame(chrome, backend):
+    """操作中のタブにアタッチし、別プロセスのiframeも子セッションとして初期化すること"""
+    assert backend.root == f"S-{cdp_double.PAGE_TARGET}"
+    backend._drain()
+    child = f"S-{cdp_double.FRAME_TARGET}"
+    assert backend.sessions[child] == {"parent": backend.root, "target_id": cdp_double.FRAME_TARGET}
+    assert chrome.methods(child) == ["Runtime.enable", "Target.setAutoAttach"]
+    assert (child, cdp_double.FRAME_TARGET) in backend.contexts
+
+
+def test_find_button_in_frame(chrome, backend):
+    """iframeの実行コンテキストでボタンが表示されるまで待機し、2回目は再利用すること"""
+    chrome.button_after = 2
+    button = backend.find_button("出勤", None, None, timeout=2)
+
+    assert button["element"].session_id == f"S-{cdp_double.FRAME_TARGET}"
+    assert button["frame_path"] == [f"cdp:{cdp_double.FRAME_TARGET}"]
+    assert button["id"] == "btnStInput"
+    assert button["disabled"] is False
+
+    evaluations = chrome.evaluations
+    assert backend.find_button("出勤", None, None, timeout=2)["element"] is button["element"]
+    assert chrome.evaluations == evaluations
+
+
+def test_click_adds_frame_offset(chrome, backend):
+    """iframe内の要素の中心に、iframeの位置を加えた座標でクリックすること"""
+    button = backend.find_button("出勤", None, None, timeout=2)
+    backend.click(button["element"])
+
+    left, top, right, bottom = cdp_double.BUTTON_RECT
+    offset_x, offset_y = cdp_double.FRAME_OFFSET
+    assert chrome.clicks == [((left + right) / 2 + offset_x, (top + bottom) / 2 + offset_y, backend.root)]
+
+
+def test_find_button_falls_back_to_search(chrome, backend):
+    """スクリプトで見つからない場合は DOM.performSearch で探すこと"""
+    chrome.button_after = None
+    chrome.search_results = 1
+    button = backend.find_button("出勤", None, None, timeout=2)
+
+    assert button["element"].object_id == "button"
+    assert "DOM.performSearch" in chrome.methods()
+
+
+@pytest.mark.parametrize("results", [0, 1])
+def test_search_ignores_discard_error(chrome, backend, results):
+    """DOM.discardSearchResults のエラーで探索の結果が失われないこと"""
+    chrome.search_results = results
+    chrome.errors["DOM.discardSearchResults"] = "No search session with given id found"
+    backend._drain()
+
+    element = backend._search('//*[@id="btnStInput"]')
+
+    assert (element is not None) == bool(results)
+    assert "DOM.discardSearchResults" in chrome.methods()
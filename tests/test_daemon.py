@@ -0,0 +1,111 @@
+"""常駐モードへの打刻の受け渡し（request_daemon と main）のテスト"""
+
+import json
+import socket
+import sys
+import threading
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def info_path(tmp_path, monkeypatch):
+    """cache/daemon.json の場所（ベースディレクトリを一時ディレクトリにする）"""
+    monkeypatch.setattr(main, "_base_dir", tmp_path)
+    (tmp_path / "cache").mkdir()
+    return tmp_path / "cache" / "daemon.json"
+
+
+@pytest.fixture
+def local_runs(monkeypatch):
+    """main() がその場で実行した打刻（ブラウザは起動しない）"""
+    runs = []
+
+    class LocalAutomation:
+        def execute(self, action_type, work_location=None):
+            runs.append((action_type, work_location))
+            return True
+
+    monkeypatch.setattr(main, "SalesforceAutoCheckInOut", LocalAutomation)
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    monkeypatch.setattr(sys, "argv", ["main.py", "出勤", "自宅"])
+    return runs
+
+
+@pytest.fixture
+def slow_daemon(info_path):
+    """要求を受け付けたまま応答しない常駐プロセス（打刻中に相当）"""
+    release = threading.Event()
+    received = []
+
+    def handle_request(request):
+        received.append(request["action"])
+        release.wait(10)
+        return {"success": True}
+
+    server = main._DaemonServer(("127.0.0.1", 0), main._DaemonRequestHandler)
+    server.daemon_instance = SimpleNamespace(handle_request=handle_request)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    info_path.write_text(
+        json.dumps({"port": server.server_address[1], "token": "token", "pid": 0}), encoding="utf-8"
+    )
+    yield received
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def unused_port():
+    """接続が拒否されるポート"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_not_running_without_info(info_path):
+    assert main.request_daemon("出勤") is None
+
+
+def test_not_running_with_stale_info(info_path):
+    info_path.write_text(json.dumps({"port": unused_port(), "token": "token"}), encoding="utf-8")
+    assert main.request_daemon("出勤") is None
+
+
+@pytest.mark.parametrize("stale", [False, True])
+def test_falls_back_to_local_punch(info_path, local_runs, stale):
+    """常駐モードが起動していない場合は、その場で打刻すること"""
+    if stale:
+        info_path.write_text(json.dumps({"port": unused_port(), "token": "token"}), encoding="utf-8")
+
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+
+    assert exit_info.value.code == 0
+    assert local_runs == [("出勤", "自宅")]
+
+
+def test_timeout_does_not_fall_back(slow_daemon, local_runs, monkeypatch):
+    """常駐モードが応答しない場合は失敗とし、その場で打刻し直さないこと"""
+    monkeypatch.setattr(main, "request_daemon", partial(main.request_daemon, timeout=0.5))
+
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+
+    assert exit_info.value.code == 1
+    assert slow_daemon == ["出勤"]
+    assert local_runs == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="ファイルのパーミッションはPOSIXのみ")
+def test_info_is_owner_only(tmp_path):
+    """認証トークンを含む daemon.json は所有者のみ読み書きできること"""
+    automation = SimpleNamespace(config={}, cache_dir=tmp_path / "cache")
+    daemon = main.CheckInOutDaemon(automation)
+    daemon._write_info(12345)
+
+    assert daemon.info_path.stat().st_mode & 0o777 == 0o600
+    assert json.loads(daemon.info_path.read_text(encoding="utf-8"))["token"] == daemon.token
@@ -0,0 +1,83 @@
+"""軽量モードのリクエストの振り分け（LeanRequestFilter）のテスト"""
+
+import time
+
+import pytest
+
+import cdp_double
+import stub_portal
+from main import _LEAN_DEFAULTS, LeanRequestFilter, lean_request_allowed, lean_request_patterns
+
+APP_URL = f"http://{stub_portal.APP_HOST}:8080"
+
+
+def wait_until(condition, timeout=5):
+    """condition() が真になるまで待機"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            pytest.fail("タイムアウトしました")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def chrome(monkeypatch):
+    return cdp_double.FakeChrome().install(monkeypatch)
+
+
+@pytest.fixture
+def lean_filter(chrome):
+    lean_filter = LeanRequestFilter(cdp_double.FakeDriver(chrome), _LEAN_DEFAULTS, timeout=1)
+    yield lean_filter
+    lean_filter.close()
+
+
+def test_request_patterns():
+    """リソース種別はURLにかかわらず、block_url_patterns はURLで一時停止すること"""
+    patterns = lean_request_patterns(_LEAN_DEFAULTS)
+
+    assert {"urlPattern": "*", "resourceType": "Font", "requestStage": "Request"} in patterns
+    assert {"urlPattern": "*://*.doubleclick.net/*", "requestStage": "Request"} in patterns
+
+
+@pytest.mark.parametrize(
+    "url, allowed",
+    [
+        (APP_URL + stub_portal.TEAMSPIRIT_ASSET, True),
+        ("https://example--c.vf.force.com/resource/1/fonts/pw.woff2", True),
+        ("https://example.my.salesforce.com/resource/teamspirit/logo.png", True),
+        (APP_URL + stub_portal.LIGHTNING_ASSET, False),
+        ("https://www.google-analytics.com/analytics.js", False),
+    ],
+)
+def test_request_allowed(url, allowed):
+    assert lean_request_allowed(url, _LEAN_DEFAULTS) is allowed
+
+
+def test_filter_enables_fetch_in_page_and_frame(chrome, lean_filter):
+    """タブと別プロセスのiframeの両方でリクエストを一時停止すること"""
+    frame = f"S-{cdp_double.FRAME_TARGET}"
+    wait_until(lambda: "Fetch.enable" in chrome.methods(frame))
+
+    enabled = [params for method, params, _ in chrome.calls if method == "Fetch.enable"]
+    assert enabled[0]["patterns"] == lean_request_patterns(_LEAN_DEFAULTS)
+    assert "Fetch.enable" in chrome.methods(lean_filter.root)
+
+
+@pytest.mark.parametrize("session_id", [f"S-{cdp_double.PAGE_TARGET}", f"S-{cdp_double.FRAME_TARGET}"])
+def test_filter_continues_allowed_assets(chrome, lean_filter, session_id):
+    """TeamSpiritの画像は続行し、Lightningの画像はブロックすること"""
+    allowed = chrome.pause(APP_URL + stub_portal.TEAMSPIRIT_ASSET, "Image", session_id)
+    blocked = chrome.pause(APP_URL + stub_portal.LIGHTNING_ASSET, "Image", session_id)
+
+    wait_until(lambda: "paused" not in chrome.requests.values())
+    assert chrome.requests == {allowed: "continued", blocked: "blocked"}
+    failed = [params for method, params, _ in chrome.calls if method == "Fetch.failRequest"]
+    assert failed == [{"requestId": blocked, "errorReason": "BlockedByClient"}]
+
+
+def test_close_stops_filter(chrome, lean_filter):
+    lean_filter.close()
+
+    assert not lean_filter.thread.is_alive()
+    assert chrome.sockets[-1].closed
@@ -0,0 +1,62 @@
+"""ボタンの探索戦略チェーン（_find_button_in_frames）のテスト"""
+
+import time
+
+from selenium.common.exceptions import StaleElementReferenceException
+
+import main
+from main import _DEEP_LOCATOR_JS, _DEFAULT_LOCATOR_STRATEGIES, _FRAME_AT_JS, SalesforceAutoCheckInOut
+
+
+class FramesDriver:
+    """クロスオリジンのiframeが2つあるページ（1つ目は探索中に古くなる）"""
+
+    def __init__(self):
+        self.current = None
+        self.switch_to = self
+
+    def default_content(self):
+        self.current = None
+
+    def frame(self, iframe):
+        self.current = iframe
+
+    def execute_script(self, script, *args):
+        if script == _FRAME_AT_JS:
+            return f"frame{args[0]}"
+        assert script == _DEEP_LOCATOR_JS
+        if self.current is None:
+            return {"found": False, "opaque": [{"path": [0]}, {"path": [1]}]}
+        if self.current == "frame0":
+            raise StaleElementReferenceException("stale element reference: element is not attached")
+        return {
+            "found": True,
+            "path": [],
+            "element": "button",
+            "id": "btnStInput",
+            "value": "出勤",
+            "disabled": False,
+        }
+
+
+def test_returns_early_without_runnable_strategy(base_dir):
+    """両方のボタンを探す場合に deep 戦略がなければ、button_timeout まで待たずに終了すること"""
+    strategies = [strategy for strategy in _DEFAULT_LOCATOR_STRATEGIES if not strategy.get("deep")]
+    automation = SalesforceAutoCheckInOut(
+        "config.json", {"locator_strategies": strategies, "button_timeout": 5}
+    )
+
+    start = time.monotonic()
+    assert automation._find_button_in_frames(None, None) is None
+    assert time.monotonic() - start < 1
+
+
+def test_deep_search_skips_stale_frame(base_dir):
+    """探索中に古くなったフレームは飛ばし、次のフレームでボタンを見つけること"""
+    automation = SalesforceAutoCheckInOut("config.json")
+    automation.driver = FramesDriver()
+
+    button = automation._locate_button_deep(main.By.ID, "btnStInput", "出勤")
+
+    assert button["frame_path"] == [1]
+    assert button["element"] == "button"
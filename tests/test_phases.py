@@ -0,0 +1,186 @@
+"""打刻の段階の再試行（_run_phases）のテスト
+
+各段階をスクリプトどおりに成功・失敗させ、段階ごとの再試行の回数と、
+再読み込み → 起動し直しの順にやり直すこと、二重にクリックしないことを確認する。
+"""
+
+import pytest
+
+from main import _PUNCH_PHASES, PunchPhaseError, SalesforceAutoCheckInOut
+
+FULL_RUN = ["driver", "login", "widget", "http", "location", "verify", "click", "confirm"]
+RELOADED_RUN = ["widget", "http", "location", "verify", "click", "confirm"]
+
+
+class ScriptedDriver:
+    """起動したブラウザの代わり（再読み込みの回数を記録）"""
+
+    def __init__(self):
+        self.alive = True
+        self.refreshes = 0
+        self.quit_count = 0
+
+    @property
+    def current_url(self):
+        if not self.alive:
+            raise ConnectionError("ブラウザが応答しません")
+        return "https://example.lightning.force.com/"
+
+    def refresh(self):
+        self.refreshes += 1
+
+    def quit(self):
+        self.quit_count += 1
+
+
+@pytest.fixture
+def automation(base_dir, monkeypatch):
+    """各段階を automation.script の結果（例外または戻り値）の順に実行する
+
+    結果が関数の場合は呼び出した戻り値を使う。スクリプトがない段階は成功する
+    （打刻の確認は True、それ以外は None を返す）。
+    """
+    automation = SalesforceAutoCheckInOut(
+        "config.json", {"recovery": {"reloads": 1, "relaunches": 1, "retry_delay": 0}}
+    )
+    automation.calls = []
+    automation.script = {}
+    automation.drivers = []
+
+    def scripted(phase):
+        def run_phase(state):
+            automation.calls.append(phase)
+            outcomes = automation.script.get(phase)
+            outcome = outcomes.pop(0) if outcomes else (True if phase == "confirm" else None)
+            if callable(outcome):
+                outcome = outcome()
+            if isinstance(outcome, Exception):
+                raise outcome
+            if phase == "driver":
+                automation.driver = ScriptedDriver()
+                automation.drivers.append(automation.driver)
+            return outcome
+
+        return run_phase
+
+    for phase in _PUNCH_PHASES:
+        monkeypatch.setattr(automation, f"_phase_{phase}", scripted(phase))
+    return automation
+
+
+def run(automation):
+    return automation._run_phases("出勤", "自宅")
+
+
+def refreshes(automation):
+    return sum(driver.refreshes for driver in automation.drivers)
+
+
+def test_all_phases_run_once(automation):
+    assert run(automation) == (True, None)
+    assert automation.calls == FULL_RUN
+
+
+def test_widget_failure_is_skipped(automation):
+    """ウィジェットの段階は再試行せず、警告のみで次の段階へ進むこと"""
+    automation.script["widget"] = [PunchPhaseError("ウィジェットが表示されません")]
+
+    assert run(automation) == (True, None)
+    assert automation.calls == FULL_RUN
+    assert refreshes(automation) == 0
+
+
+def test_widget_retries_from_config(automation):
+    """recovery.phases で指定した回数だけ、同じページで再試行すること"""
+    automation.config["recovery"]["phases"] = {"widget": {"retries": 2}}
+    automation.script["widget"] = [PunchPhaseError("ウィジェットが表示されません")] * 2
+
+    assert run(automation) == (True, None)
+    assert automation.calls.count("widget") == 3
+    assert automation.calls.count("click") == 1
+    assert refreshes(automation) == 0
+
+
+def test_driver_retried_without_browser(automation):
+    """ブラウザの起動は、ブラウザがない状態でも再試行すること"""
+    automation.script["driver"] = [PunchPhaseError("ブラウザを起動できません")]
+
+    assert run(automation) == (True, None)
+    assert automation.calls == ["driver"] + FULL_RUN
+
+
+def test_fatal_error_is_not_retried(automation):
+    automation.script["login"] = [PunchPhaseError("ログインが拒否されました", fatal=True)]
+
+    assert run(automation) == (False, "login")
+    assert automation.calls == ["driver", "login"]
+
+
+def test_verify_failure_reloads_page(automation):
+    """打刻の状態の確認に失敗した場合は、再読み込みしてウィジェットの待機からやり直すこと"""
+    automation.script["verify"] = [PunchPhaseError("ボタンが見つかりません")]
+
+    assert run(automation) == (True, None)
+    assert automation.calls == FULL_RUN[:6] + RELOADED_RUN
+    assert refreshes(automation) == 1
+    assert len(automation.drivers) == 1
+
+
+def test_verify_failure_relaunches_after_reload(automation):
+    """再読み込みしても失敗した場合は、ブラウザを起動し直して最初からやり直すこと"""
+    automation.script["verify"] = [PunchPhaseError("ボタンが見つかりません")] * 2
+
+    assert run(automation) == (True, None)
+    assert automation.calls == FULL_RUN[:6] + RELOADED_RUN[:4] + FULL_RUN
+    assert refreshes(automation) == 1
+    assert len(automation.drivers) == 2
+    assert automation.drivers[0].quit_count == 1
+
+
+def test_gives_up_after_relaunch(automation):
+    automation.script["verify"] = [PunchPhaseError("ボタンが見つかりません")] * 3
+
+    assert run(automation) == (False, "verify")
+    assert automation.calls.count("verify") == 3
+    assert "click" not in automation.calls
+
+
+@pytest.mark.parametrize("retries", [None, 3])
+def test_click_failure_verifies_before_clicking_again(automation, retries):
+    """クリックは設定にかかわらず同じページで再試行せず、再読み込み後に打刻済みなら終了すること"""
+    if retries is not None:
+        automation.config["recovery"]["phases"] = {"click": {"retries": retries, "required": False}}
+    automation.script["click"] = [PunchPhaseError("出勤ボタンをクリックできませんでした")]
+    automation.script["verify"] = [None, "already_done"]
+
+    assert run(automation) == ("already_done", None)
+    assert automation.calls == FULL_RUN[:7] + RELOADED_RUN[:4]
+    assert automation.calls.count("click") == 1
+    assert refreshes(automation) == 1
+
+
+def test_confirm_failure_verifies_before_clicking_again(automation):
+    """打刻を確認できない場合は、再読み込みして打刻の状態を確認し、打刻済みならクリックしないこと"""
+    automation.script["confirm"] = [PunchPhaseError("出勤の打刻を確認できませんでした")]
+    automation.script["verify"] = [None, "already_done"]
+
+    assert run(automation) == ("already_done", None)
+    assert automation.calls == FULL_RUN + RELOADED_RUN[:4]
+    assert automation.calls.count("click") == 1
+
+
+def test_confirm_failure_with_dead_browser_relaunches(automation):
+    """ブラウザが応答しない場合は再読み込みを省略し、起動し直してから打刻の状態を確認すること"""
+
+    def browser_crashed():
+        automation.driver.alive = False
+        return PunchPhaseError("出勤の打刻を確認できませんでした")
+
+    automation.script["confirm"] = [browser_crashed]
+    automation.script["verify"] = [None, "already_done"]
+
+    assert run(automation) == ("already_done", None)
+    assert automation.calls == FULL_RUN + FULL_RUN[:6]
+    assert automation.calls.count("click") == 1
+    assert refreshes(automation) == 0
+    assert automation.drivers[0].quit_count == 1
@@ -0,0 +1,62 @@
+"""setup_driver（ブラウザの自動選択と起動後の設定）のテスト"""
+
+import pytest
+
+from main import SalesforceAutoCheckInOut
+
+
+class LaunchedDriver:
+    """起動したブラウザの代わり"""
+
+    def __init__(self):
+        self.quit_count = 0
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def quit(self):
+        self.quit_count += 1
+
+
+@pytest.fixture
+def automation(base_dir, monkeypatch):
+    """Chrome・Edgeの起動を置き換え（ドライバーは cache/ 内のパスで起動したことにする）"""
+    automation = SalesforceAutoCheckInOut("config.json", {"browser": "auto"})
+    drivers = {}
+
+    def setup(browser):
+        def launch():
+            automation.driver_path = str(base_dir / "cache" / f"{browser}driver")
+            drivers[browser] = LaunchedDriver()
+            return drivers[browser]
+
+        return launch
+
+    monkeypatch.setattr(automation, "_setup_chrome", setup("chrome"))
+    monkeypatch.setattr(automation, "_setup_edge", setup("edge"))
+    automation.drivers = drivers
+    return automation
+
+
+def test_remembers_browser_after_setup(automation):
+    automation.setup_driver()
+
+    assert automation.driver is automation.drivers["chrome"]
+    assert automation.driver_cache.working_browser() == "chrome"
+
+
+def test_failed_setup_is_not_remembered(automation, monkeypatch):
+    """起動後の設定に失敗したブラウザは閉じ、前回起動に成功したブラウザとして記録しないこと"""
+    prepare = SalesforceAutoCheckInOut._prepare_driver
+
+    def prepare_driver(self, browser):
+        if browser == "chrome":
+            raise RuntimeError("DevToolsに接続できません")
+        prepare(self, browser)
+
+    monkeypatch.setattr(SalesforceAutoCheckInOut, "_prepare_driver", prepare_driver)
+    automation.setup_driver()
+
+    assert automation.drivers["chrome"].quit_count == 1
+    assert automation.driver is automation.drivers["edge"]
+    assert automation.driver_cache.working_browser() == "edge"
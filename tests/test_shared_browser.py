@@ -0,0 +1,74 @@
+"""SharedBrowser（ブラウザコンテキストで分離した共有ブラウザ）のテスト"""
+
+import json
+
+import pytest
+
+import cdp_double
+import main
+from main import SalesforceAutoCheckInOut, SharedBrowser
+
+
+@pytest.fixture
+def chrome(base_dir, monkeypatch):
+    """Chromeの起動と、起動済みのブラウザへの接続をテストダブルに置き換える"""
+    chrome = cdp_double.FakeChrome().install(monkeypatch)
+    monkeypatch.setattr(
+        SalesforceAutoCheckInOut, "_setup_chrome", lambda self: cdp_double.FakeDriver(chrome)
+    )
+    monkeypatch.setattr(
+        SalesforceAutoCheckInOut,
+        "_attach_to_browser",
+        lambda self, browser, address: cdp_double.FakeDriver(chrome),
+    )
+    return chrome
+
+
+@pytest.fixture
+def shared(chrome):
+    shared = SharedBrowser("config.json", sample_interval=60)
+    yield shared
+    shared.close()
+
+
+def test_contexts_isolate_cookies(chrome, shared):
+    """ユーザーごとに別のブラウザコンテキストのタブを操作し、Cookieが共有されないこと"""
+    driver_a, context_a = shared.open(SalesforceAutoCheckInOut("config.json"))
+    driver_b, context_b = shared.open(SalesforceAutoCheckInOut("config.json"))
+
+    assert context_a != context_b
+    assert chrome.targets[driver_a.current_window_handle]["context"] == context_a
+    assert chrome.targets[driver_b.current_window_handle]["context"] == context_b
+
+    driver_a.add_cookie({"name": "sid", "value": "user-a"})
+    assert driver_b.get_cookies() == []
+    driver_b.add_cookie({"name": "sid", "value": "user-b"})
+    assert driver_a.get_cookies() == [{"name": "sid", "value": "user-a"}]
+
+    shared.close_context(context_a)
+    shared.close_context(context_b)
+    assert chrome.disposed == [context_a, context_b]
+    assert shared.active == 0
+
+
+def test_context_disposed_when_user_fails(base_dir, chrome, shared):
+    """ユーザーの処理が失敗した場合も、作成したブラウザコンテキストをすべて破棄すること"""
+    config = json.loads((base_dir / "config.json").read_text(encoding="utf-8"))
+    config["recovery"]["retry_delay"] = 0
+    (base_dir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    entry = {
+        "username": "user@example.com",
+        "password": "password",
+        "action": "出勤",
+        "work_location": None,
+    }
+
+    result = main._run_batch_entry(entry, "config.json", shared_browser=shared)
+
+    assert result["success"] is False
+    # 再起動の段階で作り直したコンテキストも含め、作成したものはすべて破棄されている
+    created = chrome.methods().count("Target.createBrowserContext")
+    assert created == 1 + config["recovery"]["relaunches"]
+    assert len(chrome.disposed) == created
+    assert set(chrome.cookies) == {""}
+    assert shared.active == 0
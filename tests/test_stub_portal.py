@@ -0,0 +1,151 @@
+"""stub_portal.py のスタブに対する打刻のテスト"""
+
+from collections import Counter
+
+import pytest
+
+import stub_portal
+from conftest import requires_chrome
+from main import _PUNCH_PHASES, PunchPhaseError, SalesforceAutoCheckInOut
+
+
+@pytest.fixture
+def portal():
+    """スタブを起動（テストの終了時に停止）"""
+    server = stub_portal.start_stub_portal()
+    yield server
+    server.shutdown()
+
+
+def stub_overrides(portal, **settings):
+    """スタブにヘッドレスのChromeでログインする設定（ブラウザでクリックする）"""
+    return {
+        "salesforce_url": f"http://{stub_portal.LOGIN_HOST}:{portal.server_address[1]}/",
+        "username": stub_portal.STUB_USERNAME,
+        "password": stub_portal.STUB_PASSWORD,
+        "browser": "chrome",
+        "headless": True,
+        "auto_close": True,
+        "user_data_dir": "",
+        "http_punch": {"enabled": False},
+        **settings,
+    }
+
+
+def count_phases(monkeypatch):
+    """段階ごとの実行回数（失敗した回も含む）を数える"""
+    counts = Counter()
+
+    def counted(phase, run_phase):
+        def run(self, state):
+            counts[phase] += 1
+            return run_phase(self, state)
+
+        return run
+
+    for phase in _PUNCH_PHASES:
+        name = f"_phase_{phase}"
+        monkeypatch.setattr(SalesforceAutoCheckInOut, name, counted(phase, getattr(SalesforceAutoCheckInOut, name)))
+    return counts
+
+
+def fail_first(monkeypatch, name, after=False):
+    """メソッドの最初の呼び出しを失敗させる（after=True の場合は実行してから失敗させる）"""
+    method = getattr(SalesforceAutoCheckInOut, name)
+    calls = []
+
+    def fail_once(self, *args):
+        calls.append(args)
+        if len(calls) > 1:
+            return method(self, *args)
+        if after:
+            method(self, *args)
+        raise PunchPhaseError(f"{name} を失敗させました")
+
+    monkeypatch.setattr(SalesforceAutoCheckInOut, name, fail_once)
+
+
+def test_check_http_punch():
+    """python stub_portal.py --check-http-punch と同じ確認"""
+    assert stub_portal.check_http_punch()
+
+
+@requires_chrome
+@pytest.mark.parametrize("backend", ["selenium", "cdp"])
+def test_check_in_and_out(base_dir, portal, backend, monkeypatch):
+    """ログイン → ボタンの探索 → 打刻をヘッドレスのChromeで実行し、スタブに記録されること"""
+    attached = []
+    attach = SalesforceAutoCheckInOut._attach_cdp_backend
+
+    def record_backend(self):
+        attach(self)
+        attached.append("cdp" if self.cdp else "selenium")
+
+    def drop_backend(self, error):
+        pytest.fail(f"DevToolsでの操作に失敗しました: {error}")
+
+    monkeypatch.setattr(SalesforceAutoCheckInOut, "_attach_cdp_backend", record_backend)
+    monkeypatch.setattr(SalesforceAutoCheckInOut, "_drop_cdp_backend", drop_backend)
+    overrides = stub_overrides(portal, driver_backend=backend)
+
+    for action in ("出勤", "退勤"):
+        automation = SalesforceAutoCheckInOut("config.json", overrides)
+        assert automation.execute(action, "自宅")
+
+    assert attached == [backend, backend]
+    assert portal.portal.punches == [
+        {"action": "出勤", "work_location": "自宅"},
+        {"action": "退勤", "work_location": "自宅"},
+    ]
+
+
+@requires_chrome
+def test_lean_mode_keeps_teamspirit_assets(base_dir, portal):
+    """軽量モードでも、許可リストに一致するTeamSpiritの画像はブロックしないこと"""
+    automation = SalesforceAutoCheckInOut("config.json", stub_overrides(portal, lean_mode={"enabled": True}))
+    assert automation.execute("出勤", "自宅")
+
+    assert stub_portal.TEAMSPIRIT_ASSET in portal.portal.assets
+    assert stub_portal.LIGHTNING_ASSET not in portal.portal.assets
+    assert portal.portal.punches == [{"action": "出勤", "work_location": "自宅"}]
+
+
+@requires_chrome
+def test_widget_failure_retried_in_place(base_dir, portal, monkeypatch):
+    """ウィジェットの段階は recovery.phases の回数だけ同じページで再試行し、再読み込みしないこと"""
+    fail_first(monkeypatch, "_phase_widget")
+    counts = count_phases(monkeypatch)
+    recovery = {"reloads": 1, "relaunches": 1, "retry_delay": 0, "phases": {"widget": {"retries": 1}}}
+    automation = SalesforceAutoCheckInOut("config.json", stub_overrides(portal, recovery=recovery))
+
+    assert automation.execute("出勤", "自宅")
+    assert counts == {**dict.fromkeys(_PUNCH_PHASES, 1), "widget": 2}
+    assert portal.portal.punches == [{"action": "出勤", "work_location": "自宅"}]
+
+
+@requires_chrome
+def test_verify_failure_reloads_page(base_dir, portal, monkeypatch):
+    """打刻の状態の確認に失敗した場合は、再読み込みしてウィジェットの待機からやり直すこと"""
+    fail_first(monkeypatch, "_phase_verify")
+    counts = count_phases(monkeypatch)
+    recovery = {"reloads": 1, "relaunches": 1, "retry_delay": 0}
+    automation = SalesforceAutoCheckInOut("config.json", stub_overrides(portal, recovery=recovery))
+
+    assert automation.execute("出勤", "自宅")
+    assert counts == {**dict.fromkeys(_PUNCH_PHASES, 1), "widget": 2, "http": 2, "location": 2, "verify": 2}
+    assert portal.portal.punches == [{"action": "出勤", "work_location": "自宅"}]
+
+
+@requires_chrome
+@pytest.mark.parametrize("failing", ["_click_button", "_confirm_punch"])
+def test_click_recorded_but_failed_is_not_clicked_again(base_dir, portal, monkeypatch, failing):
+    """打刻が記録された後にクリック・確認が失敗しても、再読み込み後の確認で打刻済みとして終了すること"""
+    fail_first(monkeypatch, failing, after=True)
+    counts = count_phases(monkeypatch)
+    recovery = {"reloads": 1, "relaunches": 1, "retry_delay": 0, "phases": {"click": {"retries": 3}}}
+    automation = SalesforceAutoCheckInOut("config.json", stub_overrides(portal, recovery=recovery))
+
+    assert automation.execute("出勤", "自宅")
+    assert counts["click"] == 1
+    assert counts["verify"] == 2
+    assert portal.portal.punches == [{"action": "出勤", "work_location": "自宅"}]